@@ -0,0 +1,172 @@
+"""
+Benchmark the authenticated request path.
+
+Measures throughput and p50/p99 latency of authenticating one request, from the
+identity cookie to the user object, for every backend and session mode. Each
+request has `--consumers` consumers of its identity, as a view using both
+`@protected` and the `User` dependency has two:
+
+- per_consumer: every consumer resolves the cookie, session and user itself,
+  as they did before identities were request-scoped.
+- request_scoped: consumers share one resolution through `get_identity`.
+
+The app modules are imported, so run it from a checkout with a configured core/.env.
+
+Usage:
+    python -m benchmarks.auth_path [--backends system,sqlite,shared_memory]
+        [--modes stateful,stateless] [--consumers 2] [--users 1000]
+        [--concurrency 1,16,64] [--requests N] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import uuid
+from types import SimpleNamespace
+
+import jwt
+
+from benchmarks.cache_storage import parse_list, run_concurrently, summarise
+from core.authentication import get_user, resolve_identity
+from core.cache import CacheManager
+from core.sessions import SessionManager
+
+COOKIE_IDENTITY = 'identity'
+COOKIE_SECRET = 'bench-secret'
+
+class BenchUser:
+    """
+    A stand-in for the `User` model, cached like it and without a database behind it.
+    """
+    def __init__(self):
+        self.uuid = uuid.uuid4()
+        self.username = 'bench'
+        self.is_email_verified = True
+        self.max_sessions = 10
+
+class BenchEnv:
+    def __init__(self, values: dict):
+        self.values = values
+
+    def get(self, key: str):
+        return self.values.get(key)
+
+class BenchRequest:
+    """
+    The parts of a Sanic request used by the authentication path.
+    """
+    def __init__(self, app, cookies: dict):
+        self.app = app
+        self.ctx = SimpleNamespace()
+        self.cookies = cookies
+
+def connector_kwargs(backend: str, workdir: str) -> dict:
+    if backend == 'sqlite':
+        return {'db_path': os.path.join(workdir, 'auth.db')}
+    if backend == 'shared_memory':
+        return {'directory': workdir}
+    if backend == 'system':
+        return {}
+    raise ValueError('Invalid backend: {}'.format(backend))
+
+async def bench_case(backend: str, mode: str, concurrency: int, args) -> list[dict]:
+    """
+    Benchmark both strategies of one backend, session mode and concurrency level.
+    """
+    workdir = tempfile.mkdtemp(prefix='cascade-bench-')
+    kwargs = connector_kwargs(backend, workdir)
+    session_manager = SessionManager(backend, mode=mode, **kwargs)
+    cache_manager = CacheManager(backend, **kwargs)
+    await session_manager.__async__init__()
+    await cache_manager.__async__init__()
+    app = SimpleNamespace(ctx=SimpleNamespace(
+        env_manager=BenchEnv({'COOKIE_IDENTITY': COOKIE_IDENTITY, 'COOKIE_SECRET': COOKIE_SECRET, 'SESSION_TTL': 3600}),
+        session_manager=session_manager,
+        cache_manager=cache_manager,
+    ))
+    case = {
+        'backend': backend,
+        'mode': mode,
+        'consumers': args.consumers,
+        'concurrency': concurrency,
+    }
+    rows = []
+    try:
+        cookies = []
+        for _ in range(args.users):
+            user = BenchUser()
+            await cache_manager.add(user)
+            session_id = session_manager.gen_session_id()
+            await session_manager.add(session_id, user.uuid, '127.0.0.1', False, ttl=3600)
+            value = await session_manager.cookie_value(session_id, user.uuid, False)
+            cookies.append({COOKIE_IDENTITY: jwt.encode(value, COOKIE_SECRET, algorithm='HS256')})
+        sample = [random.choice(cookies) for _ in range(args.requests)]
+
+        async def per_consumer(cookie):
+            request = BenchRequest(app, cookie)
+            for _ in range(args.consumers):
+                await resolve_identity(request)
+
+        async def request_scoped(cookie):
+            request = BenchRequest(app, cookie)
+            for _ in range(args.consumers):
+                await get_user(request)
+
+        for strategy, operation in (('per_consumer', per_consumer), ('request_scoped', request_scoped)):
+            latencies, elapsed = await run_concurrently(operation, sample, concurrency)
+            rows.append({**case, **summarise(strategy, latencies, elapsed)})
+    finally:
+        await session_manager.close()
+        await cache_manager.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return rows
+
+async def run(args) -> dict:
+    results = []
+    for backend in args.backends:
+        for mode in args.modes:
+            for concurrency in args.concurrency:
+                rows = await bench_case(backend, mode, concurrency, args)
+                results.extend(rows)
+                for row in rows:
+                    print(json.dumps(row), file=sys.stderr)
+
+    return {
+        'meta': {
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'requests': args.requests,
+            'users': args.users,
+        },
+        'results': results,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', type=lambda value: parse_list(value, str), default=['system', 'sqlite', 'shared_memory'])
+    parser.add_argument('--modes', type=lambda value: parse_list(value, str), default=['stateful', 'stateless'])
+    parser.add_argument('--consumers', type=int, default=2, help='Consumers of the identity per request')
+    parser.add_argument('--users', type=int, default=1000, help='Users, each with one session')
+    parser.add_argument('--concurrency', type=parse_list, default=[1, 16, 64])
+    parser.add_argument('--requests', type=int, default=10000, help='Requests timed per strategy and case')
+    parser.add_argument('--output', default=None, help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
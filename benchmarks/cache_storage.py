@@ -0,0 +1,351 @@
+"""
+Benchmark the cache storage connectors.
+
+Measures throughput and p50/p99 latency of get, set, delete, clear_expired and
+get_all_values for every backend, key count, value size and concurrency level,
+and writes the results as JSON.
+
+Redis and Memcached run against in-process fakes unless a URL is given, so the
+fake numbers show the connector overhead without the network round trip.
+
+Usage:
+    python -m benchmarks.cache_storage [--backends sqlite,system,shared_memory,redis,memcached]
+        [--keys 1000,100000,1000000] [--value-sizes 64,1024,16384] [--concurrency 1,16,64]
+        [--ops N] [--redis-url URL] [--memcached-url URL] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+INSTANCE_NAME = 'bench'
+POPULATE_BATCH_SIZE = 1000
+
+class FakeRedis:
+    """
+    An in-process stand-in for the subset of the aioredis client used by `RedisConnector`.
+    """
+    def __init__(self):
+        self.data = {}
+
+    def _get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def _set(self, key, value, ex=None):
+        self.data[key] = (value, time.monotonic() + ex if ex else None)
+
+    async def get(self, key):
+        return self._get(key)
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and self._get(key) is not None:
+            return None
+        self._set(key, value, ex)
+        return True
+
+    async def setex(self, key, ttl, value):
+        self._set(key, value, ttl)
+
+    async def mget(self, keys):
+        return [self._get(key) for key in keys]
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def scan(self, cursor, match=None, count=10):
+        keys = list(self.data)
+        page = keys[cursor:cursor + count]
+        next_cursor = cursor + count if cursor + count < len(keys) else 0
+        return next_cursor, [key for key in page if match is None or fnmatch.fnmatchcase(key, match)]
+
+    async def eval(self, script, numkeys, key, token):
+        if self._get(key) == token:
+            return await self.delete(key)
+        return 0
+
+    async def publish(self, channel, message):
+        return 0
+
+    def pipeline(self, transaction=True):
+        return FakeRedisPipeline(self)
+
+    async def close(self):
+        pass
+
+class FakeRedisPipeline:
+    """
+    Buffers commands and runs them against a `FakeRedis` on execute.
+    """
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value, ex))
+        return self
+
+    async def execute(self):
+        for key, value, ex in self.commands:
+            self.redis._set(key, value, ex)
+        self.commands.clear()
+
+class FakeMemcached:
+    """
+    An in-process stand-in for the subset of the aiomcache client used by `MemcachedConnector`.
+    """
+    def __init__(self):
+        self.data = {}
+
+    def _get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    async def get(self, key):
+        return self._get(key)
+
+    async def multi_get(self, *keys):
+        return tuple(self._get(key) for key in keys)
+
+    async def set(self, key, value, exptime=0):
+        self.data[key] = (value, time.monotonic() + exptime if exptime else None)
+        return True
+
+    async def add(self, key, value, exptime=0):
+        if self._get(key) is not None:
+            return False
+        return await self.set(key, value, exptime)
+
+    async def delete(self, key):
+        return self.data.pop(key, None) is not None
+
+    async def close(self):
+        pass
+
+async def create_connector(backend: str, args, workdir: str, key_count: int, value_size: int):
+    """
+    Build and initialise a connector for the backend, sized for the case where it needs to be.
+
+    Returns:
+        tuple: The connector and a label saying whether it runs against a fake.
+    """
+    if backend == 'sqlite':
+        from core.cache_storage.connectors.sqlite import SQLiteConnector
+        connector = SQLiteConnector(os.path.join(workdir, f'{INSTANCE_NAME}.db'))
+        await connector.__async__init__(INSTANCE_NAME)
+        return connector, 'local'
+
+    if backend == 'system':
+        from core.cache_storage.connectors.system import SystemConnector
+        connector = SystemConnector()
+        await connector.__async__init__(INSTANCE_NAME)
+        return connector, 'local'
+
+    if backend == 'shared_memory':
+        from core.cache_storage.connectors.shared_memory import SharedMemoryConnector
+        # Room for the keys and the expired entries, with slack so buckets rarely fill up
+        connector = SharedMemoryConnector(
+            workdir,
+            max_entries=key_count * 2,
+            arena_bytes=int(key_count * 1.2 * (value_size + 1024)) if value_size > 256 else 1024,
+        )
+        await connector.__async__init__(INSTANCE_NAME)
+        return connector, 'local'
+
+    if backend == 'redis':
+        from core.cache_storage.connectors.redis import RedisConnector
+        connector = RedisConnector(args.redis_url or 'redis://fake')
+        if args.redis_url:
+            await connector.__async__init__(INSTANCE_NAME)
+            return connector, 'server'
+        connector.conn = FakeRedis()
+        return connector, 'fake'
+
+    if backend == 'memcached':
+        from core.cache_storage.connectors.memcached import MemcachedConnector
+        connector = MemcachedConnector(args.memcached_url or 'fake')
+        if args.memcached_url:
+            await connector.__async__init__(INSTANCE_NAME)
+            return connector, 'server'
+        connector.client = FakeMemcached()
+        return connector, 'fake'
+
+    raise ValueError('Invalid backend: {}'.format(backend))
+
+def summarise(op: str, latencies: list, elapsed: float) -> dict:
+    """
+    Turn per-operation latencies into a result row.
+    """
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'op': op,
+        'ops': count,
+        'seconds': elapsed,
+        'throughput': count / elapsed if elapsed else None,
+        'p50_ms': latencies[int(0.50 * (count - 1))] * 1e3 if count else None,
+        'p99_ms': latencies[int(0.99 * (count - 1))] * 1e3 if count else None,
+    }
+
+async def run_concurrently(operation, keys: list, concurrency: int) -> tuple:
+    """
+    Run the operation once per key from `concurrency` workers sharing the key list.
+
+    Returns:
+        tuple: The per-operation latencies and the elapsed wall time.
+    """
+    latencies = []
+    pending = iter(keys)
+
+    async def worker():
+        for key in pending:
+            started = time.perf_counter()
+            await operation(key)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+async def populate(connector, count: int, value: bytes, ttl=None, prefix: str = 'key') -> list:
+    """
+    Fill the instance with `count` keys through `set_many`.
+    """
+    keys = [f'{prefix}:{i}' for i in range(count)]
+    for i in range(0, count, POPULATE_BATCH_SIZE):
+        await connector.set_many(INSTANCE_NAME, {key: value for key in keys[i:i + POPULATE_BATCH_SIZE]}, ttl)
+    return keys
+
+async def bench_case(backend: str, key_count: int, value_size: int, concurrency: int, args) -> list[dict]:
+    """
+    Benchmark every operation of one backend for one key count, value size and concurrency level.
+    """
+    workdir = tempfile.mkdtemp(prefix='cascade-bench-')
+    connector, mode = await create_connector(backend, args, workdir, key_count, value_size)
+    case = {
+        'backend': backend,
+        'mode': mode,
+        'keys': key_count,
+        'value_size': value_size,
+        'concurrency': concurrency,
+    }
+    rows = []
+    try:
+        value = os.urandom(value_size)
+        keys = await populate(connector, key_count, value)
+        sample = random.sample(keys, min(args.ops, key_count))
+
+        async def get(key):
+            await connector.get(INSTANCE_NAME, key)
+
+        async def set(key):
+            await connector.set(INSTANCE_NAME, key, value)
+
+        async def delete(key):
+            await connector.delete(INSTANCE_NAME, key)
+
+        for op, operation in (('get', get), ('set', set), ('delete', delete)):
+            latencies, elapsed = await run_concurrently(operation, sample, concurrency)
+            rows.append({**case, **summarise(op, latencies, elapsed)})
+        # Put the deleted keys back so the scans below see the full key count
+        await connector.set_many(INSTANCE_NAME, {key: value for key in sample})
+
+        try:
+            started = time.perf_counter()
+            count = sum([1 async for _ in connector.aiter_values(INSTANCE_NAME)])
+            elapsed = time.perf_counter() - started
+            rows.append({**case, **summarise('get_all_values', [elapsed], elapsed), 'values': count})
+        except NotImplementedError:
+            rows.append({**case, 'op': 'get_all_values', 'unsupported': True})
+
+        # Sweep a tenth of the key count worth of expired entries
+        expired = max(1, key_count // 10)
+        await populate(connector, expired, value, ttl=1, prefix='expired')
+        await asyncio.sleep(1.1)
+        started = time.perf_counter()
+        await connector.clear_expired(INSTANCE_NAME)
+        elapsed = time.perf_counter() - started
+        rows.append({**case, **summarise('clear_expired', [elapsed], elapsed), 'expired': expired})
+    finally:
+        await connector.close(INSTANCE_NAME)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return rows
+
+def parse_list(value: str, cast=int) -> list:
+    return [cast(item) for item in value.split(',') if item]
+
+async def run(args) -> dict:
+    results = []
+    skipped = {}
+    for backend in args.backends:
+        for key_count in args.keys:
+            for value_size in args.value_sizes:
+                for concurrency in args.concurrency:
+                    try:
+                        rows = await bench_case(backend, key_count, value_size, concurrency, args)
+                    except ImportError as e:
+                        # The client library of this backend isn't installed
+                        skipped[backend] = str(e)
+                        break
+                    results.extend(rows)
+                    for row in rows:
+                        print(json.dumps(row), file=sys.stderr)
+                if backend in skipped:
+                    break
+            if backend in skipped:
+                break
+
+    return {
+        'meta': {
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'ops': args.ops,
+            'skipped': skipped,
+        },
+        'results': results,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', type=lambda value: parse_list(value, str), default=['sqlite', 'system', 'shared_memory', 'redis', 'memcached'])
+    parser.add_argument('--keys', type=parse_list, default=[1000, 100000])
+    parser.add_argument('--value-sizes', type=parse_list, default=[64, 1024, 16384])
+    parser.add_argument('--concurrency', type=parse_list, default=[1, 16, 64])
+    parser.add_argument('--ops', type=int, default=10000, help='Operations timed per op and case')
+    parser.add_argument('--redis-url', default=None, help='Benchmark a real Redis server instead of the fake')
+    parser.add_argument('--memcached-url', default=None, help='Benchmark a real Memcached server instead of the fake')
+    parser.add_argument('--output', default=None, help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark the cache value codecs on user and session payloads.
+
+Usage:
+    python -m benchmarks.codecs [--iterations N]
+"""
+
+import argparse
+import datetime
+import timeit
+import uuid
+
+from core.cache_storage.codecs import CODECS
+
+def session_payload() -> dict:
+    """
+    A session entry as written by `SessionManager.add`.
+    """
+    return {
+        'user_uuid': uuid.uuid4(),
+        'created_at': datetime.datetime.now(),
+        'ip_address': '203.0.113.42',
+        'is_logging_in_with_mfa': False,
+        'session_id': str(uuid.uuid4()),
+    }
+
+def user_payload() -> dict:
+    """
+    The column values of a `User` row, as cached by `CacheManager.add`.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return {
+        'id': 4211,
+        'uuid': uuid.uuid4(),
+        'username': 'daftscientist',
+        'email': 'someone@example.com',
+        'password': '$2b$12$' + 'x' * 53,
+        'first_name': 'Some',
+        'last_name': 'One',
+        'address': '1 Example Street, Exampletown',
+        'postcode': 'EX1 2MP',
+        'avatar': 'https://example.com/avatars/4211.png',
+        'staff_level': 0,
+        'email_verification_code': uuid.uuid4(),
+        'mfa_secret': 'JBSWY3DPEHPK3PXP',
+        'created_at': now,
+        'last_login': now,
+        'last_failed_login': None,
+        'failed_login_attempts': 0,
+        'signup_ip': '203.0.113.42',
+        'last_login_ip': '203.0.113.42',
+        'last_failed_login_ip': None,
+        'max_sessions': 5,
+        'is_root_admin': False,
+        'is_mfa_enabled': True,
+        'is_email_verified': True,
+    }
+
+def bench(iterations: int) -> list[dict]:
+    """
+    Time encode and decode for every codec and payload.
+
+    Returns:
+        list[dict]: One result row per codec and payload.
+    """
+    results = []
+    for payload_name, payload in (('session', session_payload()), ('user', user_payload())):
+        for codec in CODECS.values():
+            encoded = codec.encode(payload)
+            encode_time = timeit.timeit(lambda: codec.encode(payload), number=iterations)
+            decode_time = timeit.timeit(lambda: codec.decode(encoded), number=iterations)
+            results.append({
+                'payload': payload_name,
+                'codec': codec.name,
+                'bytes': len(encoded),
+                'encode_us': encode_time / iterations * 1e6,
+                'decode_us': decode_time / iterations * 1e6,
+            })
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'payload':<8} {'codec':<8} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+    for row in bench(args.iterations):
+        print(f"{row['payload']:<8} {row['codec']:<8} {row['bytes']:>6} {row['encode_us']:>10.2f} {row['decode_us']:>10.2f}")
+
+if __name__ == '__main__':
+    main()
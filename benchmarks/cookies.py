@@ -0,0 +1,86 @@
+"""
+Benchmark identity cookie verification per request.
+
+Times verifying one identity cookie, for the stateful (session ID) and the
+stateless (signed session claims) cookie:
+
+- pyjwt: `jwt.decode` with the secret, as every request did before.
+- jwt_cold / compact_cold: `CookieSigner` with the prepared HMAC key, LRU disabled.
+- jwt_warm / compact_warm: `CookieSigner` with a returning cookie, served by the LRU.
+
+Usage:
+    python -m benchmarks.cookies [--iterations N]
+"""
+
+import argparse
+import time
+import timeit
+import uuid
+
+import jwt
+
+from core.cookies import CookieSigner
+
+SECRET = 'bench-cookie-secret'
+EXPIRES_IN = 3600
+
+def cookie_values() -> dict:
+    """
+    The identity cookie values of both session modes, as built by `SessionManager.cookie_value`.
+    """
+    issued_at = int(time.time())
+    return {
+        'stateful': {'session_id': str(uuid.uuid4())},
+        'stateless': {
+            'sid': str(uuid.uuid4()),
+            'uid': str(uuid.uuid4()),
+            'mfa': False,
+            'iat': issued_at,
+            'rat': issued_at + 300,
+            'gen': 3,
+        },
+    }
+
+def bench(iterations: int) -> list[dict]:
+    """
+    Time verification of each cookie with each strategy.
+
+    Returns:
+        list[dict]: One result row per cookie and strategy.
+    """
+    results = []
+    for cookie_name, value in cookie_values().items():
+        jwt_signer = CookieSigner(SECRET)
+        compact_signer = CookieSigner(SECRET, cookie_format='compact')
+        cold_signer = CookieSigner(SECRET, cache_size=0)
+        jwt_token = jwt_signer.encode(value, EXPIRES_IN)
+        compact_token = compact_signer.encode(value, EXPIRES_IN)
+        cases = (
+            ('pyjwt', jwt_token, lambda: jwt.decode(jwt_token, SECRET, algorithms=['HS256'])),
+            ('jwt_cold', jwt_token, lambda: cold_signer.decode(jwt_token)),
+            ('jwt_warm', jwt_token, lambda: jwt_signer.decode(jwt_token)),
+            ('compact_cold', compact_token, lambda: cold_signer.decode(compact_token)),
+            ('compact_warm', compact_token, lambda: compact_signer.decode(compact_token)),
+        )
+        for strategy, token, verify in cases:
+            assert verify() is not None
+            elapsed = timeit.timeit(verify, number=iterations)
+            results.append({
+                'cookie': cookie_name,
+                'strategy': strategy,
+                'bytes': len(token),
+                'verify_us': elapsed / iterations * 1e6,
+            })
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'cookie':<10} {'strategy':<13} {'bytes':>6} {'verify us':>10}")
+    for row in bench(args.iterations):
+        print(f"{row['cookie']:<10} {row['strategy']:<13} {row['bytes']:>6} {row['verify_us']:>10.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark password checks under a login storm.
+
+Fires `--logins` concurrent password checks and measures, while they run, how
+late a ticker on the event loop wakes up (the delay every other request on the
+worker sees), how many checks were accepted or rejected, and their latency:
+
+- thread: `core.hashing.check_password`, aiobcrypt on the default thread pool.
+- pool: `HashingPool.check_password`, on worker processes with admission control.
+
+Logins come from `--ips` addresses and `--accounts` accounts in turn.
+
+Usage:
+    python -m benchmarks.hashing [--logins 200] [--workers N] [--max-pending N]
+        [--ips 50] [--accounts 50] [--rounds 12]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import bcrypt
+
+from benchmarks.cache_storage import summarise
+from core.hashing import HashingBusy, HashingPool, check_password
+
+TICK = 0.005
+
+async def measure_lag(stop: asyncio.Event) -> list:
+    """
+    Record how late a TICK second sleep wakes up, until `stop` is set.
+    """
+    lags = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+    return lags
+
+async def storm(check, args) -> dict:
+    """
+    Run the login storm against one way of checking passwords.
+    """
+    password = b'correct horse battery staple'
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt(args.rounds))
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop))
+    latencies = []
+    rejected = 0
+
+    async def login(i: int):
+        nonlocal rejected
+        started = time.perf_counter()
+        try:
+            await check(password, hashed, f'198.51.100.{i % args.ips}', f'account-{i % args.accounts}')
+        except HashingBusy:
+            rejected += 1
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(args.logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    lags = sorted(await ticker)
+
+    row = summarise('check', latencies, elapsed)
+    row['rejected'] = rejected
+    row['loop_lag_p99_ms'] = lags[int(0.99 * (len(lags) - 1))] * 1000 if lags else None
+    row['loop_lag_max_ms'] = lags[-1] * 1000 if lags else None
+    return row
+
+async def run(args) -> list[dict]:
+    async def thread(password, hashed, ip, account):
+        return await check_password(password, hashed)
+
+    pool = HashingPool(workers=args.workers, max_pending=args.max_pending)
+    await pool.__async__init__()
+    try:
+        results = [
+            {'strategy': 'thread', **await storm(thread, args)},
+            {'strategy': 'pool', **await storm(pool.check_password, args), 'stats': pool.get_stats()},
+        ]
+    finally:
+        await pool.close()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=200, help='Concurrent password checks')
+    parser.add_argument('--workers', type=int, default=None, help='Hashing pool processes')
+    parser.add_argument('--max-pending', type=int, default=None, help='Hashing pool queue bound')
+    parser.add_argument('--ips', type=int, default=50)
+    parser.add_argument('--accounts', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt cost of the checked hash')
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == '__main__':
+    main()
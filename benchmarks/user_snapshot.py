@@ -0,0 +1,93 @@
+"""
+Benchmark cached user entries: the ORM `User` against the `UserSnapshot`.
+
+Measures the bytes per entry and the encode/decode time of one cached user,
+as it was cached before (the pickled ORM object, with its instance state and
+every column) and as it is now (the snapshot, in its fixed binary layout).
+
+The `User` model is imported, so run it from a checkout with a configured core/.env.
+
+Usage:
+    python -m benchmarks.user_snapshot [--iterations N]
+"""
+
+import argparse
+import datetime
+import timeit
+import uuid
+
+from core.cache_storage.codecs import CODECS
+from core.database.models.user.User import User
+from core.user_snapshot import UserSnapshot
+
+def orm_user() -> User:
+    """
+    A transient `User` with every column set, as loaded by `UserDAL.get`.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return User(
+        id=4211,
+        uuid=uuid.uuid4(),
+        username='daftscientist',
+        email='someone@example.com',
+        password='$2b$12$' + 'x' * 53,
+        first_name='Some',
+        last_name='One',
+        address='1 Example Street, Exampletown',
+        postcode='EX1 2MP',
+        avatar='https://example.com/avatars/4211.png',
+        staff_level=0,
+        email_verification_code=uuid.uuid4(),
+        mfa_secret='JBSWY3DPEHPK3PXP',
+        created_at=now,
+        last_login=now,
+        last_failed_login=None,
+        failed_login_attempts=0,
+        signup_ip='203.0.113.42',
+        last_login_ip='203.0.113.42',
+        last_failed_login_ip=None,
+        max_sessions=5,
+        is_root_admin=False,
+        is_mfa_enabled=True,
+        is_email_verified=True,
+    )
+
+def bench(iterations: int) -> list[dict]:
+    """
+    Time encode and decode of the cached user, for every way of caching it.
+
+    Returns:
+        list[dict]: One result row per entry and codec.
+    """
+    user = orm_user()
+    snapshot = UserSnapshot.from_user(user)
+    cases = (
+        ('User', CODECS['pickle'], user),
+        ('snapshot', CODECS['pickle'], snapshot),
+        ('snapshot', CODECS['user_snapshot'], snapshot),
+    )
+    results = []
+    for entry, codec, value in cases:
+        encoded = codec.encode(value)
+        encode_time = timeit.timeit(lambda: codec.encode(value), number=iterations)
+        decode_time = timeit.timeit(lambda: codec.decode(encoded), number=iterations)
+        results.append({
+            'entry': entry,
+            'codec': codec.name,
+            'bytes': len(encoded),
+            'encode_us': encode_time / iterations * 1e6,
+            'decode_us': decode_time / iterations * 1e6,
+        })
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'entry':<9} {'codec':<14} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+    for row in bench(args.iterations):
+        print(f"{row['entry']:<9} {row['codec']:<14} {row['bytes']:>6} {row['encode_us']:>10.2f} {row['decode_us']:>10.2f}")
+
+if __name__ == '__main__':
+    main()
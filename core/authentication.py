@@ -1,12 +1,16 @@
 
+import asyncio
+from dataclasses import dataclass
 from datetime import datetime
 from sanic import BadRequest, Request
+from sanic.log import logger
 from core.database.DALs.user.mfa_dal import MfaDAL
 from core.database.DALs.user.user_dal import UserDAL
 from core.database.models.user.User import User
-from core.cookies import get_cookie
-from core.hashing import check_password
+from core.cookies import append_cookie, get_cookie
+from core.hashing import HashingBusy
 from core.type_hints import Email, Password
+from core.user_snapshot import UserSnapshot
 
 async def fetch_cookie(request: Request) -> str:
     """
@@ -16,22 +20,72 @@ async def fetch_cookie(request: Request) -> str:
             request: The incoming request.
 
         Returns:
-            The cookie value.
+            The verified cookie value, or None if it is missing, expired or not validly signed.
     """
-    cookie = get_cookie(request, request.app.ctx.env_manager.get("COOKIE_IDENTITY"))
+    # The cookie name is read from the env once at startup, and the signer remembers verified cookies
+    cookie = get_cookie(request, request.app.ctx.identity_cookie)
     return cookie
 
-async def get_user(request: Request, include_session: bool = False) -> User:
+@dataclass(slots=True)
+class Identity:
     """
-        Retrieve the user from the request.
+        The user and session a request is authenticated as.
+
+        Args:
+            user: The cached snapshot of the user.
+            session: The user session info.
+    """
+    user: UserSnapshot
+    session: dict
+
+async def get_identity(request: Request) -> Identity:
+    """
+        Retrieve the identity of the request, resolved on first use and shared by every later consumer
+        of the same request, such as `protected`, the `User` dependency and views.
 
         Args:
             request: The incoming request.
-            include_session: Whether to include the session alongside the user object.
 
         Returns:
-            The user object.
-        
+            The identity of the request.
+
+        Raises:
+            BadRequest: If the request isn't authenticated, again for every consumer.
+    """
+    identity = getattr(request.ctx, "identity", None)
+
+    if identity is not None:
+        # Done for every consumer but those running concurrently with the first, which wait for it
+        return await identity
+
+    # The first consumer resolves inline, a future lets the others share its outcome
+    identity = request.ctx.identity = asyncio.get_running_loop().create_future()
+
+    try:
+        result = await resolve_identity(request)
+    except asyncio.CancelledError:
+        identity.cancel()
+        raise
+    except Exception as e:
+        identity.set_exception(e)
+        # Raised here, later consumers get it again from the future
+        identity.exception()
+        raise
+
+    identity.set_result(result)
+    return result
+
+async def resolve_identity(request: Request) -> Identity:
+    """
+        Resolve the identity of the request from its cookie, its session and the cached user.
+        Use `get_identity` instead, which only resolves it once per request.
+
+        Args:
+            request: The incoming request.
+
+        Returns:
+            The identity of the request.
+
         Raises:
             BadRequest: If the user is not found.
     """
@@ -43,24 +97,83 @@ async def get_user(request: Request, include_session: bool = False) -> User:
     if cookie is None:
         raise BadRequest("Unauthorized")
 
-    session = ctx.session_manager.get(cookie.get("session_id"))
+    session, claims = await ctx.session_manager.resolve(cookie)
 
     if session is None:
         raise BadRequest("Unauthorized")
+
+    if claims is not None:
+        # Written back to the identity cookie by `refresh_session_cookie`
+        request.ctx.session_claims = claims
     
-    user = ctx.cache_manager.get(session.get("user_uuid"))
+    user = await ctx.cache_manager.get_or_load(
+        session.get("user_uuid"),
+        lambda: load_user(request, session.get("user_uuid"))
+    )
 
     if user is None:
         raise BadRequest("Unauthorized")
 
+    return Identity(user, session)
+
+async def load_user(request: Request, user_uuid) -> User | None:
+    """
+        Load a user from the database, for the user cache to fill its misses with.
+
+        Args:
+            request: The incoming request.
+            user_uuid: The UUID of the user.
+
+        Returns:
+            The user object if found, otherwise None.
+    """
+    async with request.app.ctx.db.asyncsession() as session:
+        async with session.begin():
+            user_dal = UserDAL(session)
+
+            return await user_dal.get(user_uuid)
+
+async def get_user(request: Request, include_session: bool = False) -> UserSnapshot:
+    """
+        Retrieve the user from the request.
+
+        Args:
+            request: The incoming request.
+            include_session: Whether to include the session alongside the user snapshot.
+
+        Returns:
+            The user snapshot, with the fields the request path needs. Load the `User` through
+            `UserDAL` to read or change other fields.
+        
+        Raises:
+            BadRequest: If the user is not found.
+    """
+    identity = await get_identity(request)
+
     if include_session:
-        return (user, session)
+        return (identity.user, identity.session)
+
+    return identity.user
+
+async def refresh_session_cookie(request: Request, response) -> None:
+    """
+        Rewrite the identity cookie when its session claims were reissued during the request.
 
-    return user
+        Args:
+            request: The incoming request.
+            response: The outgoing response.
+    """
+    claims = getattr(request.ctx, "session_claims", None)
 
-async def mfa_is_setting_up(request, user: User) -> bool:
+    if claims is not None:
+        app = request.app
+        # The same cookie `fetch_cookie` reads
+        append_cookie(request, response, app.ctx.identity_cookie, claims, http_only=True, expires_in=app.ctx.env_manager.get("SESSION_TTL"))
+
+async def mfa_is_setting_up(request, user: User | UserSnapshot) -> bool:
     """
         Retrieve the MFA setup status of the user from the request.
+        The status is looked up once per request and user.
 
         Args:
             request: The incoming request.
@@ -68,13 +181,22 @@ async def mfa_is_setting_up(request, user: User) -> bool:
         Returns:
             The MFA setup status.
     """
+    statuses = getattr(request.ctx, "mfa_is_setting_up", None)
+
+    if statuses is None:
+        statuses = request.ctx.mfa_is_setting_up = {}
+
+    if user.uuid in statuses:
+        return statuses[user.uuid]
     
-    async with request.app.ctx.db_session() as session:
+    async with request.app.ctx.db.asyncsession() as session:
         async with session.begin():
             mfa_dal = MfaDAL(session)
 
             mfa = await mfa_dal.get(user.uuid)
 
+            statuses[user.uuid] = mfa.is_setting_up
+
             return mfa.is_setting_up
 
 async def login(request: Request, email: Email, password: Password) -> str:
@@ -86,38 +208,54 @@ async def login(request: Request, email: Email, password: Password) -> str:
             password: The user's password.
 
         Returns:
-            The users session ID.
+            The value of the identity cookie, holding the session ID or the signed session claims.
+
+        Raises:
+            BadRequest: If the credentials are invalid or no session can be started.
+            HashingBusy: If the hashing pool has no room for the password check, answered with 429.
+            LoginThrottled: If the account or IP address is locked out after failed logins, answered with 429.
     """
     app = request.app
+    ip_address = request.ip or request.remote_addr
 
-    async with app.ctx.db_session() as session:
+    # Locked out accounts and IPs are turned away before the user lookup and the password hashing
+    await app.ctx.login_throttle.check(email, ip_address)
+
+    async with app.ctx.db.asyncsession() as session:
         async with session.begin():
             user_dal = UserDAL(session)
-            user = user_dal.get_by_email(email)
+            user = await user_dal.get_by_email(email)
 
             if user is None:
+                await app.ctx.login_throttle.failed(email, ip_address)
                 raise BadRequest("Invalid credentials")
 
-            if not check_password(password, user.password):
-                user.failed_login_attempts += 1
-                user.last_failed_login = datetime.now()
-                user.last_failed_login_ip = request.ip or request.remote_addr
-                await user_dal.update(user)
+            # Runs on the hashing pool, raises `HashingBusy` (429) when it has no room for this IP or account
+            if not await app.ctx.hashing_pool.check_password(
+                password, user.password,
+                ip=ip_address, account=user.uuid
+            ):
+                # Counted in the cache, the audit columns of the user are written later in a batch
+                await app.ctx.login_throttle.failed(email, ip_address, user.uuid)
                 raise BadRequest("Invalid credentials")
+
+            await app.ctx.login_throttle.succeeded(email)
+
+            if app.ctx.hashing_pool.needs_rehash(user.password):
+                # Replaced in the background, the login doesn't wait for the new hash
+                app.add_task(rehash_password(request, user.uuid, password, user.password))
             
+            mfa = False
+
             if user.is_mfa_enabled:
                 if await mfa_is_setting_up(request, user):
                     raise BadRequest("MFA setup is not complete")
                 mfa = True
             
             user.last_login = datetime.now()
-            user.last_login_ip = request.ip or request.remote_addr
+            user.last_login_ip = ip_address
 
-            len_sessions = 0
-
-            for i in app.ctx.session_manager.get_all_values():
-                if i.get("user_uuid") == user.uuid:
-                    len_sessions += 1
+            len_sessions = await app.ctx.session_manager.count_for_user(user)
 
             if len_sessions > user.max_sessions:
                 raise BadRequest("Maximum number of sessions reached")
@@ -126,12 +264,47 @@ async def login(request: Request, email: Email, password: Password) -> str:
 
             await app.ctx.session_manager.add(
                 session_id, user.uuid, 
-                request.ip or request.remote_addr,
+                ip_address,
                 mfa, ttl=app.ctx.env_manager.get("SESSION_TTL")
             )
 
-            return session_id
+            return await app.ctx.session_manager.cookie_value(session_id, user.uuid, mfa)
     
+async def rehash_password(request: Request, user_uuid, password: Password, hashed_password: str) -> None:
+    """
+        Replace a password hash made under an older or mis-tuned hashing policy, once the password was checked.
+        Skipped when the hashing pool is busy or the password changed meanwhile, the next login tries again.
+
+        Args:
+            request: The login request.
+            user_uuid: The UUID of the user.
+            password: The password the user logged in with.
+            hashed_password: The hash the password was checked against.
+    """
+    app = request.app
+
+    try:
+        new_hashed_password = await app.ctx.hashing_pool.hash_password(
+            password, ip=request.ip or request.remote_addr, account=user_uuid
+        )
+    except HashingBusy:
+        return
+
+    try:
+        async with app.ctx.db.asyncsession() as session:
+            async with session.begin():
+                user_dal = UserDAL(session)
+                user = await user_dal.get(user_uuid)
+
+                if user is None or user.password != hashed_password:
+                    return
+
+                user.password = new_hashed_password
+                await user_dal.update(user)
+    except Exception:
+        # Runs as a background task, a failure would otherwise go unnoticed
+        logger.exception("Failed to rehash the password of user %s", user_uuid)
+
 async def logout(request: Request) -> None:
     """
         Log out a user.
@@ -143,14 +316,11 @@ async def logout(request: Request) -> None:
 
     user, session = await get_user(request, include_session=True)
 
-    len_sessions = 0
-    for i in app.ctx.session_manager.get_all_values():
-        if i.get("user_uuid") == user.uuid:
-            len_sessions += 1
+    len_sessions = await app.ctx.session_manager.count_for_user(user)
     
     if len_sessions == 1:
-        app.ctx.cache_manager.delete(user.uuid)
+        await app.ctx.cache_manager.delete(user.uuid)
     
-    app.ctx.session_manager.delete(session.get("session_id"))
+    await app.ctx.session_manager.delete(session.get("session_id"), user.uuid)
 
     
\ No newline at end of file
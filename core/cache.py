@@ -1,35 +1,37 @@
 """ This module provides functions for caching user information in the application. """
 
-from sqlalchemy import Uuid
+import asyncio
+from inspect import isawaitable
+from sqlalchemy import Uuid, event
+from sqlalchemy.orm import Session, object_session
 from core.cache_storage import CacheStorageManager
+from core.cache_storage.connectors.factory import make_connector
 from core.database.models.user.User import User
+from core.user_snapshot import UserSnapshot, UserSnapshotCodec
 
-from core.cache_storage.connectors.sqlite import SQLiteConnector
-from core.cache_storage.connectors.redis import RedisConnector
-from core.cache_storage.connectors.system import SystemConnector
-from core.cache_storage.connectors.memcached import MemcachedConnector
+# Where a database session collects the users changed by its transaction
+CHANGED_USERS = 'cascade_changed_users'
 
 class CacheManager:
-    def __init__(self, connector_type: str, **kwargs):
+    def __init__(self, connector_type: str, codec: str = None, near_cache_ttl: float = None, near_cache_size: int = None, batch_window: float = None, ttl: int = None, **kwargs):
         """
             Initialize the cache manager.
 
             Args:
                 connector_type: The type of connector to use.
+                codec: The name of the codec used to encode cached values. Defaults to the user snapshot codec.
+                near_cache_ttl: Seconds values are served from an in-process near cache. Defaults to disabled.
+                near_cache_size: The maximum number of entries in the near cache.
+                batch_window: Seconds single-key calls are collected for and sent as one batch. Defaults to disabled.
+                ttl: Seconds users loaded by `get_or_load` are cached for, refreshed ahead of expiry. Defaults to no expiry.
                 kwargs: Additional keyword arguments to pass to the connector.
         """
-        if connector_type.lower() == 'sqlite':
-            connector = SQLiteConnector(**kwargs)
-        elif connector_type.lower() == 'redis':
-            connector = RedisConnector(**kwargs)
-        elif connector_type.lower() == 'system':
-            connector = SystemConnector(**kwargs)
-        elif connector_type.lower() == 'memcached':
-            connector = MemcachedConnector(**kwargs)
-        else:
-            raise ValueError('Invalid connector type: {}'.format(connector_type))
+        connector = make_connector(connector_type, **kwargs)
         
-        self.cache = CacheStorageManager(connector, 'users')
+        self.cache = CacheStorageManager(connector, 'users', codec or UserSnapshotCodec.name, near_cache_ttl, near_cache_size, batch_window, generations=True)
+        self.ttl = ttl
+        self.hooks_registered = False
+        self.invalidating = set()
 
     async def __async__init__(self) -> None:
         """
@@ -37,7 +39,7 @@ class CacheManager:
         """
         await self.cache.__async__init__()
 
-    async def get(self, user_uuid: Uuid) -> User:
+    async def get(self, user_uuid: Uuid) -> UserSnapshot:
         """
             Retrieve a user from the cache based on the UUID.
 
@@ -45,14 +47,46 @@ class CacheManager:
                 user_uuid: The UUID of the user to retrieve.
             
             Returns:
-                The user object if found, otherwise None.
+                The user snapshot if found, otherwise None.
         """
         user = await self.cache.get(str(user_uuid))
         return user
     
+    async def get_or_load(self, user_uuid: Uuid, loader) -> UserSnapshot:
+        """
+            Retrieve a user from the cache, loading and caching it on a miss.
+            Concurrent misses for the same user share one load.
+
+            Args:
+                user_uuid: The UUID of the user to retrieve.
+                loader: Called on a miss to load the user from the database, sync or async.
+            
+            Returns:
+                The user snapshot if found, otherwise None.
+        """
+        async def load_snapshot():
+            user = loader()
+            if isawaitable(user):
+                user = await user
+            return None if user is None else UserSnapshot.from_user(user)
+
+        return await self.cache.get_or_set(str(user_uuid), load_snapshot, ttl=self.ttl)
+
+    async def get_many(self, user_uuids: list[Uuid]) -> dict[str, UserSnapshot]:
+        """
+            Retrieve several users from the cache in one round trip.
+
+            Args:
+                user_uuids: The UUIDs of the users to retrieve.
+            
+            Returns:
+                The found user snapshots keyed by their stringified UUID.
+        """
+        return await self.cache.get_many(str(user_uuid) for user_uuid in user_uuids)
+    
     async def add(self, user: User) -> User:
         """
-            Add a user to the cache.
+            Add a user to the cache, as a `UserSnapshot`.
 
             Args:
                 user: The user to be cached.
@@ -60,7 +94,7 @@ class CacheManager:
             Returns:
                 The user object.
         """
-        await self.cache.set(str(user.uuid), user)
+        await self.cache.set(str(user.uuid), UserSnapshot.from_user(user))
         return user
     
     async def delete(self, user_uuid: Uuid) -> None:
@@ -83,6 +117,80 @@ class CacheManager:
                 True if the cache was cleared.
         """
         await self.cache.clear_expired()
+
+    async def flush(self) -> None:
+        """
+            Invalidate every cached user at once, e.g. after a change to the user schema.
+        """
+        await self.cache.invalidate_all()
+
+    def register_invalidation_hooks(self) -> None:
+        """
+            Drop cached users whenever their row is updated or deleted through the ORM, so no call site
+            has to remember to. Changes are collected per database session and dropped once it commits,
+            the next read loads the committed row.
+        """
+        if self.hooks_registered:
+            return
+        event.listen(User, 'after_update', self._user_changed)
+        event.listen(User, 'after_delete', self._user_changed)
+        event.listen(Session, 'after_commit', self._session_committed)
+        event.listen(Session, 'after_rollback', self._session_rolled_back)
+        self.hooks_registered = True
+
+    def remove_invalidation_hooks(self) -> None:
+        """
+            Stop dropping cached users on ORM changes.
+        """
+        if not self.hooks_registered:
+            return
+        event.remove(User, 'after_update', self._user_changed)
+        event.remove(User, 'after_delete', self._user_changed)
+        event.remove(Session, 'after_commit', self._session_committed)
+        event.remove(Session, 'after_rollback', self._session_rolled_back)
+        self.hooks_registered = False
+
+    def _user_changed(self, mapper, connection, target: User) -> None:
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault(CHANGED_USERS, set()).add(str(target.uuid))
+
+    def _session_rolled_back(self, session: Session) -> None:
+        session.info.pop(CHANGED_USERS, None)
+
+    def _session_committed(self, session: Session) -> None:
+        """
+            Drop the users changed by the committed transaction from the cache, in the background
+            since ORM events can't await.
+        """
+        user_uuids = session.info.pop(CHANGED_USERS, None)
+        if not user_uuids:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not running in the server, e.g. a maintenance script, there is no cache to drop from
+            return
+        task = loop.create_task(self.cache.delete_many(list(user_uuids)))
+        self.invalidating.add(task)
+        task.add_done_callback(self._invalidated)
+
+    def _invalidated(self, task: asyncio.Task) -> None:
+        """
+            Forget a finished invalidation. A failed one leaves the user cached until its TTL runs out.
+        """
+        self.invalidating.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    async def close(self) -> None:
+        """
+            Release the connections held by the cache storage.
+        """
+        self.remove_invalidation_hooks()
+        if self.invalidating:
+            await asyncio.gather(*self.invalidating, return_exceptions=True)
+        await self.cache.close()
     
     async def update(self, user: User) -> User:
         """
@@ -1,5 +1,69 @@
 """ The main, public interface to the caching system. """
-from core.cache_storage.connectors.base import BaseConnector
+import asyncio
+import math
+import random
+import struct
+import time
+import uuid
+from inspect import isawaitable
+from core.cache_storage.codecs import BaseCodec, CODECS_BY_ID, get_codec
+from core.cache_storage.connectors.base import BaseConnector, DEFAULT_BATCH_SIZE
+from core.cache_storage.connectors.batching import BatchingConnector
+from core.cache_storage.near_cache import NearCache
+
+# Set in the frame header when the entry carries refresh metadata after the header
+REFRESH_FLAG = 0x80
+REFRESH_METADATA = struct.Struct('<dd')
+# Leads the frame of entries written with a time-to-live while a near cache is used, followed by their expiry.
+# Never a codec id, readers without near cache support treat these entries as missing.
+EXPIRY_MARKER = 0x00
+EXPIRY_METADATA = struct.Struct('<d')
+
+# Counter names of the instance-wide generation and of tag generations
+NAMESPACE_GENERATION = 'namespace'
+TAG_GENERATION = 'tag:'
+# Published as an invalidated key when a generation is bumped, never a valid stored key
+GENERATION_MARKER = '\x01generation:'
+
+class CacheEntry:
+    """
+    A cached value written by `get_or_set`, carrying what is needed to refresh it ahead of time.
+
+    Args:
+        value: The cached value.
+        soft_expires_at (float): The timestamp after which the value is stale and gets refreshed.
+        delta (float): The seconds the loader took to build the value.
+    """
+    __slots__ = ('value', 'soft_expires_at', 'delta')
+
+    def __init__(self, value, soft_expires_at: float, delta: float):
+        self.value = value
+        self.soft_expires_at = soft_expires_at
+        self.delta = delta
+
+    def should_refresh(self, beta: float) -> bool:
+        """
+        Decide whether to refresh now, always once stale and otherwise with a probability that
+        grows as the soft expiry nears and with the cost of the loader (XFetch).
+
+        Args:
+            beta (float): Scales how early refreshes start, 0 disables early refreshes.
+
+        Returns:
+            bool: True if the value should be refreshed.
+        """
+        now = time.time()
+        if now >= self.soft_expires_at:
+            return True
+        if beta <= 0 or self.delta <= 0:
+            return False
+        return now - self.delta * beta * math.log(1.0 - random.random()) >= self.soft_expires_at
+
+def unwrap(item):
+    """
+    Return the value held by a cache entry, or the item itself for plain values.
+    """
+    return item.value if isinstance(item, CacheEntry) else item
 
 class CacheStorageManager:
     """
@@ -7,28 +71,484 @@ class CacheStorageManager:
 
     Attributes:
         connector: The storage connector (e.g., SQLiteConnector, RedisConnector).
+        codec: The codec used to encode values for this instance (e.g., PickleCodec, CompactCodec).
+        near_cache: The optional in-process cache in front of the connector (NearCache).
+
+    With a `batch_window` (in seconds, 0 for the same loop tick), single-key calls made close
+    together are sent to the connector as batches, see `BatchingConnector`.
+
+    With `generations`, keys are stored under the current generation of the instance and of
+    their tags, e.g. `g3,user-42=1:<key>`. Bumping a generation with `invalidate_all` or
+    `invalidate_tag` hides every entry written under the old one in a single operation, and
+    the old entries are left to expire or be evicted. Generations are cached locally for
+    `generation_refresh` seconds, and dropped early when another worker publishes a bump.
     """
-    def __init__(self, connector: BaseConnector, instance_name: str):
+    def __init__(
+            self,
+            connector: BaseConnector,
+            instance_name: str,
+            codec: str | BaseCodec | None = None,
+            near_cache_ttl: float | None = None,
+            near_cache_size: int | None = None,
+            batch_window: float | None = None,
+            generations: bool = False,
+            generation_refresh: float = 1.0,
+        ):
+        if batch_window is not None:
+            connector = BatchingConnector(connector, batch_window)
         self.connector = connector
         self.instance_name = instance_name
+        self.codec = get_codec(codec)
+        self.header = bytes((self.codec.codec_id,))
+        self.origin = uuid.uuid4().hex
+        self.loading = {}
+        self.refreshing = set()
+        # Generation values keyed by counter name, with the monotonic time they were fetched
+        self.generations = {} if generations else None
+        self.generation_refresh = generation_refresh
+
+        # Local connectors are in memory already, a near cache would only duplicate them
+        self.near_cache = None
+        if near_cache_ttl and not connector.is_local:
+            self.near_cache = NearCache(near_cache_ttl, near_cache_size or 10000)
 
     async def __async__init__(self) -> None:
         """
         Initialize the cache manager.
         """
         await self.connector.__async__init__(self.instance_name)
+        if self.near_cache is not None or self.generations is not None:
+            await self.connector.subscribe_invalidations(self.instance_name, self._on_invalidation)
 
-    async def get(self, key: str):
-        return await self.connector.get(self.instance_name, key)
+    def _on_invalidation(self, origin: str | None, keys: list | None) -> None:
+        """
+        Drop keys changed by other workers from the near cache, and generations they bumped.
+        """
+        if origin is None:
+            if self.near_cache is not None:
+                self.near_cache.clear()
+            if self.generations is not None:
+                self.generations.clear()
+        elif origin != self.origin:
+            for key in keys:
+                if key.startswith(GENERATION_MARKER):
+                    if self.generations is not None:
+                        self.generations.pop(key[len(GENERATION_MARKER):], None)
+                elif self.near_cache is not None:
+                    self.near_cache.delete(key)
 
-    async def set(self, key: str, value: str, ttl=None) -> None:
-        await self.connector.set(self.instance_name, key, value, ttl)
+    async def _generation_values(self, names: list) -> list:
+        """
+        Retrieve generations, fetching those not cached or cached for too long in one round trip.
+        """
+        now = time.monotonic()
+        stale = [
+            name for name in names
+            if name not in self.generations or now - self.generations[name][1] >= self.generation_refresh
+        ]
+        if stale:
+            counters = await self.connector.get_counters(self.instance_name, stale)
+            for name in stale:
+                self.generations[name] = (counters.get(name, 0), now)
+        return [self.generations[name][0] for name in names]
+
+    async def _prefix(self, tags) -> str | None:
+        """
+        Build the generation prefix of keys with the given tags, None when generations are off.
+        """
+        if self.generations is None:
+            if tags:
+                raise ValueError(f'Tags need generations to be enabled for the {self.instance_name} cache')
+            return None
+        tags = sorted(set(tags))
+        for tag in tags:
+            if not tag or any(character in tag for character in ':,='):
+                raise ValueError(f'Invalid cache tag: {tag}')
+        namespace, *tag_generations = await self._generation_values(
+            [NAMESPACE_GENERATION, *(TAG_GENERATION + tag for tag in tags)]
+        )
+        return f'g{namespace}' + ''.join(f',{tag}={generation}' for tag, generation in zip(tags, tag_generations))
+
+    async def _key(self, key: str, tags=()) -> str:
+        """
+        The key an entry is stored under.
+        """
+        prefix = await self._prefix(tags)
+        return key if prefix is None else f'{prefix}:{key}'
+
+    async def _is_current(self, prefix: str) -> bool:
+        """
+        Whether a stored key prefix matches the current generations.
+        """
+        _, *tags = prefix.split(',')
+        try:
+            return prefix == await self._prefix([tag.partition('=')[0] for tag in tags])
+        except ValueError:
+            # Not a generation prefix, e.g. a key written before generations were enabled
+            return False
+
+    async def _bump(self, name: str) -> None:
+        """
+        Move a generation forward and tell the other workers to refetch it.
+        """
+        if self.generations is None:
+            raise ValueError(f'Generations are not enabled for the {self.instance_name} cache')
+        generation = await self.connector.incr(self.instance_name, name)
+        self.generations[name] = (generation, time.monotonic())
+        await self.connector.publish_invalidation(self.instance_name, self.origin, [GENERATION_MARKER + name])
+
+    async def generation(self) -> int:
+        """
+        The current generation of the instance, served from the local copy while it is fresh.
+        - Values derived from the instance outside of it, like signed session claims, can carry it
+          to be dropped by `invalidate_all` too.
+
+        Returns:
+            int: The generation, bumped by every `invalidate_all`.
+        """
+        if self.generations is None:
+            raise ValueError(f'Generations are not enabled for the {self.instance_name} cache')
+        return (await self._generation_values([NAMESPACE_GENERATION]))[0]
+
+    async def invalidate_all(self) -> None:
+        """
+        Invalidate every entry of the instance in one operation, by moving to a new generation.
+        """
+        await self._bump(NAMESPACE_GENERATION)
+
+    async def invalidate_tag(self, tag: str) -> None:
+        """
+        Invalidate every entry written with a tag in one operation, by moving the tag to a new generation.
+
+        Args:
+            tag (str): The tag to invalidate.
+        """
+        await self._bump(TAG_GENERATION + tag)
+
+    async def _invalidate(self, keys: list) -> None:
+        """
+        Drop keys from the local near cache and tell the other workers to do the same.
+        """
+        if self.near_cache is None:
+            return
+        for key in keys:
+            self.near_cache.delete(key)
+        await self.connector.publish_invalidation(self.instance_name, self.origin, keys)
+
+    def encode(self, value, ttl=None) -> bytes:
+        """
+        Encode a value with the instance codec, prefixed with the codec id.
+        - Cache entries also get the refresh flag and their metadata after the header.
+        - With a near cache, values written with a time-to-live are led by their expiry, so other
+          workers never keep them in memory past it.
+        - Connectors that store live objects get the value as is.
+        """
+        if self.connector.stores_objects:
+            return value
+        if isinstance(value, CacheEntry):
+            data = (
+                bytes((self.codec.codec_id | REFRESH_FLAG,))
+                + REFRESH_METADATA.pack(value.soft_expires_at, value.delta)
+                + self.codec.encode(value.value)
+            )
+        else:
+            data = self.header + self.codec.encode(value)
+        if ttl and self.near_cache is not None:
+            return bytes((EXPIRY_MARKER,)) + EXPIRY_METADATA.pack(time.time() + ttl) + data
+        return data
+
+    def decode(self, data: bytes | None):
+        """
+        Decode a stored value with the codec named in its header.
+        - Entries with refresh metadata come back as a `CacheEntry`.
+        - Entries with an unknown header (e.g. written before codecs existed) are treated as missing,
+          as are cache entries whose codec can no longer read their value.
+        """
+        if self.connector.stores_objects:
+            return data
+        if data and data[0] == EXPIRY_MARKER:
+            data = data[1 + EXPIRY_METADATA.size:]
+        if not data:
+            return None
+        codec = CODECS_BY_ID.get(data[0] & ~REFRESH_FLAG)
+        if codec is None:
+            return None
+        if data[0] & REFRESH_FLAG:
+            soft_expires_at, delta = REFRESH_METADATA.unpack_from(data, 1)
+            value = codec.decode(data[1 + REFRESH_METADATA.size:])
+            return None if value is None else CacheEntry(value, soft_expires_at, delta)
+        return codec.decode(data[1:])
+
+    def _fill_near_cache(self, key: str, item, data) -> None:
+        """
+        Keep a value read from the connector in the near cache, never past its expiry in the backing store.
+        """
+        if data and data[0] == EXPIRY_MARKER:
+            remaining = EXPIRY_METADATA.unpack_from(data, 1)[0] - time.time()
+            if remaining <= 0:
+                return
+            self.near_cache.set(key, item, remaining)
+        else:
+            self.near_cache.set(key, item)
+
+    async def _read(self, key: str):
+        """
+        Retrieve a value or cache entry, going through the near cache when there is one.
+        """
+        if self.near_cache is not None:
+            item = self.near_cache.get(key)
+            if item is not None:
+                return item
+
+        data = await self.connector.get(self.instance_name, key)
+        item = self.decode(data)
+
+        if self.near_cache is not None and item is not None:
+            self._fill_near_cache(key, item, data)
+        return item
+
+    async def _write(self, key: str, value, ttl=None) -> None:
+        """
+        Store a value or cache entry under its stored key.
+        """
+        await self.connector.set(self.instance_name, key, self.encode(value, ttl), ttl)
+        await self._invalidate([key])
+        if self.near_cache is not None:
+            self.near_cache.set(key, value, ttl)
+
+    async def get(self, key: str, tags=()):
+        return unwrap(await self._read(await self._key(key, tags)))
+
+    async def set(self, key: str, value: str, ttl=None, tags=()) -> None:
+        await self._write(await self._key(key, tags), value, ttl)
+
+    async def get_many(self, keys: list, tags=()) -> dict:
+        prefix = await self._prefix(tags)
+        stored_keys = {key if prefix is None else f'{prefix}:{key}': key for key in keys}
+        if not stored_keys:
+            return {}
+
+        values = {}
+        if self.near_cache is not None:
+            for stored_key, key in stored_keys.items():
+                item = self.near_cache.get(stored_key)
+                if item is not None:
+                    values[key] = unwrap(item)
+            missing = [stored_key for stored_key, key in stored_keys.items() if key not in values]
+            if not missing:
+                return values
+        else:
+            missing = list(stored_keys)
+
+        for stored_key, data in (await self.connector.get_many(self.instance_name, missing)).items():
+            item = self.decode(data)
+            if item is None:
+                continue
+            values[stored_keys[stored_key]] = unwrap(item)
+            if self.near_cache is not None:
+                self._fill_near_cache(stored_key, item, data)
+        return values
+
+    async def set_many(self, values: dict, ttl=None, tags=()) -> None:
+        if values:
+            prefix = await self._prefix(tags)
+            if prefix is not None:
+                values = {f'{prefix}:{key}': value for key, value in values.items()}
+            await self.connector.set_many(
+                self.instance_name,
+                {key: self.encode(value, ttl) for key, value in values.items()},
+                ttl
+            )
+            await self._invalidate(list(values))
+            if self.near_cache is not None:
+                for key, value in values.items():
+                    self.near_cache.set(key, value, ttl)
+
+    async def delete_many(self, keys: list, tags=()) -> None:
+        prefix = await self._prefix(tags)
+        keys = [key if prefix is None else f'{prefix}:{key}' for key in keys]
+        if keys:
+            await self.connector.delete_many(self.instance_name, keys)
+            await self._invalidate(keys)
+
+    async def get_or_set(
+            self,
+            key: str,
+            loader,
+            ttl=None,
+            lock: bool = False,
+            lock_ttl: int = 10,
+            stale_ttl: int | None = None,
+            beta: float = 1.0,
+            tags=(),
+        ):
+        """
+        Retrieve a value, calling the loader to build and cache it on a miss.
+        - Concurrent misses for the same key in this process share a single loader call.
+        - With `lock`, workers also coordinate through the backend so only one of them runs the loader,
+          while the others wait for its value.
+        - With a `ttl`, the value is refreshed in the background when it goes stale, and sometimes a little
+          before (XFetch), so hot keys don't all expire at once. With `stale_ttl`, stale values keep being
+          served for that long past the `ttl` while the refresh runs.
+
+        Args:
+            key (str): The key of the cache.
+            loader: A callable (sync or async) returning the value, None values are not cached.
+            ttl (int, optional): The seconds the value is fresh for. Defaults to None.
+            lock (bool, optional): Whether to take a cross-worker lock while loading. Defaults to False.
+            lock_ttl (int, optional): The seconds before an abandoned lock is released. Defaults to 10.
+            stale_ttl (int, optional): The seconds a stale value may still be served. Defaults to None.
+            beta (float, optional): Scales how early refreshes start, 0 disables early refreshes. Defaults to 1.0.
+            tags (tuple, optional): The tags of the value, see `invalidate_tag`. Defaults to none.
+
+        Returns:
+            The cached or loaded value.
+        """
+        key = await self._key(key, tags)
+        item = await self._read(key)
+        if item is not None:
+            if isinstance(item, CacheEntry) and item.should_refresh(beta) and key not in self.loading:
+                task = asyncio.create_task(self._load_once(key, loader, ttl, lock, lock_ttl, stale_ttl))
+                self.refreshing.add(task)
+                task.add_done_callback(self._refreshed)
+            return unwrap(item)
+
+        return await self._load_once(key, loader, ttl, lock, lock_ttl, stale_ttl)
+
+    def _refreshed(self, task: asyncio.Task) -> None:
+        """
+        Forget a finished background refresh. A failed refresh leaves the stale value in place until its hard expiry.
+        """
+        self.refreshing.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    async def _load_once(self, key: str, loader, ttl, lock: bool, lock_ttl: int, stale_ttl: int | None):
+        """
+        Load a value, sharing a single loader call between concurrent callers for the same key.
+        """
+        loading = self.loading.get(key)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        loading = self.loading[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await self._load(key, loader, ttl, lock, lock_ttl, stale_ttl)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                loading.cancel()
+            else:
+                loading.set_exception(e)
+                # Mark the exception as retrieved in case no other caller was waiting
+                loading.exception()
+            raise
+        else:
+            loading.set_result(value)
+            return value
+        finally:
+            del self.loading[key]
+
+    async def _load(self, key: str, loader, ttl, lock: bool, lock_ttl: int, stale_ttl: int | None):
+        """
+        Run the loader and cache its value, optionally under a cross-worker lock.
+        """
+        token = None
+        if lock:
+            token = uuid.uuid4().hex
+            if not await self.connector.acquire_lock(self.instance_name, key, token, lock_ttl):
+                token = None
+                # Another worker is loading, wait for its value until the lock would have expired
+                deadline = time.monotonic() + lock_ttl
+                delay = 0.01
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(delay)
+                    value = unwrap(await self._read(key))
+                    if value is not None:
+                        return value
+                    delay = min(delay * 2, 0.25)
+
+        try:
+            started = time.monotonic()
+            value = loader()
+            if isawaitable(value):
+                value = await value
+            if value is not None and ttl:
+                entry = CacheEntry(value, time.time() + ttl, time.monotonic() - started)
+                await self._write(key, entry, ttl + (stale_ttl or 0))
+            elif value is not None:
+                await self._write(key, value)
+            return value
+        finally:
+            if token is not None:
+                await self.connector.release_lock(self.instance_name, key, token)
 
     async def clear_expired(self) -> None:
         await self.connector.clear_expired(self.instance_name)
 
-    async def delete(self, key: str) -> None:
+    async def delete(self, key: str, tags=()) -> None:
+        key = await self._key(key, tags)
         await self.connector.delete(self.instance_name, key)
+        await self._invalidate([key])
+
+    async def touch_many(self, keys: list, ttl: int, tags=()) -> None:
+        """
+        Push back the expiry of several entries without rewriting them.
+
+        Args:
+            keys (list): The keys of the entries.
+            ttl (int): The new time-to-live in seconds, counted from now.
+        """
+        prefix = await self._prefix(tags)
+        keys = [key if prefix is None else f'{prefix}:{key}' for key in keys]
+        if keys:
+            await self.connector.touch_many(self.instance_name, keys, ttl)
+
+    async def index_add(self, index: str, member: str, ttl=None) -> None:
+        """
+        Add a member to a secondary index, such as the keys of the entries belonging to one user.
+        - Indexes live under the generation of the instance, so `invalidate_all` empties them too.
+
+        Args:
+            index (str): The name of the index.
+            member (str): The member to add.
+            ttl (int, optional): The time-to-live of the member in seconds. Defaults to None.
+        """
+        await self.connector.index_add(self.instance_name, await self._key(index), member, ttl)
+
+    async def index_remove(self, index: str, members: list) -> None:
+        if members:
+            await self.connector.index_remove(self.instance_name, await self._key(index), members)
+
+    async def index_members(self, index: str) -> list:
+        return await self.connector.index_members(self.instance_name, await self._key(index))
+
+    async def index_pop(self, index: str) -> list:
+        return await self.connector.index_pop(self.instance_name, await self._key(index))
+
+    async def aiter_values(self, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Iterate over every value of the instance.
+        - With generations, entries written under an old generation are skipped.
+        """
+        if self.generations is None:
+            async for data in self.connector.aiter_values(self.instance_name, batch_size):
+                item = self.decode(data)
+                if item is not None:
+                    yield unwrap(item)
+            return
+
+        current = {}
+        async for key, data in self.connector.aiter_items(self.instance_name, batch_size):
+            prefix = key.partition(':')[0]
+            if prefix not in current:
+                current[prefix] = await self._is_current(prefix)
+            if current[prefix]:
+                item = self.decode(data)
+                if item is not None:
+                    yield unwrap(item)
 
     async def get_all_values(self) -> list:
-        return await self.connector.get_all_values(self.instance_name)
\ No newline at end of file
+        return [value async for value in self.aiter_values()]
+
+    async def close(self) -> None:
+        await self.connector.close(self.instance_name)
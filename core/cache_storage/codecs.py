@@ -0,0 +1,328 @@
+""" Value codecs used by the caching system to turn cached values into bytes and back. """
+
+import datetime
+import pickle
+import struct
+import uuid
+import ujson
+
+class BaseCodec:
+    """
+    The base class for all value codecs.
+
+    Every encoded value is framed by `CacheStorageManager` with a one byte header
+    holding the codec id, so entries written with one codec stay readable after an
+    instance is switched to another.
+
+    Attributes:
+        codec_id (int): The unique id written in the frame header.
+        name (str): The name used to select the codec.
+    """
+    codec_id = 0
+    name = None
+
+    def encode(self, value) -> bytes:
+        """
+        Encode a value into bytes.
+
+        Args:
+            value: The value to encode.
+
+        Returns:
+            bytes: The encoded value.
+        """
+        raise NotImplementedError
+
+    def decode(self, data: bytes):
+        """
+        Decode bytes back into a value.
+
+        Args:
+            data (bytes): The encoded value.
+
+        Returns:
+            The decoded value.
+        """
+        raise NotImplementedError
+
+class PickleCodec(BaseCodec):
+    """
+    Encodes values with pickle, supporting any picklable object.
+    """
+    codec_id = 1
+    name = 'pickle'
+
+    def encode(self, value) -> bytes:
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data: bytes):
+        return pickle.loads(data)
+
+def _json_default(value) -> str:
+    """
+    Convert values ujson can't serialise natively into strings.
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+class JSONCodec(BaseCodec):
+    """
+    Encodes values as JSON with ujson.
+    - UUIDs, dates and other non JSON types are stored as strings and come back as strings.
+    """
+    codec_id = 2
+    name = 'json'
+
+    def encode(self, value) -> bytes:
+        return ujson.dumps(value, default=_json_default).encode()
+
+    def decode(self, data: bytes):
+        return ujson.loads(data)
+
+# Compact codec type tags
+_NONE = 0x00
+_FALSE = 0x01
+_TRUE = 0x02
+_INT8 = 0x03
+_INT64 = 0x04
+_BIGINT = 0x05
+_FLOAT = 0x06
+_SHORT_STR = 0x07
+_STR = 0x08
+_BYTES = 0x09
+_LIST = 0x0a
+_TUPLE = 0x0b
+_DICT = 0x0c
+_UUID = 0x0d
+_DATETIME = 0x0e
+_AWARE_DATETIME = 0x0f
+_PICKLE = 0x10
+
+_U8 = struct.Struct('<B')
+_U32 = struct.Struct('<I')
+_I8 = struct.Struct('<b')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+_DATETIME_FIELDS = struct.Struct('<HBBBBBI')
+_AWARE_DATETIME_FIELDS = struct.Struct('<HBBBBBIi')
+
+_TIMEZONES = {}
+
+def _timezone(utc_offset: int) -> datetime.timezone:
+    """
+    Return a shared fixed offset timezone, avoiding a new tzinfo per decoded datetime.
+    """
+    tzinfo = _TIMEZONES.get(utc_offset)
+    if tzinfo is None:
+        tzinfo = _TIMEZONES[utc_offset] = datetime.timezone(datetime.timedelta(seconds=utc_offset))
+    return tzinfo
+
+
+class CompactCodec(BaseCodec):
+    """
+    A compact, msgpack style binary codec built on `struct`.
+    - Natively handles None, bool, int, float, str, bytes, list, tuple, dict, UUID and datetime.
+    - Any other value is embedded as a pickle so the codec can be used for every instance.
+    """
+    codec_id = 3
+    name = 'compact'
+
+    def encode(self, value) -> bytes:
+        buffer = bytearray()
+        self._encode(value, buffer)
+        return bytes(buffer)
+
+    def decode(self, data: bytes):
+        value, _ = self._decode(bytes(data), 0)
+        return value
+
+    def _encode(self, value, buffer: bytearray) -> None:
+        """
+        Append the encoding of a value to the buffer.
+        """
+        value_type = type(value)
+        if value is None:
+            buffer.append(_NONE)
+        elif value_type is bool:
+            buffer.append(_TRUE if value else _FALSE)
+        elif value_type is int:
+            if -128 <= value < 128:
+                buffer.append(_INT8)
+                buffer += _I8.pack(value)
+            elif -(1 << 63) <= value < (1 << 63):
+                buffer.append(_INT64)
+                buffer += _I64.pack(value)
+            else:
+                raw = value.to_bytes((value.bit_length() + 8) // 8, 'little', signed=True)
+                buffer.append(_BIGINT)
+                buffer += _U32.pack(len(raw))
+                buffer += raw
+        elif value_type is float:
+            buffer.append(_FLOAT)
+            buffer += _F64.pack(value)
+        elif value_type is str:
+            raw = value.encode()
+            if len(raw) < 256:
+                buffer.append(_SHORT_STR)
+                buffer += _U8.pack(len(raw))
+            else:
+                buffer.append(_STR)
+                buffer += _U32.pack(len(raw))
+            buffer += raw
+        elif value_type is bytes:
+            buffer.append(_BYTES)
+            buffer += _U32.pack(len(value))
+            buffer += value
+        elif value_type is list or value_type is tuple:
+            buffer.append(_LIST if value_type is list else _TUPLE)
+            buffer += _U32.pack(len(value))
+            for item in value:
+                self._encode(item, buffer)
+        elif value_type is dict:
+            buffer.append(_DICT)
+            buffer += _U32.pack(len(value))
+            for key, item in value.items():
+                self._encode(key, buffer)
+                self._encode(item, buffer)
+        elif value_type is uuid.UUID:
+            buffer.append(_UUID)
+            buffer += value.bytes
+        elif value_type is datetime.datetime:
+            offset = value.utcoffset()
+            fields = (value.year, value.month, value.day, value.hour, value.minute, value.second, value.microsecond)
+            if offset is None:
+                buffer.append(_DATETIME)
+                buffer += _DATETIME_FIELDS.pack(*fields)
+            else:
+                buffer.append(_AWARE_DATETIME)
+                buffer += _AWARE_DATETIME_FIELDS.pack(*fields, offset // datetime.timedelta(seconds=1))
+        else:
+            raw = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            buffer.append(_PICKLE)
+            buffer += _U32.pack(len(raw))
+            buffer += raw
+
+    def _decode(self, data: bytes, offset: int) -> tuple:
+        """
+        Decode the value starting at the offset.
+
+        Returns:
+            tuple: The decoded value and the offset just past it.
+        """
+        tag = data[offset]
+        offset += 1
+        if tag == _SHORT_STR:
+            length = data[offset]
+            offset += 1
+            return data[offset:offset + length].decode(), offset + length
+        if tag == _NONE:
+            return None, offset
+        if tag == _FALSE:
+            return False, offset
+        if tag == _TRUE:
+            return True, offset
+        if tag == _INT8:
+            return _I8.unpack_from(data, offset)[0], offset + 1
+        if tag == _INT64:
+            return _I64.unpack_from(data, offset)[0], offset + 8
+        if tag == _FLOAT:
+            return _F64.unpack_from(data, offset)[0], offset + 8
+        if tag == _DICT:
+            count = _U32.unpack_from(data, offset)[0]
+            offset += 4
+            value = {}
+            for _ in range(count):
+                # Keys are almost always short strings, decode them inline to save a call
+                if data[offset] == _SHORT_STR:
+                    length = data[offset + 1]
+                    offset += 2
+                    key = data[offset:offset + length].decode()
+                    offset += length
+                else:
+                    key, offset = self._decode(data, offset)
+                value[key], offset = self._decode(data, offset)
+            return value, offset
+        if tag == _LIST or tag == _TUPLE:
+            count = _U32.unpack_from(data, offset)[0]
+            offset += 4
+            value = []
+            for _ in range(count):
+                item, offset = self._decode(data, offset)
+                value.append(item)
+            return (value if tag == _LIST else tuple(value)), offset
+        if tag == _UUID:
+            return uuid.UUID(bytes=data[offset:offset + 16]), offset + 16
+        if tag == _DATETIME:
+            fields = _DATETIME_FIELDS.unpack_from(data, offset)
+            return datetime.datetime(*fields), offset + _DATETIME_FIELDS.size
+        if tag == _AWARE_DATETIME:
+            *fields, utc_offset = _AWARE_DATETIME_FIELDS.unpack_from(data, offset)
+            return datetime.datetime(*fields, tzinfo=_timezone(utc_offset)), offset + _AWARE_DATETIME_FIELDS.size
+
+        length = _U32.unpack_from(data, offset)[0]
+        offset += 4
+        raw = data[offset:offset + length]
+        if tag == _STR:
+            return raw.decode(), offset + length
+        if tag == _BYTES:
+            return raw, offset + length
+        if tag == _BIGINT:
+            return int.from_bytes(raw, 'little', signed=True), offset + length
+        if tag == _PICKLE:
+            return pickle.loads(raw), offset + length
+        raise ValueError(f"Unknown compact codec tag: {tag}")
+
+CODECS = {
+    codec.name: codec
+    for codec in (PickleCodec(), JSONCodec(), CompactCodec())
+}
+
+CODECS_BY_ID = {
+    codec.codec_id: codec
+    for codec in CODECS.values()
+}
+
+DEFAULT_CODEC = 'compact'
+
+def register_codec(codec: BaseCodec) -> BaseCodec:
+    """
+    Register a codec so it can be selected by name and its entries can be decoded.
+
+    Args:
+        codec (BaseCodec): The codec to register.
+
+    Returns:
+        BaseCodec: The registered codec.
+
+    Raises:
+        ValueError: If the codec id is out of range or already taken by another codec.
+    """
+    if not 0 < codec.codec_id < 0x80:
+        raise ValueError('Codec ids must be between 1 and 127, the top bit of the header is reserved')
+    existing = CODECS_BY_ID.get(codec.codec_id)
+    if existing is not None and existing.name != codec.name:
+        raise ValueError('Codec id {} is already used by {}'.format(codec.codec_id, existing.name))
+    CODECS[codec.name] = codec
+    CODECS_BY_ID[codec.codec_id] = codec
+    return codec
+
+def get_codec(codec: str | BaseCodec | None) -> BaseCodec:
+    """
+    Resolve a codec from its name.
+
+    Args:
+        codec (str | BaseCodec | None): The codec name, a codec instance, or None for the default codec.
+
+    Returns:
+        BaseCodec: The codec.
+
+    Raises:
+        ValueError: If no codec exists with the given name.
+    """
+    if isinstance(codec, BaseCodec):
+        return codec
+    name = (codec or DEFAULT_CODEC).lower()
+    if name not in CODECS:
+        raise ValueError('Invalid codec: {}'.format(codec))
+    return CODECS[name]
@@ -1,12 +1,20 @@
 """ The base connector for all storage connectors. """
 
+DEFAULT_BATCH_SIZE = 500
+
 class BaseConnector:
     """
     The base class for all storage connectors.
+    - Values reach the connector already encoded to bytes by the `CacheStorageManager` codec,
+      unless the connector sets `stores_objects` to keep live objects instead.
+    - Connectors setting `is_local` read from this host's memory, so no near cache is put in front of them.
 
     Args:
         connection: The connection to the storage system.
     """
+    stores_objects = False
+    is_local = False
+
     def __init__(self, connection):
         self.connection = connection
 
@@ -36,6 +44,47 @@ class BaseConnector:
         """
         raise NotImplementedError
 
+    async def get_many(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several values from the cache in one round trip.
+
+        Args:
+            keys (list): The keys of the cache.
+
+        Returns:
+            dict: The cached values keyed by their key, missing keys are left out.
+        """
+        raise NotImplementedError
+
+    async def set_many(self, instance_name: str, values: dict, ttl=None) -> None:
+        """
+        Add several values to the cache in one round trip.
+
+        Args:
+            values (dict): The values to be cached keyed by their key.
+            ttl (int, optional): The time-to-live in seconds. Defaults to None.
+        """
+        raise NotImplementedError
+
+    async def delete_many(self, instance_name: str, keys: list) -> None:
+        """
+        Remove several values from the cache in one round trip.
+
+        Args:
+            keys (list): The keys of the cache.
+        """
+        raise NotImplementedError
+
+    async def touch_many(self, instance_name: str, keys: list, ttl: int) -> None:
+        """
+        Push back the expiry of several values without rewriting them, missing keys are skipped.
+
+        Args:
+            keys (list): The keys of the cache.
+            ttl (int): The new time-to-live in seconds, counted from now.
+        """
+        raise NotImplementedError
+
     async def clear_expired(self, instance_name: str) -> None:
         """
         Clear expired cache entries from the storage system
@@ -54,11 +103,161 @@ class BaseConnector:
         """
         raise NotImplementedError
 
+    async def aiter_items(self, instance_name: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Iterate over every key and value in the cache, fetching them in batches.
+
+        Args:
+            batch_size (int, optional): The number of values fetched per round trip. Defaults to 500.
+
+        Yields:
+            tuple: The key and value of each cached entry.
+        """
+        raise NotImplementedError
+        yield # Makes this method an async generator like its overrides
+
+    async def aiter_values(self, instance_name: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Iterate over every value in the cache, fetching them in batches.
+
+        Args:
+            batch_size (int, optional): The number of values fetched per round trip. Defaults to 500.
+
+        Yields:
+            The cached values.
+        """
+        async for _, value in self.aiter_items(instance_name, batch_size):
+            yield value
+
     async def get_all_values(self, instance_name: str) -> list:
         """
         Retrieve all values from the cache.
+        - Prefer `aiter_values`, this materialises the whole cache in memory.
 
         Returns:
             list: All values in the cache.
         """
+        return [value async for value in self.aiter_values(instance_name)]
+
+    async def incr(self, instance_name: str, key: str) -> int:
+        """
+        Atomically increment a counter shared by every worker using this storage, starting from 0.
+        - Counters are kept apart from cached values, they never expire and aren't returned by iteration.
+
+        Args:
+            key (str): The name of the counter.
+
+        Returns:
+            int: The value of the counter after the increment.
+        """
+        raise NotImplementedError
+
+    async def get_counters(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several counters in one round trip.
+
+        Args:
+            keys (list): The names of the counters.
+
+        Returns:
+            dict: The counter values keyed by their name, counters never incremented are left out.
+        """
+        raise NotImplementedError
+
+    async def index_add(self, instance_name: str, index: str, member: str, ttl=None) -> None:
+        """
+        Add a member to a secondary index, a set of keys kept apart from cached values.
+        - Members expire on their own like cached values, so an index can follow the entries it points to.
+
+        Args:
+            index (str): The name of the index.
+            member (str): The member to add.
+            ttl (int, optional): The time-to-live of the member in seconds. Defaults to None.
+        """
+        raise NotImplementedError
+
+    async def index_remove(self, instance_name: str, index: str, members: list) -> None:
+        """
+        Remove members from a secondary index.
+
+        Args:
+            index (str): The name of the index.
+            members (list): The members to remove.
+        """
         raise NotImplementedError
+
+    async def index_members(self, instance_name: str, index: str) -> list:
+        """
+        Retrieve the live members of a secondary index.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        raise NotImplementedError
+
+    async def index_pop(self, instance_name: str, index: str) -> list:
+        """
+        Atomically retrieve the live members of a secondary index and delete it.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        raise NotImplementedError
+
+    async def acquire_lock(self, instance_name: str, key: str, token: str, ttl: int) -> bool:
+        """
+        Try to take a lock shared by every worker using this storage.
+        - Connectors that live in a single process have nothing to coordinate and always succeed.
+
+        Args:
+            key (str): The key being locked.
+            token (str): A unique value identifying the holder.
+            ttl (int): The number of seconds before the lock is released on its own.
+
+        Returns:
+            bool: True if the lock was taken.
+        """
+        return True
+
+    async def release_lock(self, instance_name: str, key: str, token: str) -> None:
+        """
+        Release a lock, only if it is still held with the given token.
+
+        Args:
+            key (str): The key being locked.
+            token (str): The value the lock was taken with.
+        """
+        pass
+
+    async def publish_invalidation(self, instance_name: str, origin: str, keys: list) -> None:
+        """
+        Tell the other workers that keys changed, so they drop them from their near cache.
+        - Connectors without a broadcast channel leave this as a no-op, the near cache TTL then bounds staleness.
+
+        Args:
+            origin (str): The id of the publishing cache manager.
+            keys (list): The keys that changed.
+        """
+        pass
+
+    async def subscribe_invalidations(self, instance_name: str, callback) -> None:
+        """
+        Start delivering invalidations published by other workers.
+
+        Args:
+            callback: Called with the origin and keys of every invalidation, or with
+                (None, None) when messages may have been missed and everything must be dropped.
+        """
+        pass
+
+    async def close(self, instance_name: str) -> None:
+        """
+        Release any connections held by the connector.
+        """
+        pass
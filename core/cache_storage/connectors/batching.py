@@ -0,0 +1,186 @@
+""" This module contains the BatchingConnector class that pipelines concurrent single-key calls. """
+
+import asyncio
+from core.cache_storage.connectors.base import BaseConnector, DEFAULT_BATCH_SIZE
+
+class BatchingConnector(BaseConnector):
+    """
+    Wraps a connector and turns the single-key calls issued close together into batch calls.
+    - `get`, `set` and `delete` are queued and flushed on the next loop tick, or after `window` seconds.
+    - A flush sends each run of consecutive calls of the same kind as one `get_many`, `set_many`
+      or `delete_many`, so calls are applied in the order they were made.
+    - Flushes of an instance never overlap, calls made during a flush go in the next one.
+
+    Args:
+        connector (BaseConnector): The connector doing the actual storage.
+        window (float, optional): The seconds calls are collected for before a flush. Defaults to 0, the next loop tick.
+    """
+    def __init__(self, connector: BaseConnector, window: float = 0):
+        self.connector = connector
+        self.window = window
+        self.stores_objects = connector.stores_objects
+        self.is_local = connector.is_local
+        self.pending = {}
+        self.flushing = {}
+
+    def _enqueue(self, instance_name: str, kind: str, key: str, value=None, ttl=None) -> asyncio.Future:
+        """
+        Queue a call and make sure a flush is coming.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self.pending.setdefault(instance_name, [])
+        pending.append((kind, key, value, ttl, future))
+        if len(pending) == 1 and instance_name not in self.flushing:
+            self._schedule(instance_name)
+        return future
+
+    def _schedule(self, instance_name: str) -> None:
+        loop = asyncio.get_running_loop()
+        if self.window:
+            loop.call_later(self.window, self._start_flush, instance_name)
+        else:
+            loop.call_soon(self._start_flush, instance_name)
+
+    def _start_flush(self, instance_name: str) -> None:
+        if instance_name in self.flushing:
+            # The running flush schedules the next one when it ends
+            return
+        calls = self.pending.pop(instance_name, None)
+        if calls:
+            self.flushing[instance_name] = asyncio.create_task(self._flush(instance_name, calls))
+
+    async def _flush(self, instance_name: str, calls: list) -> None:
+        """
+        Send the queued calls as batches of consecutive calls of the same kind, and resolve their futures.
+        """
+        try:
+            start = 0
+            while start < len(calls):
+                kind, ttl = calls[start][0], calls[start][3]
+                end = start + 1
+                while end < len(calls) and calls[end][0] == kind and (kind != 'set' or calls[end][3] == ttl):
+                    end += 1
+                run = calls[start:end]
+                start = end
+
+                try:
+                    if kind == 'get':
+                        values = await self.connector.get_many(instance_name, list(dict.fromkeys(key for _, key, _, _, _ in run)))
+                        results = [values.get(key) for _, key, _, _, _ in run]
+                    elif kind == 'set':
+                        # Later calls for the same key win, as they would have one at a time
+                        await self.connector.set_many(instance_name, {key: value for _, key, value, _, _ in run}, ttl)
+                        results = [None] * len(run)
+                    else:
+                        await self.connector.delete_many(instance_name, list(dict.fromkeys(key for _, key, _, _, _ in run)))
+                        results = [None] * len(run)
+                except Exception as e:
+                    for *_, future in run:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                for (*_, future), result in zip(run, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            del self.flushing[instance_name]
+            if self.pending.get(instance_name):
+                self._schedule(instance_name)
+
+    async def __async__init__(self, instance_name: str) -> None:
+        await self.connector.__async__init__(instance_name)
+
+    async def get(self, instance_name: str, key: str):
+        """
+        Retrieve a value from the cache based on the key, batched with the other calls of this tick.
+
+        Args:
+            key (str): The key of the cache.
+
+        Returns:
+            The cached value if found, otherwise None.
+        """
+        return await self._enqueue(instance_name, 'get', key)
+
+    async def set(self, instance_name: str, key: str, value, ttl=None) -> None:
+        """
+        Add a value to the cache, batched with the other calls of this tick.
+
+        Args:
+            key (str): The key of the cache.
+            value: The value to be cached.
+            ttl (int, optional): The time-to-live in seconds. Defaults to None.
+        """
+        await self._enqueue(instance_name, 'set', key, value, ttl)
+
+    async def delete(self, instance_name: str, key: str) -> None:
+        """
+        Remove a value from the cache based on the key, batched with the other calls of this tick.
+
+        Args:
+            key (str): The key of the cache.
+        """
+        await self._enqueue(instance_name, 'delete', key)
+
+    async def get_many(self, instance_name: str, keys: list) -> dict:
+        return await self.connector.get_many(instance_name, keys)
+
+    async def set_many(self, instance_name: str, values: dict, ttl=None) -> None:
+        await self.connector.set_many(instance_name, values, ttl)
+
+    async def delete_many(self, instance_name: str, keys: list) -> None:
+        await self.connector.delete_many(instance_name, keys)
+
+    async def touch_many(self, instance_name: str, keys: list, ttl: int) -> None:
+        await self.connector.touch_many(instance_name, keys, ttl)
+
+    async def clear_expired(self, instance_name: str) -> None:
+        await self.connector.clear_expired(instance_name)
+
+    async def aiter_items(self, instance_name: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        async for item in self.connector.aiter_items(instance_name, batch_size):
+            yield item
+
+    async def incr(self, instance_name: str, key: str) -> int:
+        return await self.connector.incr(instance_name, key)
+
+    async def get_counters(self, instance_name: str, keys: list) -> dict:
+        return await self.connector.get_counters(instance_name, keys)
+
+    async def index_add(self, instance_name: str, index: str, member: str, ttl=None) -> None:
+        await self.connector.index_add(instance_name, index, member, ttl)
+
+    async def index_remove(self, instance_name: str, index: str, members: list) -> None:
+        await self.connector.index_remove(instance_name, index, members)
+
+    async def index_members(self, instance_name: str, index: str) -> list:
+        return await self.connector.index_members(instance_name, index)
+
+    async def index_pop(self, instance_name: str, index: str) -> list:
+        return await self.connector.index_pop(instance_name, index)
+
+    async def acquire_lock(self, instance_name: str, key: str, token: str, ttl: int) -> bool:
+        return await self.connector.acquire_lock(instance_name, key, token, ttl)
+
+    async def release_lock(self, instance_name: str, key: str, token: str) -> None:
+        await self.connector.release_lock(instance_name, key, token)
+
+    async def publish_invalidation(self, instance_name: str, origin: str, keys: list) -> None:
+        await self.connector.publish_invalidation(instance_name, origin, keys)
+
+    async def subscribe_invalidations(self, instance_name: str, callback) -> None:
+        await self.connector.subscribe_invalidations(instance_name, callback)
+
+    async def close(self, instance_name: str) -> None:
+        """
+        Wait for the queued calls to be sent, then close the wrapped connector.
+        """
+        while instance_name in self.flushing or self.pending.get(instance_name):
+            flushing = self.flushing.get(instance_name)
+            if flushing is not None:
+                await flushing
+            else:
+                self._start_flush(instance_name)
+        await self.connector.close(instance_name)
@@ -0,0 +1,42 @@
+""" Builds the cache connector selected by the `CACHE_STORAGE_TYPE` setting. """
+
+from core.cache_storage.connectors.base import BaseConnector
+from core.cache_storage.connectors.sqlite import SQLiteConnector
+from core.cache_storage.connectors.redis import RedisConnector
+from core.cache_storage.connectors.system import SystemConnector
+from core.cache_storage.connectors.memcached import MemcachedConnector
+from core.cache_storage.connectors.shared_memory import SharedMemoryConnector
+from core.cache_storage.connectors.sharded import ShardedConnector
+
+def make_connector(connector_type: str, **kwargs) -> BaseConnector:
+    """
+    Build a connector from its type.
+    - A list of Redis or Memcached URLs builds one connector per node behind a `ShardedConnector`.
+
+    Args:
+        connector_type (str): The type of connector, one of sqlite, redis, system, memcached and shared_memory.
+        kwargs: Additional keyword arguments to pass to the connector.
+
+    Returns:
+        BaseConnector: The connector.
+
+    Raises:
+        ValueError: If no connector exists with the given type.
+    """
+    connector_type = connector_type.lower()
+    if connector_type == 'sqlite':
+        return SQLiteConnector(**kwargs)
+    if connector_type == 'redis':
+        if isinstance(kwargs.get('redis_url'), list):
+            # Several nodes, spread the keys over them
+            return ShardedConnector({url: RedisConnector(url) for url in kwargs['redis_url']})
+        return RedisConnector(**kwargs)
+    if connector_type == 'system':
+        return SystemConnector(**kwargs)
+    if connector_type == 'memcached':
+        if isinstance(kwargs.get('memcached_url'), list):
+            return ShardedConnector({url: MemcachedConnector(url) for url in kwargs['memcached_url']})
+        return MemcachedConnector(**kwargs)
+    if connector_type == 'shared_memory':
+        return SharedMemoryConnector(**kwargs)
+    raise ValueError('Invalid connector type: {}'.format(connector_type))
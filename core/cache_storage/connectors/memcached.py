@@ -1,8 +1,11 @@
 """ This module contains the MemcachedConnector class. """
 
+import asyncio
+import time
 import aiomcache
-import pickle
-from core.cache_storage.connectors.base import BaseConnector
+import aiomcache.exceptions
+import ujson
+from core.cache_storage.connectors.base import BaseConnector, DEFAULT_BATCH_SIZE
 
 class MemcachedConnector(BaseConnector):
     """
@@ -35,7 +38,7 @@ class MemcachedConnector(BaseConnector):
         instance_key = f"{instance_name}:{key}".encode()
         value = await self.client.get(instance_key)
         if value:
-            return pickle.loads(value)
+            return value
         return None
 
     async def set(self, instance_name: str, key: str, value, ttl=None) -> None:
@@ -48,12 +51,99 @@ class MemcachedConnector(BaseConnector):
             ttl (int, optional): The time-to-live in seconds. Defaults to None.
         """
         instance_key = f"{instance_name}:{key}".encode()
-        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
         if ttl:
             await self.client.set(instance_key, value, exptime=ttl)
         else:
             await self.client.set(instance_key, value)
 
+    async def get_many(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several values from the cache with a single multi-get.
+
+        Args:
+            keys (list): The keys of the cache.
+
+        Returns:
+            dict: The cached values keyed by their key, missing keys are left out.
+        """
+        values = await self.client.multi_get(*[f"{instance_name}:{key}".encode() for key in keys])
+        return {
+            key: value
+            for key, value in zip(keys, values) if value
+        }
+
+    async def set_many(self, instance_name: str, values: dict, ttl=None) -> None:
+        """
+        Add several values to the cache.
+        - Memcached has no multi-set, so the writes are issued concurrently over the client pool.
+
+        Args:
+            values (dict): The values to be cached keyed by their key.
+            ttl (int, optional): The time-to-live in seconds. Defaults to None.
+        """
+        await asyncio.gather(*(
+            self.client.set(
+                f"{instance_name}:{key}".encode(),
+                value,
+                exptime=ttl or 0
+            )
+            for key, value in values.items()
+        ))
+
+    async def delete_many(self, instance_name: str, keys: list) -> None:
+        """
+        Remove several values from the cache.
+        - Memcached has no multi-delete, so the deletes are issued concurrently over the client pool.
+
+        Args:
+            keys (list): The keys of the cache.
+        """
+        await asyncio.gather(*(
+            self.client.delete(f"{instance_name}:{key}".encode())
+            for key in keys
+        ))
+
+    async def acquire_lock(self, instance_name: str, key: str, token: str, ttl: int) -> bool:
+        """
+        Take a lock with `add`, which only succeeds if the lock key doesn't exist yet.
+
+        Args:
+            key (str): The key being locked.
+            token (str): A unique value identifying the holder.
+            ttl (int): The number of seconds before the lock is released on its own.
+
+        Returns:
+            bool: True if the lock was taken.
+        """
+        return await self.client.add(f"lock:{instance_name}:{key}".encode(), token.encode(), exptime=ttl)
+
+    async def release_lock(self, instance_name: str, key: str, token: str) -> None:
+        """
+        Release a lock, only if it is still held with the given token.
+        - Memcached can't compare and delete atomically, the lock ttl covers the small race left.
+
+        Args:
+            key (str): The key being locked.
+            token (str): The value the lock was taken with.
+        """
+        lock_key = f"lock:{instance_name}:{key}".encode()
+        if await self.client.get(lock_key) == token.encode():
+            await self.client.delete(lock_key)
+
+    async def touch_many(self, instance_name: str, keys: list, ttl: int) -> None:
+        """
+        Push back the expiry of several values.
+        - Memcached has no multi-touch, so the touches are issued concurrently over the client pool.
+
+        Args:
+            keys (list): The keys of the cache.
+            ttl (int): The new time-to-live in seconds, counted from now.
+        """
+        await asyncio.gather(*(
+            self.client.touch(f"{instance_name}:{key}".encode(), ttl)
+            for key in keys
+        ))
+
     async def clear_expired(self, instance_name: str) -> None:
         """
         Clear expired cache entries from the Memcached database.
@@ -71,16 +161,147 @@ class MemcachedConnector(BaseConnector):
         instance_key = f"{instance_name}:{key}".encode()
         await self.client.delete(instance_key)
 
-    async def get_all_values(self, instance_name: str) -> list:
+    async def aiter_items(self, instance_name: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Iterate over every key and value in the cache.
+        - The memcached protocol has no way to enumerate keys, so this is not supported.
+
+        Raises:
+            NotImplementedError: Always.
+        """
+        raise NotImplementedError("Memcached does not support iterating over cached values")
+        yield # Makes this method an async generator like the other connectors
+
+    async def incr(self, instance_name: str, key: str) -> int:
+        """
+        Atomically increment a counter with INCR, creating it with ADD on first use.
+        - Memcached may evict counters under memory pressure like any other item, which resets them.
+
+        Args:
+            key (str): The name of the counter.
+
+        Returns:
+            int: The value of the counter after the increment.
+        """
+        counter_key = f"counter:{instance_name}:{key}".encode()
+        try:
+            return await self.client.incr(counter_key)
+        except aiomcache.exceptions.ClientException:
+            # The counter doesn't exist yet, ADD only succeeds for one worker, the others retry the INCR
+            if await self.client.add(counter_key, b'1'):
+                return 1
+            return await self.client.incr(counter_key)
+
+    async def get_counters(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several counters with a single multi-get.
+
+        Args:
+            keys (list): The names of the counters.
+
+        Returns:
+            dict: The counter values keyed by their name, counters never incremented are left out.
+        """
+        values = await self.client.multi_get(*[f"counter:{instance_name}:{key}".encode() for key in keys])
+        return {key: int(value) for key, value in zip(keys, values) if value is not None}
+
+    async def _update_index(self, instance_name: str, index: str, update) -> list:
+        """
+        Apply a change to an index item with a GETS/CAS loop, so concurrent changes from other workers aren't lost.
+        - The item holds a JSON object of members and their expiry time, and expires with its newest member.
+
+        Args:
+            index (str): The name of the index.
+            update: Called with the live members dict, changes it in place.
+
+        Returns:
+            list: The live members before the change.
+        """
+        index_key = f"index:{instance_name}:{index}".encode()
+        while True:
+            raw, cas_token = await self.client.gets(index_key)
+            now = time.time()
+            members = {
+                member: expires_at
+                for member, expires_at in (ujson.loads(raw) if raw is not None else {}).items()
+                if expires_at is None or expires_at > now
+            }
+            live = list(members)
+            update(members)
+
+            if not members and raw is None:
+                return live
+            if not members:
+                # Empty the item with CAS rather than DELETE, which would drop a member added meanwhile
+                value, exptime = b'{}', 1
+            else:
+                expires = list(members.values())
+                value = ujson.dumps(members).encode()
+                exptime = 0 if None in expires else int(max(expires) - now) + 1
+            if raw is None:
+                if await self.client.add(index_key, value, exptime):
+                    return live
+            elif await self.client.cas(index_key, value, cas_token, exptime):
+                return live
+            # Another worker changed the index in between, start over from its version
+
+    async def index_add(self, instance_name: str, index: str, member: str, ttl=None) -> None:
+        """
+        Add a member to a secondary index.
+
+        Args:
+            index (str): The name of the index.
+            member (str): The member to add.
+            ttl (int, optional): The time-to-live of the member in seconds. Defaults to None.
+        """
+        expires_at = time.time() + ttl if ttl else None
+        await self._update_index(instance_name, index, lambda members: members.__setitem__(member, expires_at))
+
+    async def index_remove(self, instance_name: str, index: str, members: list) -> None:
+        """
+        Remove members from a secondary index.
+
+        Args:
+            index (str): The name of the index.
+            members (list): The members to remove.
         """
-        Retrieve all values from the cache.
+        def remove(indexed: dict) -> None:
+            for member in members:
+                indexed.pop(member, None)
+        await self._update_index(instance_name, index, remove)
+
+    async def index_members(self, instance_name: str, index: str) -> list:
+        """
+        Retrieve the live members of a secondary index.
+
+        Args:
+            index (str): The name of the index.
 
         Returns:
-            list: All values in the cache.
-        """
-        keys = await self.client._execute_simple_command(conn=self.client, command=b'keys', key=instance_name.encode())
-        values = []
-        for key in keys:
-            value = await self.client.get(key)
-            values.append(pickle.loads(value))
-        return values
+            list: The members that haven't expired.
+        """
+        raw = await self.client.get(f"index:{instance_name}:{index}".encode())
+        if raw is None:
+            return []
+        now = time.time()
+        return [member for member, expires_at in ujson.loads(raw).items() if expires_at is None or expires_at > now]
+
+    async def index_pop(self, instance_name: str, index: str) -> list:
+        """
+        Retrieve the live members of a secondary index and delete it.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        return await self._update_index(instance_name, index, dict.clear)
+
+    async def close(self, instance_name: str) -> None:
+        """
+        Close the Memcached client pool.
+        """
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
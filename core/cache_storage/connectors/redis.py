@@ -1,8 +1,31 @@
 """ This module contains the RedisConnector class that manages the Redis cache. """
 
+import asyncio
+import time
 import aioredis
-import pickle
-from core.cache_storage.connectors.base import BaseConnector
+from core.cache_storage.connectors.base import BaseConnector, DEFAULT_BATCH_SIZE
+
+# Deletes the lock only if it still holds the caller's token
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Adds a member scored by its expiry, drops the expired ones and lets the set expire with its newest member.
+# ARGV: member, score (+inf for never), now
+INDEX_ADD_SCRIPT = """
+redis.call("zadd", KEYS[1], ARGV[2], ARGV[1])
+redis.call("zremrangebyscore", KEYS[1], "-inf", ARGV[3])
+local newest = redis.call("zrange", KEYS[1], -1, -1, "WITHSCORES")[2]
+if newest == "inf" then
+    redis.call("persist", KEYS[1])
+else
+    redis.call("pexpireat", KEYS[1], math.ceil(tonumber(newest) * 1000))
+end
+return 1
+"""
 
 class RedisConnector(BaseConnector):
     """
@@ -14,12 +37,13 @@ class RedisConnector(BaseConnector):
     def __init__(self, redis_url: str):
         self.redis_url = redis_url
         self.conn = None
+        self.invalidation_task = None
 
     async def __async__init__(self, instance_name: str) -> None:
         """
         Initializes the Redis connection.
         """
-        self.conn = await aioredis.create_redis_pool(self.redis_url)
+        self.conn = aioredis.from_url(self.redis_url)
 
     async def get(self, instance_name: str, key: str):
         """
@@ -34,7 +58,7 @@ class RedisConnector(BaseConnector):
         instance_key = f"{instance_name}:{key}"
         value = await self.conn.get(instance_key)
         if value:
-            return pickle.loads(value)
+            return value
         return None
 
     async def set(self, instance_name: str, key: str, value, ttl=None):
@@ -47,12 +71,62 @@ class RedisConnector(BaseConnector):
             ttl (int, optional): The time-to-live in seconds. Defaults to None.
         """
         instance_key = f"{instance_name}:{key}"
-        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
         if ttl:
             await self.conn.setex(instance_key, ttl, value)
         else:
             await self.conn.set(instance_key, value)
 
+    async def get_many(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several values from the cache with a single MGET.
+
+        Args:
+            keys (list): The keys of the cache.
+
+        Returns:
+            dict: The cached values keyed by their key, missing keys are left out.
+        """
+        values = await self.conn.mget([f"{instance_name}:{key}" for key in keys])
+        return {
+            key: value
+            for key, value in zip(keys, values) if value
+        }
+
+    async def set_many(self, instance_name: str, values: dict, ttl=None) -> None:
+        """
+        Add several values to the cache with a single pipeline.
+
+        Args:
+            values (dict): The values to be cached keyed by their key.
+            ttl (int, optional): The time-to-live in seconds. Defaults to None.
+        """
+        pipe = self.conn.pipeline(transaction=False)
+        for key, value in values.items():
+            pipe.set(f"{instance_name}:{key}", value, ex=ttl or None)
+        await pipe.execute()
+
+    async def delete_many(self, instance_name: str, keys: list) -> None:
+        """
+        Remove several values from the cache with a single DEL.
+
+        Args:
+            keys (list): The keys of the cache.
+        """
+        await self.conn.delete(*[f"{instance_name}:{key}" for key in keys])
+
+    async def touch_many(self, instance_name: str, keys: list, ttl: int) -> None:
+        """
+        Push back the expiry of several values with a single pipeline of EXPIRE.
+
+        Args:
+            keys (list): The keys of the cache.
+            ttl (int): The new time-to-live in seconds, counted from now.
+        """
+        pipe = self.conn.pipeline(transaction=False)
+        for key in keys:
+            pipe.expire(f"{instance_name}:{key}", ttl)
+        await pipe.execute()
+
     async def clear_expired(self, instance_name: str) -> None:
         """
         Clear expired cache entries from the Redis database.
@@ -71,16 +145,189 @@ class RedisConnector(BaseConnector):
         instance_key = f"{instance_name}:{key}"
         await self.conn.delete(instance_key)
 
-    async def get_all_values(self, instance_name: str) -> list:
+    async def aiter_items(self, instance_name: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Iterate over every key and value in the cache with SCAN, fetching each page with a single MGET.
+        - Unlike KEYS, SCAN never blocks the Redis server for the whole keyspace.
+
+        Args:
+            batch_size (int, optional): The SCAN count hint per round trip. Defaults to 500.
+
+        Yields:
+            tuple: The key and value of each cached entry.
         """
-        Retrieve all values from the cache.
+        prefix_length = len(instance_name) + 1
+        cursor = 0
+        while True:
+            cursor, keys = await self.conn.scan(cursor, match=f"{instance_name}:*", count=batch_size)
+            if keys:
+                for key, value in zip(keys, await self.conn.mget(keys)):
+                    # Keys may expire between the SCAN and the MGET
+                    if value:
+                        yield (key.decode() if isinstance(key, bytes) else key)[prefix_length:], value
+            if cursor == 0:
+                break
+
+    async def incr(self, instance_name: str, key: str) -> int:
+        """
+        Atomically increment a counter with INCR.
+        - Counters live outside the instance key prefix, so SCAN never returns them.
+
+        Args:
+            key (str): The name of the counter.
 
         Returns:
-            list: All values in the cache.
+            int: The value of the counter after the increment.
         """
-        keys = await self.conn.keys(f"{instance_name}:*")
-        values = []
-        for key in keys:
-            value = await self.conn.get(key)
-            values.append(pickle.loads(value))
-        return values
\ No newline at end of file
+        return await self.conn.incr(f"counter:{instance_name}:{key}")
+
+    async def get_counters(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several counters with a single MGET.
+
+        Args:
+            keys (list): The names of the counters.
+
+        Returns:
+            dict: The counter values keyed by their name, counters never incremented are left out.
+        """
+        values = await self.conn.mget([f"counter:{instance_name}:{key}" for key in keys])
+        return {key: int(value) for key, value in zip(keys, values) if value is not None}
+
+    async def index_add(self, instance_name: str, index: str, member: str, ttl=None) -> None:
+        """
+        Add a member to a secondary index, a sorted set scored by the expiry time of each member.
+        - The set itself expires with its newest member, never while a member without a TTL is in it.
+        - Members that expired meanwhile are dropped, so the set doesn't grow without bound.
+
+        Args:
+            index (str): The name of the index.
+            member (str): The member to add.
+            ttl (int, optional): The time-to-live of the member in seconds. Defaults to None.
+        """
+        now = time.time()
+        await self.conn.eval(
+            INDEX_ADD_SCRIPT, 1, f"index:{instance_name}:{index}",
+            member, now + ttl if ttl else '+inf', now
+        )
+
+    async def index_remove(self, instance_name: str, index: str, members: list) -> None:
+        """
+        Remove members from a secondary index.
+
+        Args:
+            index (str): The name of the index.
+            members (list): The members to remove.
+        """
+        if members:
+            await self.conn.zrem(f"index:{instance_name}:{index}", *members)
+
+    async def index_members(self, instance_name: str, index: str) -> list:
+        """
+        Retrieve the live members of a secondary index with ZRANGEBYSCORE.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        members = await self.conn.zrangebyscore(f"index:{instance_name}:{index}", f"({time.time()}", '+inf')
+        return [member.decode() if isinstance(member, bytes) else member for member in members]
+
+    async def index_pop(self, instance_name: str, index: str) -> list:
+        """
+        Read and delete a secondary index in one MULTI/EXEC transaction.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        index_key = f"index:{instance_name}:{index}"
+        pipe = self.conn.pipeline(transaction=True)
+        pipe.zrangebyscore(index_key, f"({time.time()}", '+inf')
+        pipe.delete(index_key)
+        members, _ = await pipe.execute()
+        return [member.decode() if isinstance(member, bytes) else member for member in members]
+
+    async def acquire_lock(self, instance_name: str, key: str, token: str, ttl: int) -> bool:
+        """
+        Take a lock with SET NX, expiring on its own after the ttl.
+
+        Args:
+            key (str): The key being locked.
+            token (str): A unique value identifying the holder.
+            ttl (int): The number of seconds before the lock is released on its own.
+
+        Returns:
+            bool: True if the lock was taken.
+        """
+        return bool(await self.conn.set(f"lock:{instance_name}:{key}", token, nx=True, ex=ttl))
+
+    async def release_lock(self, instance_name: str, key: str, token: str) -> None:
+        """
+        Release a lock, only if it is still held with the given token.
+
+        Args:
+            key (str): The key being locked.
+            token (str): The value the lock was taken with.
+        """
+        await self.conn.eval(RELEASE_LOCK_SCRIPT, 1, f"lock:{instance_name}:{key}", token)
+
+    async def publish_invalidation(self, instance_name: str, origin: str, keys: list) -> None:
+        """
+        Publish changed keys on the instance invalidation channel.
+
+        Args:
+            origin (str): The id of the publishing cache manager.
+            keys (list): The keys that changed.
+        """
+        await self.conn.publish(f"{instance_name}:invalidations", "\0".join([origin, *keys]))
+
+    async def subscribe_invalidations(self, instance_name: str, callback) -> None:
+        """
+        Listen on the instance invalidation channel in a background task.
+
+        Args:
+            callback: Called with the origin and keys of every invalidation.
+        """
+        self.invalidation_task = asyncio.create_task(self._listen_invalidations(instance_name, callback))
+
+    async def _listen_invalidations(self, instance_name: str, callback) -> None:
+        """
+        Relay invalidation messages to the callback, resubscribing if the connection drops.
+        """
+        while True:
+            pubsub = self.conn.pubsub()
+            try:
+                await pubsub.subscribe(f"{instance_name}:invalidations")
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    origin, *keys = message["data"].decode().split("\0")
+                    callback(origin, keys)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Messages published while disconnected are lost, so everything cached may be stale
+                callback(None, None)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    async def close(self, instance_name: str) -> None:
+        """
+        Stop listening for invalidations and close the Redis connection pool.
+        """
+        if self.invalidation_task is not None:
+            self.invalidation_task.cancel()
+            try:
+                await self.invalidation_task
+            except asyncio.CancelledError:
+                pass
+            self.invalidation_task = None
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
@@ -0,0 +1,298 @@
+""" This module contains the ShardedConnector class that spreads keys over several connectors. """
+
+import asyncio
+import bisect
+import hashlib
+from core.cache_storage.connectors.base import BaseConnector, DEFAULT_BATCH_SIZE
+
+DEFAULT_VNODES = 160
+
+def _hash(value: str) -> int:
+    """
+    A hash that is the same in every worker and release, unlike `hash()`.
+    """
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'little')
+
+class ShardedConnector(BaseConnector):
+    """
+    A caching manager that routes keys over several child connectors with consistent hashing.
+    - Every node owns `vnodes` points on a hash ring, a key goes to the node owning the next point,
+      so adding or removing one of N nodes only moves about 1/N of the keys.
+    - Batch operations are split per node and sent to the nodes in parallel.
+
+    Args:
+        connectors (dict): The child connectors keyed by a stable node name, such as their URL.
+        vnodes (int, optional): The number of ring points per node. Defaults to 160.
+    """
+    def __init__(self, connectors: dict, vnodes: int = DEFAULT_VNODES):
+        if not connectors:
+            raise ValueError('ShardedConnector needs at least one connector')
+        self.connectors = connectors
+        ring = sorted(
+            (_hash(f'{name}#{vnode}'), name)
+            for name in connectors
+            for vnode in range(vnodes)
+        )
+        self.ring_hashes = [point for point, _ in ring]
+        self.ring_nodes = [connectors[name] for _, name in ring]
+
+    def _node(self, key: str) -> BaseConnector:
+        """
+        Find the connector owning a key.
+        """
+        index = bisect.bisect(self.ring_hashes, _hash(key))
+        return self.ring_nodes[index % len(self.ring_nodes)]
+
+    def _group(self, keys) -> dict:
+        """
+        Split keys by the connector owning them.
+        """
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._node(key), []).append(key)
+        return groups
+
+    async def __async__init__(self, instance_name: str) -> None:
+        """
+        Initialize every child connector.
+        """
+        await asyncio.gather(*(connector.__async__init__(instance_name) for connector in self.connectors.values()))
+
+    async def get(self, instance_name: str, key: str):
+        """
+        Retrieve a value from the cache based on the key.
+
+        Args:
+            key (str): The key of the cache.
+
+        Returns:
+            The cached value if found, otherwise None.
+        """
+        return await self._node(key).get(instance_name, key)
+
+    async def set(self, instance_name: str, key: str, value, ttl=None) -> None:
+        """
+        Add a value to the cache.
+
+        Args:
+            key (str): The key of the cache.
+            value: The value to be cached.
+            ttl (int, optional): The time-to-live in seconds. Defaults to None.
+        """
+        await self._node(key).set(instance_name, key, value, ttl)
+
+    async def get_many(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several values from the cache, with one request per node.
+
+        Args:
+            keys (list): The keys of the cache.
+
+        Returns:
+            dict: The cached values keyed by their key, missing keys are left out.
+        """
+        values = {}
+        for found in await asyncio.gather(*(
+            connector.get_many(instance_name, node_keys)
+            for connector, node_keys in self._group(keys).items()
+        )):
+            values.update(found)
+        return values
+
+    async def set_many(self, instance_name: str, values: dict, ttl=None) -> None:
+        """
+        Add several values to the cache, with one request per node.
+
+        Args:
+            values (dict): The values to be cached keyed by their key.
+            ttl (int, optional): The time-to-live in seconds. Defaults to None.
+        """
+        await asyncio.gather(*(
+            connector.set_many(instance_name, {key: values[key] for key in node_keys}, ttl)
+            for connector, node_keys in self._group(values).items()
+        ))
+
+    async def delete_many(self, instance_name: str, keys: list) -> None:
+        """
+        Remove several values from the cache, with one request per node.
+
+        Args:
+            keys (list): The keys of the cache.
+        """
+        await asyncio.gather(*(
+            connector.delete_many(instance_name, node_keys)
+            for connector, node_keys in self._group(keys).items()
+        ))
+
+    async def touch_many(self, instance_name: str, keys: list, ttl: int) -> None:
+        """
+        Push back the expiry of several values, with one request per node.
+
+        Args:
+            keys (list): The keys of the cache.
+            ttl (int): The new time-to-live in seconds, counted from now.
+        """
+        await asyncio.gather(*(
+            connector.touch_many(instance_name, node_keys, ttl)
+            for connector, node_keys in self._group(keys).items()
+        ))
+
+    async def clear_expired(self, instance_name: str) -> None:
+        """
+        Clear expired cache entries on every node.
+        """
+        await asyncio.gather(*(connector.clear_expired(instance_name) for connector in self.connectors.values()))
+
+    async def delete(self, instance_name: str, key: str) -> None:
+        """
+        Remove a value from the cache based on the key.
+
+        Args:
+            key (str): The key of the cache.
+        """
+        await self._node(key).delete(instance_name, key)
+
+    async def aiter_items(self, instance_name: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Iterate over every key and value in the cache, one node after the other.
+
+        Args:
+            batch_size (int, optional): The number of values fetched per round trip. Defaults to 500.
+
+        Yields:
+            tuple: The key and value of each cached entry.
+        """
+        for connector in self.connectors.values():
+            async for item in connector.aiter_items(instance_name, batch_size):
+                yield item
+
+    async def incr(self, instance_name: str, key: str) -> int:
+        """
+        Increment a counter on the node owning it.
+
+        Args:
+            key (str): The name of the counter.
+
+        Returns:
+            int: The value of the counter after the increment.
+        """
+        return await self._node(key).incr(instance_name, key)
+
+    async def get_counters(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several counters, with one request per node.
+
+        Args:
+            keys (list): The names of the counters.
+
+        Returns:
+            dict: The counter values keyed by their name, counters never incremented are left out.
+        """
+        counters = {}
+        for found in await asyncio.gather(*(
+            connector.get_counters(instance_name, node_keys)
+            for connector, node_keys in self._group(keys).items()
+        )):
+            counters.update(found)
+        return counters
+
+    async def index_add(self, instance_name: str, index: str, member: str, ttl=None) -> None:
+        """
+        Add a member to a secondary index on the node owning the index.
+
+        Args:
+            index (str): The name of the index.
+            member (str): The member to add.
+            ttl (int, optional): The time-to-live of the member in seconds. Defaults to None.
+        """
+        await self._node(index).index_add(instance_name, index, member, ttl)
+
+    async def index_remove(self, instance_name: str, index: str, members: list) -> None:
+        """
+        Remove members from a secondary index on the node owning the index.
+
+        Args:
+            index (str): The name of the index.
+            members (list): The members to remove.
+        """
+        await self._node(index).index_remove(instance_name, index, members)
+
+    async def index_members(self, instance_name: str, index: str) -> list:
+        """
+        Retrieve the live members of a secondary index from the node owning the index.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        return await self._node(index).index_members(instance_name, index)
+
+    async def index_pop(self, instance_name: str, index: str) -> list:
+        """
+        Retrieve the live members of a secondary index and delete it on the node owning the index.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        return await self._node(index).index_pop(instance_name, index)
+
+    async def acquire_lock(self, instance_name: str, key: str, token: str, ttl: int) -> bool:
+        """
+        Try to take a lock on the node owning the key.
+
+        Args:
+            key (str): The key being locked.
+            token (str): A unique value identifying the holder.
+            ttl (int): The number of seconds before the lock is released on its own.
+
+        Returns:
+            bool: True if the lock was taken.
+        """
+        return await self._node(key).acquire_lock(instance_name, key, token, ttl)
+
+    async def release_lock(self, instance_name: str, key: str, token: str) -> None:
+        """
+        Release a lock on the node owning the key.
+
+        Args:
+            key (str): The key being locked.
+            token (str): The value the lock was taken with.
+        """
+        await self._node(key).release_lock(instance_name, key, token)
+
+    async def publish_invalidation(self, instance_name: str, origin: str, keys: list) -> None:
+        """
+        Publish invalidations on the node owning each key, every worker listens to every node.
+
+        Args:
+            origin (str): The id of the publishing cache manager.
+            keys (list): The keys that changed.
+        """
+        await asyncio.gather(*(
+            connector.publish_invalidation(instance_name, origin, node_keys)
+            for connector, node_keys in self._group(keys).items()
+        ))
+
+    async def subscribe_invalidations(self, instance_name: str, callback) -> None:
+        """
+        Start delivering invalidations published on any node.
+
+        Args:
+            callback: Called with the origin and keys of every invalidation, or with
+                (None, None) when messages may have been missed and everything must be dropped.
+        """
+        await asyncio.gather(*(
+            connector.subscribe_invalidations(instance_name, callback)
+            for connector in self.connectors.values()
+        ))
+
+    async def close(self, instance_name: str) -> None:
+        """
+        Close every child connector.
+        """
+        await asyncio.gather(*(connector.close(instance_name) for connector in self.connectors.values()))
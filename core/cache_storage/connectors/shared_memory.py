@@ -0,0 +1,669 @@
+""" This module contains the SharedMemoryConnector class. """
+
+import asyncio
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+import ujson
+from core.cache_storage.connectors.base import BaseConnector, DEFAULT_BATCH_SIZE
+
+MAGIC = b'CSCSHM01'
+# magic, bucket count, slots per bucket, key size, inline size, chunk size, chunk count, free list head, free chunks
+HEADER = struct.Struct('<8sIIIIIIII')
+HEADER_SIZE = 64
+# state, key length, value length, key hash, expiry (0 for never), first arena chunk
+SLOT = struct.Struct('<BBxxIQdI4x')
+# next chunk
+CHUNK = struct.Struct('<I')
+COUNTER_VALUE = struct.Struct('<q')
+NO_CHUNK = 0xFFFFFFFF
+
+EMPTY = 0
+VALUE = 1
+LOCK = 2
+COUNTER = 3
+INDEX = 4
+
+# Byte offsets locked with fcntl for the whole file setup and the arena free list,
+# buckets are locked on the first byte of their slots
+INIT_LOCK = 0
+ARENA_LOCK = 1
+
+# Buckets checked between yields to the event loop while sweeping
+SWEEP_BUCKETS = 1024
+
+def _hash(key: bytes) -> int:
+    """
+    A hash of the key that is the same in every worker, unlike `hash()`.
+    """
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+class SharedMemoryConnector(BaseConnector):
+    """
+    A caching manager that stores cache in a memory mapped file shared by every worker on the host.
+    - Keys hash to a bucket of fixed-size slots, each bucket has its own lock so workers rarely wait on each other.
+    - Values up to `inline_size` bytes live in their slot, larger ones in chained chunks of an overflow arena.
+    - When a bucket is full, the value that expires first is evicted. Slots holding anything else are never
+      evicted, a bucket without a value to evict refuses new keys with MemoryError.
+
+    Args:
+        directory (str, optional): Where the cache files are created. Defaults to /dev/shm, or the temporary directory.
+        max_entries (int, optional): The number of slots per instance. Defaults to 65536.
+        arena_bytes (int, optional): The size of the overflow arena per instance. Defaults to 64 MiB.
+        slots_per_bucket (int, optional): The number of slots per bucket. Defaults to 8.
+        key_size (int, optional): The maximum key length in bytes. Defaults to 128.
+        inline_size (int, optional): The largest value stored in its slot. Defaults to 256.
+        chunk_size (int, optional): The size of an arena chunk. Defaults to 1024.
+    """
+    is_local = True
+
+    def __init__(
+            self,
+            directory: str = None,
+            max_entries: int = 65536,
+            arena_bytes: int = 64 * 1024 * 1024,
+            slots_per_bucket: int = 8,
+            key_size: int = 128,
+            inline_size: int = 256,
+            chunk_size: int = 1024,
+        ):
+        """
+        Initializes the caching object.
+        """
+        if directory is None:
+            directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self.directory = directory
+        self.slots_per_bucket = slots_per_bucket
+        self.bucket_count = max(1, -(-(max_entries or 65536) // slots_per_bucket))
+        self.key_size = key_size
+        self.inline_size = inline_size
+        self.chunk_size = chunk_size
+        self.chunk_count = max(1, (arena_bytes or 0) // chunk_size)
+        self.slot_size = SLOT.size + key_size + inline_size
+        self.bucket_size = self.slot_size * slots_per_bucket
+        self.arena_offset = HEADER_SIZE + self.bucket_size * self.bucket_count
+        self.file_size = self.arena_offset + self.chunk_size * self.chunk_count
+        self.files = {}
+
+    async def __async__init__(self, instance_name: str) -> None:
+        """
+        Open, and create if needed, the shared file of an instance.
+        - The first worker to get the setup lock lays the file out, the others map it as is.
+        """
+        path = os.path.join(self.directory, f'cascade-cache-{instance_name}.shm')
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, INIT_LOCK)
+        try:
+            expected = (MAGIC, self.bucket_count, self.slots_per_bucket, self.key_size,
+                        self.inline_size, self.chunk_size, self.chunk_count)
+            current = None
+            if os.fstat(fd).st_size == self.file_size:
+                current = HEADER.unpack(os.pread(fd, HEADER.size, 0))[:7]
+            if current != expected:
+                # New file or changed geometry, start from an empty table
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.file_size)
+                mm = mmap.mmap(fd, self.file_size)
+                for index in range(self.chunk_count):
+                    CHUNK.pack_into(mm, self._chunk_offset(index), index + 1 if index + 1 < self.chunk_count else NO_CHUNK)
+                HEADER.pack_into(mm, 0, *expected, 0, self.chunk_count)
+                mm.flush()
+            else:
+                mm = mmap.mmap(fd, self.file_size)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, INIT_LOCK)
+        self.files[instance_name] = (fd, mm)
+
+    def _chunk_offset(self, index: int) -> int:
+        return self.arena_offset + index * self.chunk_size
+
+    @contextmanager
+    def _locked(self, fd: int, offset: int):
+        """
+        Hold an exclusive lock on one byte of the file, shared by every process mapping it.
+        - Critical sections never await, so coroutines of the same process don't interleave inside them.
+        """
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, offset)
+
+    def _encode_key(self, key: str) -> bytes:
+        raw = key.encode()
+        if len(raw) > self.key_size:
+            raise ValueError(f'Key is longer than {self.key_size} bytes: {key}')
+        return raw
+
+    def _bucket(self, key_hash: int) -> int:
+        return HEADER_SIZE + (key_hash % self.bucket_count) * self.bucket_size
+
+    def _find(self, mm: mmap.mmap, bucket: int, raw: bytes, key_hash: int, state: int) -> int | None:
+        """
+        Find the slot holding a key, expired or not. Must be called with the bucket locked.
+        """
+        for offset in range(bucket, bucket + self.bucket_size, self.slot_size):
+            slot_state, key_len, _, slot_hash, _, _ = SLOT.unpack_from(mm, offset)
+            if (
+                slot_state == state and slot_hash == key_hash and key_len == len(raw)
+                and mm[offset + SLOT.size:offset + SLOT.size + key_len] == raw
+            ):
+                return offset
+        return None
+
+    def _read_value(self, mm: mmap.mmap, offset: int, value_len: int, chunk: int) -> bytes:
+        """
+        Copy the value of a slot out of the inline area or its arena chunks.
+        """
+        if chunk == NO_CHUNK:
+            start = offset + SLOT.size + self.key_size
+            return mm[start:start + value_len]
+        parts = []
+        remaining = value_len
+        payload = self.chunk_size - CHUNK.size
+        while chunk != NO_CHUNK and remaining > 0:
+            start = self._chunk_offset(chunk)
+            size = min(payload, remaining)
+            parts.append(mm[start + CHUNK.size:start + CHUNK.size + size])
+            remaining -= size
+            chunk = CHUNK.unpack_from(mm, start)[0]
+        return b''.join(parts)
+
+    def _allocate(self, fd: int, mm: mmap.mmap, value: bytes) -> int | None:
+        """
+        Copy a value into a chain of free arena chunks.
+
+        Returns:
+            int | None: The first chunk, or None if the arena doesn't have enough free chunks.
+        """
+        payload = self.chunk_size - CHUNK.size
+        needed = -(-len(value) // payload)
+        with self._locked(fd, ARENA_LOCK):
+            header = HEADER.unpack_from(mm, 0)
+            free_head, free_count = header[7], header[8]
+            if free_count < needed:
+                return None
+            chunks = []
+            chunk = free_head
+            for _ in range(needed):
+                chunks.append(chunk)
+                chunk = CHUNK.unpack_from(mm, self._chunk_offset(chunk))[0]
+            HEADER.pack_into(mm, 0, *header[:7], chunk, free_count - needed)
+
+        # The chunks are unreachable by other workers until linked into a slot
+        for i, chunk in enumerate(chunks):
+            start = self._chunk_offset(chunk)
+            part = value[i * payload:(i + 1) * payload]
+            CHUNK.pack_into(mm, start, chunks[i + 1] if i + 1 < needed else NO_CHUNK)
+            mm[start + CHUNK.size:start + CHUNK.size + len(part)] = part
+        return chunks[0]
+
+    def _free(self, fd: int, mm: mmap.mmap, chunk: int) -> None:
+        """
+        Return a chain of arena chunks to the free list.
+        """
+        if chunk == NO_CHUNK:
+            return
+        last = chunk
+        count = 1
+        while True:
+            following = CHUNK.unpack_from(mm, self._chunk_offset(last))[0]
+            if following == NO_CHUNK:
+                break
+            last = following
+            count += 1
+        with self._locked(fd, ARENA_LOCK):
+            header = HEADER.unpack_from(mm, 0)
+            CHUNK.pack_into(mm, self._chunk_offset(last), header[7])
+            HEADER.pack_into(mm, 0, *header[:7], chunk, header[8] + count)
+
+    def _clear_slot(self, fd: int, mm: mmap.mmap, offset: int) -> None:
+        """
+        Empty a slot and free its arena chunks. Must be called with the bucket locked.
+        """
+        slot_state, _, _, _, _, chunk = SLOT.unpack_from(mm, offset)
+        if slot_state == EMPTY:
+            return
+        SLOT.pack_into(mm, offset, EMPTY, 0, 0, 0, 0.0, NO_CHUNK)
+        self._free(fd, mm, chunk)
+
+    def _get(self, instance_name: str, key: str, state: int = VALUE):
+        fd, mm = self.files[instance_name]
+        raw = self._encode_key(key)
+        key_hash = _hash(raw)
+        bucket = self._bucket(key_hash)
+        with self._locked(fd, bucket):
+            offset = self._find(mm, bucket, raw, key_hash, state)
+            if offset is None:
+                return None
+            _, _, value_len, _, expires_at, chunk = SLOT.unpack_from(mm, offset)
+            if expires_at and expires_at <= time.time():
+                self._clear_slot(fd, mm, offset)
+                return None
+            return self._read_value(mm, offset, value_len, chunk)
+
+    def _set(self, instance_name: str, key: str, value: bytes, ttl=None, state: int = VALUE, only_if_missing: bool = False) -> bool:
+        fd, mm = self.files[instance_name]
+        raw = self._encode_key(key)
+        key_hash = _hash(raw)
+        expires_at = time.time() + ttl if ttl else 0.0
+
+        chunk = NO_CHUNK
+        if len(value) > self.inline_size:
+            chunk = self._allocate(fd, mm, value)
+            if chunk is None:
+                # Make room by sweeping expired entries, then give up if the arena is still full
+                self._sweep(fd, mm, 0, self.bucket_count)
+                chunk = self._allocate(fd, mm, value)
+                if chunk is None:
+                    raise MemoryError(f'The shared memory cache arena is full, cannot store {key}')
+
+        bucket = self._bucket(key_hash)
+        with self._locked(fd, bucket):
+            target = self._find(mm, bucket, raw, key_hash, state)
+            if target is not None and only_if_missing:
+                slot_expires_at = SLOT.unpack_from(mm, target)[4]
+                if not slot_expires_at or slot_expires_at > time.time():
+                    self._free(fd, mm, chunk)
+                    return False
+            self._place(fd, mm, bucket, target, raw, key_hash, value, expires_at, state, chunk)
+        return True
+
+    def _place(self, fd: int, mm: mmap.mmap, bucket: int, target: int | None, raw: bytes, key_hash: int,
+               value: bytes, expires_at: float, state: int, chunk: int) -> None:
+        """
+        Write a key and value into its slot, or into a free or evicted one. Must be called with the bucket locked.
+
+        Raises:
+            MemoryError: If the bucket is full and holds no value to evict.
+        """
+        if target is None:
+            now = time.time()
+            victim_expires_at = None
+            for offset in range(bucket, bucket + self.bucket_size, self.slot_size):
+                slot_state, _, _, _, slot_expires_at, _ = SLOT.unpack_from(mm, offset)
+                if slot_state == EMPTY or (slot_expires_at and slot_expires_at <= now):
+                    target = offset
+                    break
+                if slot_state != VALUE:
+                    # Other slots hold state the workers rely on, such as locks
+                    continue
+                # Evict the value that expires first, values without a TTL last
+                rank = slot_expires_at or float('inf')
+                if victim_expires_at is None or rank < victim_expires_at:
+                    target, victim_expires_at = offset, rank
+            if target is None:
+                self._free(fd, mm, chunk)
+                raise MemoryError(f'The shared memory cache bucket is full, cannot store {raw.decode()}')
+        self._clear_slot(fd, mm, target)
+
+        if chunk == NO_CHUNK:
+            start = target + SLOT.size + self.key_size
+            mm[start:start + len(value)] = value
+        mm[target + SLOT.size:target + SLOT.size + len(raw)] = raw
+        SLOT.pack_into(mm, target, state, len(raw), len(value), key_hash, expires_at, chunk)
+
+    def _update_index(self, instance_name: str, index: str, update) -> list:
+        """
+        Apply a change to an index slot, read and written under the bucket lock.
+        - The slot holds a JSON object of members and their expiry time, and expires with its newest member.
+        - The arena isn't swept from inside the lock, a full arena raises MemoryError right away.
+
+        Args:
+            index (str): The name of the index.
+            update: Called with the live members dict, changes it in place.
+
+        Returns:
+            list: The live members before the change.
+        """
+        fd, mm = self.files[instance_name]
+        raw = self._encode_key(index)
+        key_hash = _hash(raw)
+        bucket = self._bucket(key_hash)
+        with self._locked(fd, bucket):
+            now = time.time()
+            members = {}
+            offset = self._find(mm, bucket, raw, key_hash, INDEX)
+            if offset is not None:
+                _, _, value_len, _, expires_at, chunk = SLOT.unpack_from(mm, offset)
+                if not expires_at or expires_at > now:
+                    members = {
+                        member: member_expires_at
+                        for member, member_expires_at in ujson.loads(self._read_value(mm, offset, value_len, chunk)).items()
+                        if member_expires_at is None or member_expires_at > now
+                    }
+            live = list(members)
+            update(members)
+
+            if not members:
+                if offset is not None:
+                    self._clear_slot(fd, mm, offset)
+                return live
+            expires = list(members.values())
+            value = ujson.dumps(members).encode()
+            chunk = NO_CHUNK
+            if len(value) > self.inline_size:
+                chunk = self._allocate(fd, mm, value)
+                if chunk is None:
+                    raise MemoryError(f'The shared memory cache arena is full, cannot store {index}')
+            self._place(fd, mm, bucket, offset, raw, key_hash, value, 0.0 if None in expires else max(expires), INDEX, chunk)
+        return live
+
+    def _delete(self, instance_name: str, key: str, state: int = VALUE, token: bytes = None) -> None:
+        fd, mm = self.files[instance_name]
+        raw = self._encode_key(key)
+        key_hash = _hash(raw)
+        bucket = self._bucket(key_hash)
+        with self._locked(fd, bucket):
+            offset = self._find(mm, bucket, raw, key_hash, state)
+            if offset is None:
+                return
+            if token is not None:
+                _, _, value_len, _, _, chunk = SLOT.unpack_from(mm, offset)
+                if self._read_value(mm, offset, value_len, chunk) != token:
+                    return
+            self._clear_slot(fd, mm, offset)
+
+    def _sweep(self, fd: int, mm: mmap.mmap, first: int, last: int) -> None:
+        """
+        Clear the expired slots of a range of buckets.
+        - Buckets are peeked without the lock and only locked when they hold an expired slot.
+        """
+        now = time.time()
+        for index in range(first, last):
+            bucket = HEADER_SIZE + index * self.bucket_size
+            offsets = range(bucket, bucket + self.bucket_size, self.slot_size)
+            if not any(self._expired(mm, offset, now) for offset in offsets):
+                continue
+            with self._locked(fd, bucket):
+                for offset in offsets:
+                    if self._expired(mm, offset, now):
+                        self._clear_slot(fd, mm, offset)
+
+    def _expired(self, mm: mmap.mmap, offset: int, now: float) -> bool:
+        slot_state, _, _, _, expires_at, _ = SLOT.unpack_from(mm, offset)
+        return slot_state != EMPTY and 0 < expires_at <= now
+
+    async def get(self, instance_name: str, key: str):
+        """
+        Retrieve a value from the cache based on the key.
+
+        Args:
+            key (str): The key of the cache.
+
+        Returns:
+            The cached value if found, otherwise None.
+        """
+        return self._get(instance_name, key)
+
+    async def set(self, instance_name: str, key: str, value, ttl=None) -> None:
+        """
+        Add a value to the cache.
+
+        Args:
+            key (str): The key of the cache.
+            value: The value to be cached.
+            ttl (int, optional): The time-to-live in seconds. Defaults to None.
+        """
+        self._set(instance_name, key, value, ttl)
+
+    async def get_many(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several values from the cache.
+
+        Args:
+            keys (list): The keys of the cache.
+
+        Returns:
+            dict: The cached values keyed by their key, missing keys are left out.
+        """
+        values = {}
+        for key in keys:
+            value = self._get(instance_name, key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    async def set_many(self, instance_name: str, values: dict, ttl=None) -> None:
+        """
+        Add several values to the cache.
+
+        Args:
+            values (dict): The values to be cached keyed by their key.
+            ttl (int, optional): The time-to-live in seconds. Defaults to None.
+        """
+        for key, value in values.items():
+            self._set(instance_name, key, value, ttl)
+
+    async def delete_many(self, instance_name: str, keys: list) -> None:
+        """
+        Remove several values from the cache.
+
+        Args:
+            keys (list): The keys of the cache.
+        """
+        for key in keys:
+            self._delete(instance_name, key)
+
+    async def touch_many(self, instance_name: str, keys: list, ttl: int) -> None:
+        """
+        Push back the expiry of several values, rewriting only the expiry field of their slots.
+
+        Args:
+            keys (list): The keys of the cache.
+            ttl (int): The new time-to-live in seconds, counted from now.
+        """
+        fd, mm = self.files[instance_name]
+        for key in keys:
+            raw = self._encode_key(key)
+            key_hash = _hash(raw)
+            bucket = self._bucket(key_hash)
+            with self._locked(fd, bucket):
+                offset = self._find(mm, bucket, raw, key_hash, VALUE)
+                if offset is None:
+                    continue
+                slot = SLOT.unpack_from(mm, offset)
+                now = time.time()
+                if slot[4] and slot[4] <= now:
+                    continue
+                SLOT.pack_into(mm, offset, *slot[:4], now + ttl, slot[5])
+
+    async def clear_expired(self, instance_name: str) -> None:
+        """
+        Clear expired cache entries, yielding to the event loop between groups of buckets.
+        """
+        fd, mm = self.files[instance_name]
+        for first in range(0, self.bucket_count, SWEEP_BUCKETS):
+            self._sweep(fd, mm, first, min(first + SWEEP_BUCKETS, self.bucket_count))
+            await asyncio.sleep(0)
+
+    async def delete(self, instance_name: str, key: str) -> None:
+        """
+        Remove a value from the cache based on the key.
+
+        Args:
+            key (str): The key of the cache.
+        """
+        self._delete(instance_name, key)
+
+    async def aiter_items(self, instance_name: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Iterate over every live key and value in the cache, one bucket lock at a time.
+
+        Args:
+            batch_size (int, optional): The number of values yielded between event loop yields. Defaults to 500.
+
+        Yields:
+            tuple: The key and value of each cached entry.
+        """
+        fd, mm = self.files[instance_name]
+        batch = []
+        for index in range(self.bucket_count):
+            bucket = HEADER_SIZE + index * self.bucket_size
+            now = time.time()
+            with self._locked(fd, bucket):
+                for offset in range(bucket, bucket + self.bucket_size, self.slot_size):
+                    slot_state, key_len, value_len, _, expires_at, chunk = SLOT.unpack_from(mm, offset)
+                    if slot_state == VALUE and (not expires_at or expires_at > now):
+                        key = mm[offset + SLOT.size:offset + SLOT.size + key_len].decode()
+                        batch.append((key, self._read_value(mm, offset, value_len, chunk)))
+            if len(batch) >= batch_size:
+                for item in batch:
+                    yield item
+                batch = []
+                await asyncio.sleep(0)
+        for item in batch:
+            yield item
+
+    async def incr(self, instance_name: str, key: str) -> int:
+        """
+        Atomically increment a counter, stored in a slot of its own kind under the bucket lock.
+
+        Args:
+            key (str): The name of the counter.
+
+        Returns:
+            int: The value of the counter after the increment.
+        """
+        fd, mm = self.files[instance_name]
+        raw = self._encode_key(key)
+        key_hash = _hash(raw)
+        bucket = self._bucket(key_hash)
+        while True:
+            with self._locked(fd, bucket):
+                offset = self._find(mm, bucket, raw, key_hash, COUNTER)
+                if offset is not None:
+                    start = offset + SLOT.size + self.key_size
+                    value = COUNTER_VALUE.unpack_from(mm, start)[0] + 1
+                    COUNTER_VALUE.pack_into(mm, start, value)
+                    return value
+            # Another worker may create the counter first, then increment theirs
+            if self._set(instance_name, key, COUNTER_VALUE.pack(1), state=COUNTER, only_if_missing=True):
+                return 1
+
+    async def get_counters(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several counters.
+
+        Args:
+            keys (list): The names of the counters.
+
+        Returns:
+            dict: The counter values keyed by their name, counters never incremented are left out.
+        """
+        counters = {}
+        for key in keys:
+            value = self._get(instance_name, key, state=COUNTER)
+            if value is not None:
+                counters[key] = COUNTER_VALUE.unpack(value)[0]
+        return counters
+
+    async def index_add(self, instance_name: str, index: str, member: str, ttl=None) -> None:
+        """
+        Add a member to a secondary index, stored in a slot of its own kind.
+
+        Args:
+            index (str): The name of the index.
+            member (str): The member to add.
+            ttl (int, optional): The time-to-live of the member in seconds. Defaults to None.
+        """
+        expires_at = time.time() + ttl if ttl else None
+        self._update_index(instance_name, index, lambda members: members.__setitem__(member, expires_at))
+
+    async def index_remove(self, instance_name: str, index: str, members: list) -> None:
+        """
+        Remove members from a secondary index.
+
+        Args:
+            index (str): The name of the index.
+            members (list): The members to remove.
+        """
+        def remove(indexed: dict) -> None:
+            for member in members:
+                indexed.pop(member, None)
+        self._update_index(instance_name, index, remove)
+
+    async def index_members(self, instance_name: str, index: str) -> list:
+        """
+        Retrieve the live members of a secondary index.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        value = self._get(instance_name, index, state=INDEX)
+        if value is None:
+            return []
+        now = time.time()
+        return [member for member, expires_at in ujson.loads(value).items() if expires_at is None or expires_at > now]
+
+    async def index_pop(self, instance_name: str, index: str) -> list:
+        """
+        Retrieve the live members of a secondary index and delete it, under the bucket lock.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        return self._update_index(instance_name, index, dict.clear)
+
+    async def acquire_lock(self, instance_name: str, key: str, token: str, ttl: int) -> bool:
+        """
+        Try to take a lock shared by every worker on the host, stored in a slot of its own kind.
+
+        Args:
+            key (str): The key being locked.
+            token (str): A unique value identifying the holder.
+            ttl (int): The number of seconds before the lock is released on its own.
+
+        Returns:
+            bool: True if the lock was taken.
+        """
+        return self._set(instance_name, key, token.encode(), ttl, state=LOCK, only_if_missing=True)
+
+    async def release_lock(self, instance_name: str, key: str, token: str) -> None:
+        """
+        Release a lock, only if it is still held with the given token.
+
+        Args:
+            key (str): The key being locked.
+            token (str): The value the lock was taken with.
+        """
+        self._delete(instance_name, key, state=LOCK, token=token.encode())
+
+    def get_stats(self, instance_name: str) -> dict:
+        """
+        Retrieve the occupancy of a cache instance.
+
+        Returns:
+            dict: The number of used slots and free arena chunks with their totals.
+        """
+        _, mm = self.files[instance_name]
+        used = sum(
+            mm[offset] != EMPTY
+            for offset in range(HEADER_SIZE, self.arena_offset, self.slot_size)
+        )
+        return {
+            'slots': self.bucket_count * self.slots_per_bucket,
+            'used_slots': used,
+            'chunks': self.chunk_count,
+            'free_chunks': HEADER.unpack_from(mm, 0)[8],
+        }
+
+    async def close(self, instance_name: str) -> None:
+        """
+        Unmap the shared file, it is kept for the other workers and the next start.
+        """
+        fd, mm = self.files.pop(instance_name, (None, None))
+        if mm is not None:
+            mm.close()
+            os.close(fd)
@@ -1,35 +1,189 @@
 """ This module contains the SQLiteConnector class. """
 
+import asyncio
+import itertools
 import aiosqlite
-import pickle
-import datetime
-from core.cache_storage.connectors.base import BaseConnector
+import time
+from core.cache_storage.connectors.base import BaseConnector, DEFAULT_BATCH_SIZE
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Stay well below SQLITE_MAX_VARIABLE_NUMBER on older SQLite builds
+MAX_VARIABLES = 500
+
+# How long published invalidations are kept for workers to pick up, in seconds
+INVALIDATION_RETENTION = 300
+
+# Rows deleted per transaction while sweeping expired entries
+SWEEP_CHUNK_SIZE = 1000
 
 class SQLiteConnector(BaseConnector):
     """
     A caching manager that stores cache in a SQLite database.
 
+    Reads are spread over a small pool of long-lived connections, while all
+    writes go through a single writer task that commits every write queued
+    in the same tick as one transaction.
+
+    Invalidations for near caches are appended to a shared log table that
+    every worker polls, which acts as a local broadcast between processes.
+
     Args:
         db_path (str): The path to the SQLite database file.
+        pool_size (int, optional): The number of reader connections. Defaults to 4.
+        invalidation_poll_interval (float, optional): Seconds between polls of the invalidation log. Defaults to 0.25.
     """
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, pool_size: int = 4, invalidation_poll_interval: float = 0.25):
         self.db_path = db_path
+        self.pool_size = pool_size
+        self.invalidation_poll_interval = invalidation_poll_interval
+        self.readers = []
+        self.reader_cycle = None
+        self.writer = None
+        self.write_queue = None
+        self.writer_task = None
+        self.invalidation_task = None
+
+    async def _connect(self, isolation_level: str | None) -> aiosqlite.Connection:
+        """
+        Open a connection with the cache pragmas applied.
+
+        Args:
+            isolation_level (str | None): The sqlite3 isolation level, None for autocommit.
+
+        Returns:
+            aiosqlite.Connection: The opened connection.
+        """
+        db = await aiosqlite.connect(self.db_path, isolation_level=isolation_level, cached_statements=256)
+        for pragma in PRAGMAS:
+            await db.execute(pragma)
+        return db
 
     async def __async__init__(self, instance_name: str) -> None:
         """
-        Initializes the caching object and creates the cache table if it doesn't exist.
+        Initializes the connection pool, the writer task and creates the cache table if it doesn't exist.
         """
         table_name = f"cache_{instance_name}"
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(f'''
-                CREATE TABLE IF NOT EXISTS {table_name} (
-                    key TEXT PRIMARY KEY,
-                    value BLOB,
-                    ttl INTEGER,
-                    cached_at INTEGER DEFAULT (strftime('%s', 'now'))
-                )
-            ''')
-            await db.commit()
+        self.writer = await self._connect("")
+        await self.writer.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                key TEXT PRIMARY KEY,
+                value BLOB,
+                ttl INTEGER,
+                cached_at INTEGER DEFAULT (strftime('%s', 'now')),
+                expires_at REAL
+            )
+        ''')
+        columns = [row[1] for row in await self.writer.execute_fetchall(f'PRAGMA table_info({table_name})')]
+        if 'expires_at' not in columns:
+            # Tables created before expiry was indexed only have the relative ttl
+            await self.writer.execute(f'ALTER TABLE {table_name} ADD COLUMN expires_at REAL')
+            await self.writer.execute(f'UPDATE {table_name} SET expires_at = cached_at + ttl WHERE ttl IS NOT NULL')
+        await self.writer.execute(f'CREATE INDEX IF NOT EXISTS {table_name}_expires_at ON {table_name} (expires_at)')
+        await self.writer.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table_name}_locks (
+                key TEXT PRIMARY KEY,
+                token TEXT,
+                expires_at REAL
+            )
+        ''')
+        await self.writer.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table_name}_index (
+                name TEXT,
+                member TEXT,
+                expires_at REAL,
+                PRIMARY KEY (name, member)
+            ) WITHOUT ROWID
+        ''')
+        await self.writer.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table_name}_counters (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        await self.writer.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table_name}_invalidations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin TEXT,
+                key TEXT,
+                created_at REAL
+            )
+        ''')
+        await self.writer.commit()
+
+        self.readers = [await self._connect(None) for _ in range(self.pool_size)]
+        self.reader_cycle = itertools.cycle(self.readers)
+
+        self.write_queue = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self) -> None:
+        """
+        Drain the write queue, committing every write queued so far in a single transaction.
+        """
+        running = True
+        while running:
+            batch = [await self.write_queue.get()]
+            while not self.write_queue.empty():
+                batch.append(self.write_queue.get_nowait())
+
+            # A None sentinel is queued by close() once no more writes are expected
+            if None in batch:
+                batch = [item for item in batch if item is not None]
+                running = False
+
+            results = []
+            for sql, params, many, fetch, future in batch:
+                try:
+                    if many:
+                        cursor = await self.writer.executemany(sql, params)
+                    else:
+                        cursor = await self.writer.execute(sql, params)
+                    results.append((future, await cursor.fetchall() if fetch else cursor.rowcount, None))
+                except Exception as e:
+                    results.append((future, None, e))
+
+            try:
+                await self.writer.commit()
+            except Exception as e:
+                try:
+                    await self.writer.rollback()
+                except Exception:
+                    # The writer must outlive a broken transaction, or every later write would wait forever
+                    pass
+                results = [(future, None, e) for future, _, _ in results]
+
+            for future, rowcount, error in results:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(rowcount)
+
+    async def _write(self, sql: str, params, many: bool = False, fetch: bool = False) -> int | list:
+        """
+        Queue a write statement and wait for the transaction it lands in to commit.
+
+        Args:
+            sql (str): The statement to execute.
+            params: The statement parameters, or a list of them when `many` is set.
+            many (bool, optional): Whether to run the statement once per parameter set. Defaults to False.
+            fetch (bool, optional): Whether to return the rows of a `RETURNING` clause. Defaults to False.
+
+        Returns:
+            int | list: The number of affected rows, or the returned rows with `fetch`.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.write_queue.put((sql, params, many, fetch, future))
+        return await future
 
     async def get(self, instance_name: str, key: str):
         """
@@ -42,12 +196,13 @@ class SQLiteConnector(BaseConnector):
             The cached value if found, otherwise None.
         """
         table_name = f"cache_{instance_name}"
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(f'SELECT value FROM {table_name} WHERE key = ?', (key,)) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return pickle.loads(row[0])
-                return None
+        rows = await next(self.reader_cycle).execute_fetchall(
+            f'SELECT value FROM {table_name} WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        )
+        if rows:
+            return rows[0][0]
+        return None
 
     async def set(self, instance_name: str, key: str, value, ttl=None) -> None:
         """
@@ -59,22 +214,98 @@ class SQLiteConnector(BaseConnector):
             ttl (int, optional): The time-to-live in seconds. Defaults to None.
         """
         table_name = f"cache_{instance_name}"
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                f'INSERT OR REPLACE INTO {table_name} (key, value, ttl) VALUES (?, ?, ?)',
-                (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ttl)
+        await self._write(
+            f'INSERT OR REPLACE INTO {table_name} (key, value, ttl, expires_at) VALUES (?, ?, ?, ?)',
+            (key, value, ttl, time.time() + ttl if ttl else None)
+        )
+
+    async def get_many(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several values from the cache with `IN (...)` lookups.
+
+        Args:
+            keys (list): The keys of the cache.
+
+        Returns:
+            dict: The cached values keyed by their key, missing keys are left out.
+        """
+        table_name = f"cache_{instance_name}"
+        now = time.time()
+        values = {}
+        for i in range(0, len(keys), MAX_VARIABLES):
+            chunk = keys[i:i + MAX_VARIABLES]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = await next(self.reader_cycle).execute_fetchall(
+                f'SELECT key, value FROM {table_name} WHERE key IN ({placeholders}) AND (expires_at IS NULL OR expires_at > ?)',
+                [*chunk, now]
             )
-            await db.commit()
+            values.update(rows)
+        return values
+
+    async def set_many(self, instance_name: str, values: dict, ttl=None) -> None:
+        """
+        Add several values to the cache in one transaction.
+
+        Args:
+            values (dict): The values to be cached keyed by their key.
+            ttl (int, optional): The time-to-live in seconds. Defaults to None.
+        """
+        table_name = f"cache_{instance_name}"
+        expires_at = time.time() + ttl if ttl else None
+        await self._write(
+            f'INSERT OR REPLACE INTO {table_name} (key, value, ttl, expires_at) VALUES (?, ?, ?, ?)',
+            [(key, value, ttl, expires_at) for key, value in values.items()],
+            many=True
+        )
+
+    async def delete_many(self, instance_name: str, keys: list) -> None:
+        """
+        Remove several values from the cache in one transaction.
+
+        Args:
+            keys (list): The keys of the cache.
+        """
+        table_name = f"cache_{instance_name}"
+        await self._write(f'DELETE FROM {table_name} WHERE key = ?', [(key,) for key in keys], many=True)
+
+    async def touch_many(self, instance_name: str, keys: list, ttl: int) -> None:
+        """
+        Push back the expiry of several values with one UPDATE per key in a single transaction.
+
+        Args:
+            keys (list): The keys of the cache.
+            ttl (int): The new time-to-live in seconds, counted from now.
+        """
+        table_name = f"cache_{instance_name}"
+        expires_at = time.time() + ttl
+        await self._write(
+            f'UPDATE {table_name} SET ttl = ?, expires_at = ? WHERE key = ?',
+            [(ttl, expires_at, key) for key in keys],
+            many=True
+        )
 
     async def clear_expired(self, instance_name: str) -> None:
         """
         Clear expired cache entries from the SQLite database.
+        - Deletes in chunks of `SWEEP_CHUNK_SIZE` rows found through the expiry index, one transaction
+          per chunk, so concurrent writes queue behind a short transaction rather than the whole sweep.
         """
         table_name = f"cache_{instance_name}"
-        async with aiosqlite.connect(self.db_path) as db:
-            current_time = int(datetime.datetime.now().timestamp())
-            await db.execute(f'DELETE FROM {table_name} WHERE ttl IS NOT NULL AND (cached_at + ttl) < ?', (current_time,))
-            await db.commit()
+        current_time = time.time()
+        while True:
+            deleted = await self._write(
+                f'DELETE FROM {table_name} WHERE rowid IN '
+                f'(SELECT rowid FROM {table_name} WHERE expires_at <= ? LIMIT {SWEEP_CHUNK_SIZE})',
+                (current_time,)
+            )
+            if deleted < SWEEP_CHUNK_SIZE:
+                break
+        await self._write(f'DELETE FROM {table_name}_locks WHERE expires_at <= ?', (current_time,))
+        await self._write(f'DELETE FROM {table_name}_index WHERE expires_at <= ?', (current_time,))
+        await self._write(
+            f'DELETE FROM {table_name}_invalidations WHERE created_at < ?',
+            (current_time - INVALIDATION_RETENTION,)
+        )
 
     async def delete(self, instance_name: str, key: str) -> None:
         """
@@ -84,19 +315,236 @@ class SQLiteConnector(BaseConnector):
             key (str): The key of the cache.
         """
         table_name = f"cache_{instance_name}"
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(f'DELETE FROM {table_name} WHERE key = ?', (key,))
-            await db.commit()
+        await self._write(f'DELETE FROM {table_name} WHERE key = ?', (key,))
+
+    async def aiter_items(self, instance_name: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Iterate over every key and value in the cache, paging through the table by rowid.
+        - Keyset pages keep each query an index range scan no matter how deep the iteration is.
+
+        Args:
+            batch_size (int, optional): The number of rows fetched per query. Defaults to 500.
+
+        Yields:
+            tuple: The key and value of each cached entry.
+        """
+        table_name = f"cache_{instance_name}"
+        last_rowid = 0
+        while True:
+            rows = await next(self.reader_cycle).execute_fetchall(
+                f'SELECT rowid, key, value, expires_at FROM {table_name} WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                (last_rowid, batch_size)
+            )
+            now = time.time()
+            for _, key, value, expires_at in rows:
+                # Expired rows are skipped rather than filtered in SQL so every page stays full
+                if expires_at is None or expires_at > now:
+                    yield key, value
+            if len(rows) < batch_size:
+                break
+            last_rowid = rows[-1][0]
+
+    async def incr(self, instance_name: str, key: str) -> int:
+        """
+        Atomically increment a counter in the counters table.
+
+        Args:
+            key (str): The name of the counter.
+
+        Returns:
+            int: The value of the counter after the increment.
+        """
+        table_name = f"cache_{instance_name}"
+        rows = await self._write(
+            f'INSERT INTO {table_name}_counters (key, value) VALUES (?, 1) '
+            f'ON CONFLICT (key) DO UPDATE SET value = value + 1 RETURNING value',
+            (key,),
+            fetch=True
+        )
+        return rows[0][0]
+
+    async def get_counters(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several counters with an `IN (...)` lookup.
+
+        Args:
+            keys (list): The names of the counters.
+
+        Returns:
+            dict: The counter values keyed by their name, counters never incremented are left out.
+        """
+        table_name = f"cache_{instance_name}"
+        placeholders = ', '.join('?' * len(keys))
+        rows = await next(self.reader_cycle).execute_fetchall(
+            f'SELECT key, value FROM {table_name}_counters WHERE key IN ({placeholders})',
+            keys
+        )
+        return dict(rows)
+
+    async def index_add(self, instance_name: str, index: str, member: str, ttl=None) -> None:
+        """
+        Add a member to a secondary index, stored as a row of the index table keyed by index and member.
+
+        Args:
+            index (str): The name of the index.
+            member (str): The member to add.
+            ttl (int, optional): The time-to-live of the member in seconds. Defaults to None.
+        """
+        table_name = f"cache_{instance_name}"
+        await self._write(
+            f'INSERT OR REPLACE INTO {table_name}_index (name, member, expires_at) VALUES (?, ?, ?)',
+            (index, member, time.time() + ttl if ttl else None)
+        )
+
+    async def index_remove(self, instance_name: str, index: str, members: list) -> None:
+        """
+        Remove members from a secondary index.
+
+        Args:
+            index (str): The name of the index.
+            members (list): The members to remove.
+        """
+        table_name = f"cache_{instance_name}"
+        await self._write(
+            f'DELETE FROM {table_name}_index WHERE name = ? AND member = ?',
+            [(index, member) for member in members],
+            many=True
+        )
 
-    async def get_all_values(self, instance_name: str) -> list:
+    async def index_members(self, instance_name: str, index: str) -> list:
         """
-        Retrieve all values from the cache.
+        Retrieve the live members of a secondary index with a range scan of the primary key.
+
+        Args:
+            index (str): The name of the index.
 
         Returns:
-            list: All values in the cache.
+            list: The members that haven't expired.
         """
         table_name = f"cache_{instance_name}"
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(f'SELECT value FROM {table_name}') as cursor:
-                rows = await cursor.fetchall()
-                return [pickle.loads(row[0]) for row in rows] if rows else []
\ No newline at end of file
+        rows = await next(self.reader_cycle).execute_fetchall(
+            f'SELECT member FROM {table_name}_index WHERE name = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (index, time.time())
+        )
+        return [member for member, in rows]
+
+    async def index_pop(self, instance_name: str, index: str) -> list:
+        """
+        Delete a secondary index and return its live members in the same statement.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        table_name = f"cache_{instance_name}"
+        rows = await self._write(
+            f'DELETE FROM {table_name}_index WHERE name = ? RETURNING member, expires_at',
+            (index,),
+            fetch=True
+        )
+        now = time.time()
+        return [member for member, expires_at in rows if expires_at is None or expires_at > now]
+
+    async def acquire_lock(self, instance_name: str, key: str, token: str, ttl: int) -> bool:
+        """
+        Take a lock by claiming its row in the locks table, or taking over a row whose lock has expired.
+
+        Args:
+            key (str): The key being locked.
+            token (str): A unique value identifying the holder.
+            ttl (int): The number of seconds before the lock is released on its own.
+
+        Returns:
+            bool: True if the lock was taken.
+        """
+        table_name = f"cache_{instance_name}"
+        now = time.time()
+        claimed = await self._write(
+            f'INSERT INTO {table_name}_locks (key, token, expires_at) VALUES (?, ?, ?) '
+            f'ON CONFLICT (key) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at '
+            f'WHERE {table_name}_locks.expires_at <= ?',
+            (key, token, now + ttl, now)
+        )
+        return claimed == 1
+
+    async def release_lock(self, instance_name: str, key: str, token: str) -> None:
+        """
+        Release a lock, only if it is still held with the given token.
+
+        Args:
+            key (str): The key being locked.
+            token (str): The value the lock was taken with.
+        """
+        table_name = f"cache_{instance_name}"
+        await self._write(f'DELETE FROM {table_name}_locks WHERE key = ? AND token = ?', (key, token))
+
+    async def publish_invalidation(self, instance_name: str, origin: str, keys: list) -> None:
+        """
+        Append changed keys to the instance invalidation log.
+
+        Args:
+            origin (str): The id of the publishing cache manager.
+            keys (list): The keys that changed.
+        """
+        table_name = f"cache_{instance_name}"
+        now = time.time()
+        await self._write(
+            f'INSERT INTO {table_name}_invalidations (origin, key, created_at) VALUES (?, ?, ?)',
+            [(origin, key, now) for key in keys],
+            many=True
+        )
+
+    async def subscribe_invalidations(self, instance_name: str, callback) -> None:
+        """
+        Poll the instance invalidation log in a background task, starting from its current end.
+
+        Args:
+            callback: Called with the origin and keys of every invalidation.
+        """
+        table_name = f"cache_{instance_name}"
+        rows = await next(self.reader_cycle).execute_fetchall(f'SELECT COALESCE(MAX(id), 0) FROM {table_name}_invalidations')
+        self.invalidation_task = asyncio.create_task(self._poll_invalidations(instance_name, rows[0][0], callback))
+
+    async def _poll_invalidations(self, instance_name: str, last_id: int, callback) -> None:
+        """
+        Relay rows appended to the invalidation log since the last poll to the callback.
+        """
+        table_name = f"cache_{instance_name}"
+        while True:
+            await asyncio.sleep(self.invalidation_poll_interval)
+            try:
+                rows = await next(self.reader_cycle).execute_fetchall(
+                    f'SELECT id, origin, key FROM {table_name}_invalidations WHERE id > ? ORDER BY id',
+                    (last_id,)
+                )
+            except Exception:
+                # Nothing is lost, the next poll resumes from the same id
+                continue
+            for _, origin, key in rows:
+                callback(origin, [key])
+            if rows:
+                last_id = rows[-1][0]
+
+    async def close(self, instance_name: str) -> None:
+        """
+        Stop the background tasks and close every pooled connection.
+        """
+        if self.invalidation_task is not None:
+            self.invalidation_task.cancel()
+            try:
+                await self.invalidation_task
+            except asyncio.CancelledError:
+                pass
+            self.invalidation_task = None
+        if self.writer_task is not None:
+            await self.write_queue.put(None)
+            await self.writer_task
+            self.writer_task = None
+        for db in self.readers:
+            await db.close()
+        self.readers = []
+        if self.writer is not None:
+            await self.writer.close()
+            self.writer = None
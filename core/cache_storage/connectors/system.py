@@ -1,24 +1,313 @@
 """ This module contains the SystemConnector class. """
 
+import asyncio
+import heapq
+import mmap
+import os
 import pickle
-import datetime
-from core.cache_storage.connectors.base import BaseConnector
+import struct
+import sys
+import time
+from collections import OrderedDict
+from core.cache_storage.connectors.base import BaseConnector, DEFAULT_BATCH_SIZE
+
+SNAPSHOT_MAGIC = b'CSCSNAP2'
+# index offset, index length, magic. The index holds the entry locations, the counters and the indexes.
+SNAPSHOT_FOOTER = struct.Struct('<QQ8s')
+
+def _sizeof(value, depth: int = 3) -> int:
+    """
+    Estimate the memory footprint of a value, following containers a few levels deep.
+
+    Args:
+        value: The value to measure.
+        depth (int, optional): How many container levels to follow. Defaults to 3.
+
+    Returns:
+        int: The estimated size in bytes.
+    """
+    size = sys.getsizeof(value)
+    if depth <= 0:
+        return size
+    if isinstance(value, dict):
+        size += sum(_sizeof(k, depth - 1) + _sizeof(v, depth - 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_sizeof(item, depth - 1) for item in value)
+    elif hasattr(value, '__dict__'):
+        size += _sizeof(vars(value), depth - 1)
+    return size
+
+class _Entry:
+    """
+    A cached value with its absolute expiry time and estimated size.
+    """
+    __slots__ = ('value', 'expires_at', 'size')
+
+    def __init__(self, value, expires_at: float | None, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+class _Stored:
+    """
+    The location of a value in the snapshot an instance was loaded from, unpickled on first use.
+    """
+    __slots__ = ('offset', 'length')
+
+    def __init__(self, offset: int, length: int):
+        self.offset = offset
+        self.length = length
+
+class _Instance:
+    """
+    The store, expiry heap, counters and indexes of a single cache instance.
+    """
+    __slots__ = (
+        'entries', 'expiry_heap', 'counters', 'indexes', 'bytes', 'hits', 'misses', 'evictions', 'expirations', 'snapshot', 'snapshot_task'
+    )
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.expiry_heap = []
+        self.counters = {}
+        self.indexes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.snapshot = None
+        self.snapshot_task = None
 
 class SystemConnector(BaseConnector):
     """
     A caching manager that stores cache in system memory.
+    - Values are kept as live objects, so no codec runs for this connector.
+    - Expiry times are tracked in a heap, so sweeps only touch expired entries.
+    - The least recently used entries are evicted once a budget is exceeded.
+    - With a snapshot directory, instances are written to disk periodically and on close, and
+      reloaded on start. Values are only unpickled from the snapshot when first read.
+
+    Args:
+        max_entries (int, optional): The maximum number of entries per instance. Defaults to unbounded.
+        max_bytes (int, optional): The maximum estimated size of an instance in bytes. Defaults to unbounded.
+        snapshot_dir (str, optional): Where instance snapshots are kept. Defaults to no snapshots.
+        snapshot_interval (int, optional): The seconds between periodic snapshots. Defaults to 300, 0 only snapshots on close.
     """
-    def __init__(self):
+    stores_objects = True
+    is_local = True
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None, snapshot_dir: str = None, snapshot_interval: int = 300):
         """
         Initializes the caching object.
         """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
         self.store = {}
 
     async def __async__init__(self, instance_name: str) -> None:
         """
-        Initialize the caching object.
+        Initialize the caching object, warming it from its snapshot if there is one.
+        """
+        instance = self.store[instance_name] = _Instance()
+        if self.snapshot_dir:
+            self._load_snapshot(instance, self._snapshot_path(instance_name))
+            if self.snapshot_interval:
+                instance.snapshot_task = asyncio.create_task(self._snapshot_periodically(instance_name))
+
+    def _snapshot_path(self, instance_name: str) -> str:
+        return os.path.join(self.snapshot_dir, f'{instance_name}.snapshot')
+
+    def _load_snapshot(self, instance: _Instance, path: str) -> None:
+        """
+        Map a snapshot and index its live entries, leaving the values in the file until they are read.
+        - A missing or unreadable snapshot leaves the instance empty.
         """
-        self.store[instance_name] = {}
+        try:
+            with open(path, 'rb') as file:
+                snapshot = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return
+        try:
+            if len(snapshot) < len(SNAPSHOT_MAGIC) + SNAPSHOT_FOOTER.size or snapshot[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError('Not a cache snapshot')
+            index_offset, index_length, magic = SNAPSHOT_FOOTER.unpack_from(snapshot, len(snapshot) - SNAPSHOT_FOOTER.size)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError('Truncated cache snapshot')
+            index = pickle.loads(snapshot[index_offset:index_offset + index_length])
+        except (ValueError, struct.error, pickle.UnpicklingError, EOFError):
+            snapshot.close()
+            return
+
+        now = time.time()
+        # Restored with the entries, so generation prefixes keep pointing at the same entries
+        instance.counters.update(index['counters'])
+        for name, members in index['indexes'].items():
+            members = {member: expires_at for member, expires_at in members.items() if expires_at is None or expires_at > now}
+            if members:
+                instance.indexes[name] = members
+        for key, expires_at, offset, length in index['entries']:
+            if expires_at is not None and expires_at <= now:
+                continue
+            size = length if self.max_bytes else 0
+            instance.entries[key] = _Entry(_Stored(offset, length), expires_at, size)
+            instance.bytes += size
+            if expires_at is not None:
+                instance.expiry_heap.append((expires_at, key))
+        heapq.heapify(instance.expiry_heap)
+        instance.snapshot = snapshot
+        self._enforce_budget(instance)
+
+    def _materialise(self, instance: _Instance, key: str, entry: _Entry) -> bool:
+        """
+        Unpickle a value still held in the snapshot, dropping the entry if it can't be loaded anymore.
+
+        Returns:
+            bool: True if the entry now holds its value.
+        """
+        stored = entry.value
+        try:
+            entry.value = pickle.loads(instance.snapshot[stored.offset:stored.offset + stored.length])
+        except Exception:
+            # e.g. the class of the value was changed or removed by the new release
+            self._remove(instance, key)
+            return False
+        if self.max_bytes:
+            size = _sizeof(entry.value)
+            instance.bytes += size - entry.size
+            entry.size = size
+        return True
+
+    async def snapshot(self, instance_name: str, batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        """
+        Write the live entries, counters and indexes of an instance to its snapshot file.
+        - The file is written under a temporary name and swapped in, so readers only ever see complete snapshots.
+        - Values that can't be pickled are left out.
+
+        Args:
+            batch_size (int, optional): The number of entries written between event loop yields. Defaults to 500.
+        """
+        instance = self.store[instance_name]
+        path = self._snapshot_path(instance_name)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+        index = []
+        offset = len(SNAPSHOT_MAGIC)
+        try:
+            with open(temporary_path, 'wb') as file:
+                file.write(SNAPSHOT_MAGIC)
+                keys = list(instance.entries)
+                for i in range(0, len(keys), batch_size):
+                    now = time.time()
+                    for key in keys[i:i + batch_size]:
+                        entry = instance.entries.get(key)
+                        if entry is None or (entry.expires_at is not None and entry.expires_at <= now):
+                            continue
+                        if type(entry.value) is _Stored:
+                            # Copy values that were never read straight from the previous snapshot
+                            data = instance.snapshot[entry.value.offset:entry.value.offset + entry.value.length]
+                        else:
+                            try:
+                                data = pickle.dumps(entry.value, pickle.HIGHEST_PROTOCOL)
+                            except (pickle.PicklingError, TypeError, AttributeError):
+                                continue
+                        file.write(data)
+                        index.append((key, entry.expires_at, offset, len(data)))
+                        offset += len(data)
+                    await asyncio.sleep(0)
+
+                now = time.time()
+                raw_index = pickle.dumps({
+                    'entries': index,
+                    'counters': dict(instance.counters),
+                    'indexes': {
+                        name: {member: expires_at for member, expires_at in members.items() if expires_at is None or expires_at > now}
+                        for name, members in instance.indexes.items()
+                    },
+                }, pickle.HIGHEST_PROTOCOL)
+                file.write(raw_index)
+                file.write(SNAPSHOT_FOOTER.pack(offset, len(raw_index), SNAPSHOT_MAGIC))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    async def _snapshot_periodically(self, instance_name: str) -> None:
+        """
+        Snapshot an instance every `snapshot_interval` seconds until it is closed.
+        """
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.snapshot(instance_name)
+            except OSError:
+                # e.g. the disk is full, keep serving from memory and try again next time
+                pass
+
+    def _remove(self, instance: _Instance, key: str) -> None:
+        """
+        Drop an entry from an instance, keeping the byte count in step.
+        """
+        entry = instance.entries.pop(key, None)
+        if entry is not None:
+            instance.bytes -= entry.size
+
+    def _lookup(self, instance: _Instance, key: str, now: float) -> _Entry | None:
+        """
+        Find a live entry, counting the hit or miss and expiring it if its time has passed.
+        """
+        entry = instance.entries.get(key)
+        if entry is not None and entry.expires_at is not None and entry.expires_at <= now:
+            self._remove(instance, key)
+            instance.expirations += 1
+            entry = None
+        if entry is not None and type(entry.value) is _Stored and not self._materialise(instance, key, entry):
+            entry = None
+        if entry is None:
+            instance.misses += 1
+            return None
+        instance.entries.move_to_end(key)
+        instance.hits += 1
+        return entry
+
+    def _store(self, instance: _Instance, key: str, value, ttl, now: float) -> None:
+        """
+        Insert or replace an entry, without enforcing the budget.
+        """
+        expires_at = now + ttl if ttl else None
+        size = _sizeof(value) if self.max_bytes else 0
+        self._remove(instance, key)
+        instance.entries[key] = _Entry(value, expires_at, size)
+        instance.bytes += size
+        if expires_at is not None:
+            heapq.heappush(instance.expiry_heap, (expires_at, key))
+
+    def _enforce_budget(self, instance: _Instance) -> None:
+        """
+        Evict the least recently used entries until the instance fits its budget.
+        """
+        entries = instance.entries
+        while entries and (
+            (self.max_entries and len(entries) > self.max_entries)
+            or (self.max_bytes and instance.bytes > self.max_bytes)
+        ):
+            _, entry = entries.popitem(last=False)
+            instance.bytes -= entry.size
+            instance.evictions += 1
+
+        # Replaced, deleted and evicted entries leave stale heap items behind, rebuild once they dominate
+        if len(instance.expiry_heap) > 2 * len(entries) + 1024:
+            instance.expiry_heap = [
+                (entry.expires_at, key)
+                for key, entry in entries.items() if entry.expires_at is not None
+            ]
+            heapq.heapify(instance.expiry_heap)
 
     async def get(self, instance_name: str, key: str):
         """
@@ -30,10 +319,8 @@ class SystemConnector(BaseConnector):
         Returns:
             The cached value if found, otherwise None.
         """
-        raw_store = self.store[instance_name].get(key)
-        if not raw_store:
-            return None
-        return pickle.loads(raw_store)['value']
+        entry = self._lookup(self.store[instance_name], key, time.time())
+        return entry.value if entry is not None else None
 
     async def set(self, instance_name: str, key: str, value, ttl=None) -> None:
         """
@@ -44,20 +331,92 @@ class SystemConnector(BaseConnector):
             value: The value to be cached.
             ttl (int, optional): The time-to-live in seconds. Defaults to None.
         """
-        data = {"ttl": ttl, "value": value}
-        self.store[instance_name][key] = pickle.dumps(data)
+        instance = self.store[instance_name]
+        self._store(instance, key, value, ttl, time.time())
+        self._enforce_budget(instance)
 
-    async def clear_expired(self, instance_name: str) -> None:
+    async def get_many(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several values from the cache.
+
+        Args:
+            keys (list): The keys of the cache.
+
+        Returns:
+            dict: The cached values keyed by their key, missing keys are left out.
+        """
+        instance = self.store[instance_name]
+        now = time.time()
+        values = {}
+        for key in keys:
+            entry = self._lookup(instance, key, now)
+            if entry is not None:
+                values[key] = entry.value
+        return values
+
+    async def set_many(self, instance_name: str, values: dict, ttl=None) -> None:
+        """
+        Add several values to the cache.
+
+        Args:
+            values (dict): The values to be cached keyed by their key.
+            ttl (int, optional): The time-to-live in seconds. Defaults to None.
+        """
+        instance = self.store[instance_name]
+        now = time.time()
+        for key, value in values.items():
+            self._store(instance, key, value, ttl, now)
+        self._enforce_budget(instance)
+
+    async def delete_many(self, instance_name: str, keys: list) -> None:
         """
-        Clear expired cache entries from the SQLite database.
+        Remove several values from the cache.
+
+        Args:
+            keys (list): The keys of the cache.
+        """
+        instance = self.store[instance_name]
+        for key in keys:
+            self._remove(instance, key)
+
+    async def touch_many(self, instance_name: str, keys: list, ttl: int) -> None:
         """
-        for item in list(self.store[instance_name].keys()):
-            raw_store = self.store[instance_name].get(item)
-            if not raw_store:
+        Push back the expiry of several values, the old heap items are skipped when popped.
+
+        Args:
+            keys (list): The keys of the cache.
+            ttl (int): The new time-to-live in seconds, counted from now.
+        """
+        instance = self.store[instance_name]
+        now = time.time()
+        expires_at = now + ttl
+        for key in keys:
+            entry = instance.entries.get(key)
+            if entry is None or (entry.expires_at is not None and entry.expires_at <= now):
                 continue
-            data = pickle.loads(raw_store)
-            if data['ttl'] is not None and data['ttl'] < datetime.datetime.now().timestamp():
-                del self.store[instance_name][item]
+            entry.expires_at = expires_at
+            heapq.heappush(instance.expiry_heap, (expires_at, key))
+
+    async def clear_expired(self, instance_name: str) -> None:
+        """
+        Clear expired cache entries from memory.
+        - Pops the expiry heap up to the current time, so the cost is proportional to the number of expired entries.
+        - Indexes are small and few, they are pruned with a full pass.
+        """
+        instance = self.store[instance_name]
+        heap = instance.expiry_heap
+        now = time.time()
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            entry = instance.entries.get(key)
+            # Skip heap items left behind by entries that were since replaced or removed
+            if entry is not None and entry.expires_at == expires_at:
+                self._remove(instance, key)
+                instance.expirations += 1
+
+        for index in list(instance.indexes):
+            if not self._live_members(instance, index, now):
+                del instance.indexes[index]
 
     async def delete(self, instance_name: str, key: str) -> None:
         """
@@ -66,14 +425,163 @@ class SystemConnector(BaseConnector):
         Args:
             key (str): The key of the cache.
         """
-        if key in self.store[instance_name]:
-            del self.store[instance_name][key]
+        self._remove(self.store[instance_name], key)
 
-    async def get_all_values(self, instance_name: str) -> list:
+    async def aiter_items(self, instance_name: str, batch_size: int = DEFAULT_BATCH_SIZE):
         """
-        Retrieve all values from the cache.
+        Iterate over every live key and value in the cache in chunks, yielding to the event loop between chunks.
+
+        Args:
+            batch_size (int, optional): The number of values yielded per chunk. Defaults to 500.
+
+        Yields:
+            tuple: The key and value of each cached entry.
+        """
+        entries = self.store[instance_name].entries
+        keys = list(entries)
+        for i in range(0, len(keys), batch_size):
+            now = time.time()
+            for key in keys[i:i + batch_size]:
+                # Keys may be deleted while the iteration is suspended
+                entry = entries.get(key)
+                if entry is None or (entry.expires_at is not None and entry.expires_at <= now):
+                    continue
+                if type(entry.value) is _Stored and not self._materialise(self.store[instance_name], key, entry):
+                    continue
+                yield key, entry.value
+            await asyncio.sleep(0)
+
+    async def incr(self, instance_name: str, key: str) -> int:
+        """
+        Increment a counter of the instance.
+
+        Args:
+            key (str): The name of the counter.
 
         Returns:
-            list: All values in the cache.
+            int: The value of the counter after the increment.
+        """
+        counters = self.store[instance_name].counters
+        counters[key] = counters.get(key, 0) + 1
+        return counters[key]
+
+    async def get_counters(self, instance_name: str, keys: list) -> dict:
+        """
+        Retrieve several counters of the instance.
+
+        Args:
+            keys (list): The names of the counters.
+
+        Returns:
+            dict: The counter values keyed by their name, counters never incremented are left out.
+        """
+        counters = self.store[instance_name].counters
+        return {key: counters[key] for key in keys if key in counters}
+
+    def _live_members(self, instance: _Instance, index: str, now: float) -> list:
+        """
+        Drop the expired members of an index and return the others.
+        """
+        members = instance.indexes.get(index)
+        if not members:
+            return []
+        for member in [member for member, expires_at in members.items() if expires_at is not None and expires_at <= now]:
+            del members[member]
+        return list(members)
+
+    async def index_add(self, instance_name: str, index: str, member: str, ttl=None) -> None:
+        """
+        Add a member to a secondary index, a dict of members and their expiry time.
+
+        Args:
+            index (str): The name of the index.
+            member (str): The member to add.
+            ttl (int, optional): The time-to-live of the member in seconds. Defaults to None.
+        """
+        instance = self.store[instance_name]
+        now = time.time()
+        self._live_members(instance, index, now)
+        instance.indexes.setdefault(index, {})[member] = now + ttl if ttl else None
+
+    async def index_remove(self, instance_name: str, index: str, members: list) -> None:
+        """
+        Remove members from a secondary index.
+
+        Args:
+            index (str): The name of the index.
+            members (list): The members to remove.
+        """
+        instance = self.store[instance_name]
+        indexed = instance.indexes.get(index)
+        if indexed is None:
+            return
+        for member in members:
+            indexed.pop(member, None)
+        if not indexed:
+            del instance.indexes[index]
+
+    async def index_members(self, instance_name: str, index: str) -> list:
+        """
+        Retrieve the live members of a secondary index.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        return self._live_members(self.store[instance_name], index, time.time())
+
+    async def index_pop(self, instance_name: str, index: str) -> list:
+        """
+        Retrieve the live members of a secondary index and delete it.
+
+        Args:
+            index (str): The name of the index.
+
+        Returns:
+            list: The members that haven't expired.
+        """
+        instance = self.store[instance_name]
+        members = self._live_members(instance, index, time.time())
+        instance.indexes.pop(index, None)
+        return members
+
+    def get_stats(self, instance_name: str) -> dict:
+        """
+        Retrieve the counters of a cache instance.
+
+        Returns:
+            dict: The hit, miss, eviction and expiration counters with the current entry count and estimated size.
+        """
+        instance = self.store[instance_name]
+        return {
+            'entries': len(instance.entries),
+            'bytes': instance.bytes,
+            'hits': instance.hits,
+            'misses': instance.misses,
+            'evictions': instance.evictions,
+            'expirations': instance.expirations,
+        }
+
+    async def close(self, instance_name: str) -> None:
+        """
+        Stop the periodic snapshots and write a final one.
         """
-        return self.store[instance_name].values()
\ No newline at end of file
+        instance = self.store.get(instance_name)
+        if instance is None:
+            return
+        if instance.snapshot_task is not None:
+            snapshot_task, instance.snapshot_task = instance.snapshot_task, None
+            snapshot_task.cancel()
+            # Wait for a periodic snapshot in progress to clean up its temporary file, which the final one reuses
+            try:
+                await snapshot_task
+            except asyncio.CancelledError:
+                pass
+        if self.snapshot_dir:
+            await self.snapshot(instance_name)
+        if instance.snapshot is not None:
+            # Every value still in the old snapshot was copied into the new one
+            instance.snapshot.close()
+            instance.snapshot = None
@@ -0,0 +1,69 @@
+""" A small in-process LRU cache placed in front of remote cache connectors. """
+
+import time
+from collections import OrderedDict
+
+class NearCache:
+    """
+    An in-process LRU cache of decoded values with a short time-to-live.
+
+    Args:
+        ttl (float): The number of seconds a value is served from memory.
+        max_entries (int, optional): The maximum number of entries kept. Defaults to 10000.
+    """
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        """
+        Retrieve a value if it is cached and still fresh.
+
+        Args:
+            key (str): The key of the cache.
+
+        Returns:
+            The cached value if found, otherwise None.
+        """
+        item = self.entries.get(key)
+        if item is None or item[1] <= time.monotonic():
+            if item is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key: str, value, ttl=None) -> None:
+        """
+        Cache a value, never for longer than its own time-to-live.
+
+        Args:
+            key (str): The key of the cache.
+            value: The value to be cached.
+            ttl (int, optional): The time-to-live of the value in the backing store. Defaults to None.
+        """
+        lifetime = min(self.ttl, ttl) if ttl else self.ttl
+        self.entries[key] = (value, time.monotonic() + lifetime)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        """
+        Drop a value from the cache.
+
+        Args:
+            key (str): The key of the cache.
+        """
+        self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Drop every value from the cache.
+        """
+        self.entries.clear()
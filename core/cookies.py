@@ -1,11 +1,194 @@
 """
-This module provides functions for handling cookies.
+This module provides functions for handling cookies, and the signer their values are signed and verified with.
 """
 
+import base64
+import binascii
+import hashlib
+import hmac
+import struct
+import time
+import uuid
+from collections import OrderedDict
+
 import jwt
+import ujson
 from sanic import json, Sanic, response
 from sanic.request import Request
 
+COOKIE_FORMATS = ('jwt', 'compact')
+
+# The header of every HS256 token issued here, tokens with another header are verified by PyJWT
+JWT_HEADER = 'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9'
+
+COMPACT_VERSION = 1
+# version, kind, session ID, expiry
+COMPACT_SESSION = struct.Struct('<BB16sI')
+# followed by the user UUID, MFA flag, issued at, refresh at and generation of stateless session claims
+COMPACT_CLAIMS = struct.Struct('<16s?IIQ')
+SESSION_KIND = 1
+CLAIMS_KIND = 2
+SESSION_KEYS = {'session_id'}
+CLAIMS_KEYS = {'sid', 'uid', 'mfa', 'iat', 'rat', 'gen'}
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def _uuid_str(data: bytes) -> str:
+    # Same as str(uuid.UUID(bytes=data)), without building the UUID
+    h = data.hex()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+class CookieSigner:
+    """
+        Signs cookie values and verifies them, for the cookies of the app.
+        - Values are HS256 JWTs, or with the `compact` format session cookies are packed in a fixed binary layout
+          signed with HMAC-SHA256, which skips JSON. Other values are still JWTs, and both formats are always read.
+        - The HMAC key is prepared once, and verified tokens are kept in an LRU keyed by their digest
+          until they expire, at most `cache_ttl` seconds, so a returning cookie isn't verified again.
+
+        Args:
+            secret (str): The secret cookies are signed with.
+            cookie_format (str, optional): `jwt` or `compact`. Defaults to jwt.
+            cache_size (int, optional): The verified tokens remembered, 0 disables the LRU. Defaults to 4096.
+            cache_ttl (float, optional): The seconds a verified token is remembered at most. Defaults to 300.
+    """
+    def __init__(self, secret: str, cookie_format: str = 'jwt', cache_size: int = 4096, cache_ttl: float = 300):
+        if cookie_format not in COOKIE_FORMATS:
+            raise ValueError(f"Invalid cookie format: {cookie_format}")
+        self.secret = secret
+        self.compact = cookie_format == 'compact'
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # Copied for every signature instead of deriving the key pads again
+        self.key = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+        self.verified = OrderedDict()
+
+    def _sign(self, data: bytes) -> bytes:
+        mac = self.key.copy()
+        mac.update(data)
+        return mac.digest()
+
+    def _encode_compact(self, value: dict, expires_at: int) -> str | None:
+        """
+            Pack a session cookie in the compact layout, or None if the value isn't one.
+        """
+        keys = value.keys()
+        try:
+            if keys == SESSION_KEYS:
+                data = COMPACT_SESSION.pack(COMPACT_VERSION, SESSION_KIND, uuid.UUID(value['session_id']).bytes, expires_at)
+            elif keys == CLAIMS_KEYS:
+                data = COMPACT_SESSION.pack(COMPACT_VERSION, CLAIMS_KIND, uuid.UUID(value['sid']).bytes, expires_at) + COMPACT_CLAIMS.pack(
+                    uuid.UUID(value['uid']).bytes, value['mfa'], value['iat'], value['rat'], value['gen']
+                )
+            else:
+                return None
+        except (ValueError, TypeError, AttributeError, struct.error):
+            return None
+        return f'{_b64encode(data)}.{_b64encode(self._sign(data))}'
+
+    def _decode_compact(self, token: str) -> dict | None:
+        payload, _, signature = token.partition('.')
+        data = _b64decode(payload)
+        if not hmac.compare_digest(self._sign(data), _b64decode(signature)):
+            return None
+        version, kind, session_id, expires_at = COMPACT_SESSION.unpack_from(data)
+        if version != COMPACT_VERSION:
+            return None
+        if kind == SESSION_KIND and len(data) == COMPACT_SESSION.size:
+            return {'session_id': _uuid_str(session_id), 'exp': expires_at}
+        if kind == CLAIMS_KIND and len(data) == COMPACT_SESSION.size + COMPACT_CLAIMS.size:
+            user_uuid, mfa, issued_at, refresh_at, generation = COMPACT_CLAIMS.unpack_from(data, COMPACT_SESSION.size)
+            return {
+                'sid': _uuid_str(session_id),
+                'uid': _uuid_str(user_uuid),
+                'mfa': mfa,
+                'iat': issued_at,
+                'rat': refresh_at,
+                'gen': generation,
+                'exp': expires_at,
+            }
+        return None
+
+    def _decode_jwt(self, token: str) -> dict | None:
+        """
+            Verify a JWT with the prepared key, the way PyJWT does: signature, then `exp`, `nbf` and `iat`.
+        """
+        header, _, rest = token.partition('.')
+        payload, _, signature = rest.partition('.')
+        if header != JWT_HEADER:
+            return jwt.decode(token, self.secret, algorithms=['HS256'])
+        if not hmac.compare_digest(self._sign(f'{header}.{payload}'.encode()), _b64decode(signature)):
+            return None
+        claims = ujson.loads(_b64decode(payload))
+        if not isinstance(claims, dict):
+            return None
+        now = time.time()
+        if 'exp' in claims and int(claims['exp']) <= now:
+            return None
+        if 'nbf' in claims and int(claims['nbf']) > now:
+            return None
+        if 'iat' in claims and int(claims['iat']) > now:
+            return None
+        return claims
+
+    def encode(self, value: dict, expires_in: int = None) -> str:
+        """
+            Sign a cookie value.
+
+            Args:
+                value (dict): The value of the cookie.
+                expires_in (int, optional): The seconds until the signed value expires. Defaults to never.
+
+            Returns:
+                str: The signed value.
+        """
+        if expires_in is not None:
+            expires_at = int(time.time()) + expires_in
+            if self.compact:
+                token = self._encode_compact(value, expires_at)
+                if token is not None:
+                    return token
+            value = {**value, 'exp': expires_at}
+        return jwt.encode(value, self.secret, algorithm='HS256')
+
+    def decode(self, token: str) -> dict | None:
+        """
+            Verify a signed cookie value, remembering it once verified.
+
+            Args:
+                token (str): The signed value.
+
+            Returns:
+                dict: The value, or None if it is expired or not validly signed.
+        """
+        now = time.time()
+        digest = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        entry = self.verified.get(digest)
+        if entry is not None:
+            if now < entry[1]:
+                self.verified.move_to_end(digest)
+                return dict(entry[0])
+            del self.verified[digest]
+
+        try:
+            value = self._decode_compact(token) if token.count('.') == 1 else self._decode_jwt(token)
+        except (jwt.InvalidTokenError, binascii.Error, ValueError, TypeError, struct.error):
+            return None
+        if value is None:
+            return None
+        if 'exp' in value and int(value['exp']) <= now:
+            return None
+
+        if self.cache_size:
+            self.verified[digest] = (value, min(now + self.cache_ttl, value.get('exp', now + self.cache_ttl)))
+            if len(self.verified) > self.cache_size:
+                self.verified.popitem(last=False)
+        return dict(value)
+
 def append_cookie(request: Request, response: json, key: str, value: str, http_only: bool = False, expires_in: int = 604800, algorithm: str = "HS256") -> response:
     """
         Append a cookie to a response.
@@ -22,12 +205,14 @@ def append_cookie(request: Request, response: json, key: str, value: str, http_o
         Returns:
             Response: The response object with the cookie appended.
     """
+    if algorithm == "HS256":
+        # Signed with the prepared key, and set to expire with the cookie
+        signed_value = request.app.ctx.cookie_signer.encode(value, expires_in)
+    else:
+        signed_value = jwt.encode(value, request.app.ctx.env_manager.get("COOKIE_SECRET"), algorithm=algorithm)
     response.add_cookie(
         key,
-        jwt.encode(value, 
-            request.app.ctx.env_manager.get("COOKIE_SECRET"),
-            algorithm=algorithm
-        ),
+        signed_value,
         httponly=http_only,
         secure=True,
         max_age=expires_in,
@@ -45,15 +230,20 @@ def get_cookie(request: Request, key: str, algorithm: str = "HS256") -> str | No
             algorithm (str): The algorithm to use to decode the cookie.
 
         Returns:
-            str: The value of the cookie.
+            str: The value of the cookie, or None if it is missing, expired or not validly signed.
     """
+    value = request.cookies.get(key)
+    if value is None:
+        return None
+    if algorithm == "HS256":
+        return request.app.ctx.cookie_signer.decode(value)
     try:
         return jwt.decode(
-            request.cookies[key],
+            value,
             request.app.ctx.env_manager.get("COOKIE_SECRET"),
             algorithms=[algorithm]
         )
-    except jwt.ExpiredSignatureError:
+    except jwt.InvalidTokenError:
         return None
 
 def remove_cookie(response: json, key: str) -> response:
@@ -57,6 +57,18 @@ class UserDAL(BaseDAL):
         """
         return self.db_session.query(User).filter(User.email == email).first()
 
+    async def get_many(self, uuids: list[UUID]) -> list[User]:
+        """
+            Retrieve several users from the database in one query.
+
+            Args:
+                uuids (list[UUID]): The UUIDs of the users to retrieve.
+
+            Returns:
+                list[User]: The users found, in no particular order.
+        """
+        return self.db_session.query(User).filter(User.uuid.in_(uuids)).all()
+
     async def update(self, user: User) -> User:
         """
             Update a user in the database.
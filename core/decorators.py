@@ -3,7 +3,7 @@ from functools import wraps
 
 from sanic import BadRequest
 
-from core.authentication import get_user, mfa_is_setting_up
+from core.authentication import get_identity, mfa_is_setting_up
 
 def protected(
         inject: bool = True,
@@ -15,7 +15,9 @@ def protected(
         @wraps(f)
         async def decorated_function(request, *args, **kwargs):
 
-            user, session = await get_user(request, include_session=True)
+            # Shared with the `User` dependency and any other consumer of this request
+            identity = await get_identity(request)
+            user, session = identity.user, identity.session
 
             if email_unverified_only and user.is_email_verified:
                 raise BadRequest("User email is verified")
@@ -23,7 +25,7 @@ def protected(
             if mfa_logging_in_only and not session.get("is_logging_in_with_mfa"):
                 raise BadRequest("MFA is enabled")
 
-            if mfa_being_setup_only and not mfa_is_setting_up(request, user):
+            if mfa_being_setup_only and not await mfa_is_setting_up(request, user):
                 raise BadRequest("MFA is not being setup")
 
             if inject:
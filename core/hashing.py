@@ -1,35 +1,432 @@
 """
-This module provides functions for hashing and checking passwords using bcrypt.
+This module provides the policy passwords are hashed with (bcrypt or argon2, tuned to the host),
+functions for hashing and checking passwords with it, and the process pool the request path runs them on.
 """
 
-import aiobcrypt
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 
-async def hash_password(password: bytes) -> str:
+import argon2
+import bcrypt
+from sanic.exceptions import SanicException
+
+# Latencies kept for the percentiles of `HashingPool.get_stats`
+LATENCY_WINDOW = 1024
+
+HASHING_ALGORITHMS = ('bcrypt', 'argon2')
+
+# Tuning never goes below these, however slow the host is
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_MAX_ROUNDS = 20
+ARGON2_MIN_TIME_COST = 2
+ARGON2_MIN_MEMORY_KIB = 19456
+
+def _to_bytes(value) -> bytes:
+    return value if isinstance(value, bytes) else str(value).encode()
+
+class HashingPolicy:
+    """
+    How passwords are hashed: the algorithm and its cost parameters.
+    - The algorithm and parameters are stored in the hash string itself (`$2b$12$...`, `$argon2id$v=19$m=...,t=...,p=...$...`),
+      so hashes made under an older policy still verify and can be spotted by `needs_rehash`.
+    - Parameters left unset are picked by `tune` to hit `target_ms` on the host.
+
+    Args:
+        algorithm (str, optional): `bcrypt` or `argon2`. Defaults to bcrypt.
+        target_ms (float, optional): The milliseconds one hash should take when tuned. Defaults to 150.
+        bcrypt_rounds (int, optional): The bcrypt cost, tuned if unset.
+        argon2_time_cost (int, optional): The argon2 iterations, tuned if unset.
+        argon2_memory_kib (int, optional): The argon2 memory in KiB, lowered by tuning if one
+            iteration is already too slow. Defaults to 65536.
+    """
+    def __init__(
+            self,
+            algorithm: str = 'bcrypt',
+            target_ms: float = 150,
+            bcrypt_rounds: int = None,
+            argon2_time_cost: int = None,
+            argon2_memory_kib: int = 65536,
+        ):
+        if algorithm not in HASHING_ALGORITHMS:
+            raise ValueError(f"Invalid hashing algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.target_ms = target_ms
+        self.bcrypt_rounds = bcrypt_rounds
+        self.argon2_time_cost = argon2_time_cost
+        self.argon2_memory_kib = argon2_memory_kib
+        # Parameters pinned by configuration are kept as they are by `needs_rehash`, tuned ones within a factor 2
+        self.pinned = bcrypt_rounds is not None if algorithm == 'bcrypt' else argon2_time_cost is not None
+
+    @property
+    def tuned(self) -> bool:
+        return (self.bcrypt_rounds if self.algorithm == 'bcrypt' else self.argon2_time_cost) is not None
+
+    @property
+    def parameters(self) -> dict:
+        if self.algorithm == 'bcrypt':
+            return {'rounds': self.bcrypt_rounds}
+        return {'time_cost': self.argon2_time_cost, 'memory_kib': self.argon2_memory_kib}
+
+    def _argon2(self, time_cost: int = None, memory_kib: int = None) -> argon2.PasswordHasher:
+        return argon2.PasswordHasher(
+            time_cost=time_cost or self.argon2_time_cost,
+            memory_cost=memory_kib or self.argon2_memory_kib,
+            parallelism=1,
+        )
+
+    def tune(self) -> 'HashingPolicy':
+        """
+        Benchmark the host and pick the unset parameters of the algorithm, so one hash takes about `target_ms`.
+        - bcrypt doubles its work per round, so the rounds are extrapolated from a timing at cost 8.
+        - argon2 grows linearly with its iterations, which are scaled from a timing at one iteration.
+          Memory is halved first while that alone is over the target.
+        Blocks for up to about a second, run it off the event loop.
+
+        Returns:
+            HashingPolicy: The policy, tuned.
+        """
+        if self.tuned:
+            return self
+        target = self.target_ms / 1000
+
+        def timed(fn) -> float:
+            # The best of three, so one slow run caused by the host doesn't lower the cost
+            timings = []
+            for _ in range(3):
+                started = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - started)
+            return min(timings)
+
+        if self.algorithm == 'bcrypt':
+            elapsed = timed(lambda: bcrypt.hashpw(b'tuning', bcrypt.gensalt(8)))
+            rounds = 8 + round(math.log2(target / elapsed))
+            self.bcrypt_rounds = min(BCRYPT_MAX_ROUNDS, max(BCRYPT_MIN_ROUNDS, rounds))
+            return self
+
+        while True:
+            elapsed = timed(lambda: self._argon2(1).hash('tuning'))
+            if elapsed * ARGON2_MIN_TIME_COST <= target or self.argon2_memory_kib // 2 < ARGON2_MIN_MEMORY_KIB:
+                break
+            self.argon2_memory_kib //= 2
+        self.argon2_time_cost = max(ARGON2_MIN_TIME_COST, round(target / elapsed))
+        return self
+
+    def hash(self, password) -> str:
+        """
+        Hash a password under the policy. Blocks for about `target_ms`.
+
+        Args:
+            password (str | bytes): The password to be hashed.
+
+        Returns:
+            str: The hashed password, with its algorithm and parameters.
+        """
+        if self.algorithm == 'bcrypt':
+            return bcrypt.hashpw(_to_bytes(password), bcrypt.gensalt(self.bcrypt_rounds)).decode()
+        return self._argon2().hash(_to_bytes(password))
+
+    def verify(self, password, hashed_password) -> bool:
+        """
+        Check a password against a hash made under this or any earlier policy.
+
+        Args:
+            password (str | bytes): The password to check.
+            hashed_password (str | bytes): The hashed password to compare against.
+
+        Returns:
+            bool: True if the password matches the hashed password, False otherwise.
+        """
+        hashed_password = _to_bytes(hashed_password)
+        try:
+            if hashed_password.startswith(b'$argon2'):
+                # Parameters are read from the hash, the hasher's own don't matter
+                return argon2.PasswordHasher().verify(hashed_password, _to_bytes(password))
+            return bcrypt.checkpw(_to_bytes(password), hashed_password)
+        except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError, ValueError):
+            return False
+
+    def needs_rehash(self, hashed_password) -> bool:
+        """
+        Check whether a hash should be replaced by one made under this policy: it uses another algorithm,
+        or parameters other than the pinned ones, or parameters costing under half or over twice the tuned ones.
+        The tolerance keeps workers whose tuning came out a step apart from rehashing each other's hashes.
+
+        Args:
+            hashed_password (str | bytes): The hashed password.
+
+        Returns:
+            bool: True if the hash should be replaced.
+        """
+        hashed_password = _to_bytes(hashed_password).decode()
+        if self.algorithm == 'bcrypt':
+            if not hashed_password.startswith('$2'):
+                return True
+            try:
+                rounds = int(hashed_password.split('$')[2])
+            except (IndexError, ValueError):
+                return True
+            # Every round doubles the cost
+            tolerance = 0 if self.pinned else 1
+            return abs(rounds - self.bcrypt_rounds) > tolerance
+
+        try:
+            parameters = argon2.extract_parameters(hashed_password)
+        except argon2.exceptions.InvalidHashError:
+            return True
+        if parameters.type is not argon2.Type.ID or parameters.version != argon2.low_level.ARGON2_VERSION:
+            return True
+        if self.pinned:
+            return (parameters.time_cost, parameters.memory_cost) != (self.argon2_time_cost, self.argon2_memory_kib)
+        cost = parameters.time_cost * parameters.memory_cost / (self.argon2_time_cost * self.argon2_memory_kib)
+        return not 0.5 <= cost <= 2
+
+async def hash_password(password, policy: HashingPolicy = None) -> str:
     """
-    Hashes the given password using bcrypt.
+    Hashes the given password on a thread, use `HashingPool.hash_password` on the request path.
 
     Args:
-        password (bytes): The password to be hashed.
+        password (str | bytes): The password to be hashed.
+        policy (HashingPolicy, optional): The policy to hash with. Defaults to bcrypt at its default cost.
 
     Returns:
         str: The hashed password.
     """
-    salt = await aiobcrypt.gensalt()
-
-    hashed_password = await aiobcrypt.hashpw(password, salt)
-    return hashed_password
+    policy = policy or HashingPolicy(bcrypt_rounds=12)
+    return await asyncio.get_running_loop().run_in_executor(None, policy.hash, password)
 
-async def check_password(password: bytes, hashed_password: bytes) -> bool:
+async def check_password(password, hashed_password) -> bool:
     """
-    Check if the provided password matches the hashed password.
+    Check if the provided password matches the hashed password on a thread,
+    use `HashingPool.check_password` on the request path.
 
     Args:
-        password (bytes): The password to check.
-        hashed_password (bytes): The hashed password to compare against.
+        password (str | bytes): The password to check.
+        hashed_password (str | bytes): The hashed password to compare against, bcrypt or argon2.
 
     Returns:
         bool: True if the password matches the hashed password, False otherwise.
     """
-    if await aiobcrypt.checkpw(password, hashed_password):
-        return True
-    return False
\ No newline at end of file
+    return await asyncio.get_running_loop().run_in_executor(None, HashingPolicy().verify, password, hashed_password)
+
+def _warm_up() -> int:
+    """
+    Start a worker process of the pool, with this module imported.
+    """
+    return os.getpid()
+
+def _tune(policy: HashingPolicy) -> HashingPolicy:
+    """
+    Tune a policy, in a worker process of the pool so it's timed where hashes run.
+    """
+    return policy.tune()
+
+def _hash(policy: HashingPolicy, password: bytes) -> str:
+    """
+    Hash a password, in a worker process of the pool.
+    """
+    return policy.hash(password)
+
+def _verify(policy: HashingPolicy, password: bytes, hashed_password: bytes) -> bool:
+    """
+    Check a password against its hash, in a worker process of the pool.
+    """
+    return policy.verify(password, hashed_password)
+
+class HashingBusy(SanicException):
+    """
+    Raised when the hashing pool has no room for another job, answered with 429 Too Many Requests.
+
+    Args:
+        reason (str): What was full - `queue`, `ip` or `account`.
+        retry_after (int): The seconds the client is asked to wait before retrying.
+    """
+    status_code = 429
+    quiet = True
+
+    def __init__(self, reason: str, retry_after: int = 1):
+        super().__init__("Too many requests, try again shortly", headers={"Retry-After": str(retry_after)})
+        self.reason = reason
+
+class HashingPool:
+    """
+    Runs password hashing on a dedicated process pool, so a burst of logins can't starve the event loop.
+    - At most `max_pending` jobs are running or queued at once, further ones fail fast with `HashingBusy`.
+    - One IP address or account can only hold `max_per_ip` and `max_per_account` of them, so a single
+      client can't fill the queue for everyone else.
+    - Queue depth and hash latency (queue wait included) are reported by `get_stats`.
+    - Passwords are hashed under `policy`, tuned on a worker at startup when its parameters aren't set.
+
+    Args:
+        policy (HashingPolicy, optional): The policy passwords are hashed with. Defaults to tuned bcrypt.
+        workers (int, optional): The worker processes. Defaults to half of the CPUs.
+        max_pending (int, optional): The jobs running or queued at once. Defaults to 8 per worker.
+        max_per_ip (int, optional): The jobs one IP address can have pending. Defaults to 4.
+        max_per_account (int, optional): The jobs one account can have pending. Defaults to 2.
+        retry_after (int, optional): The seconds rejected clients are asked to wait. Defaults to 1.
+    """
+    def __init__(
+            self,
+            policy: HashingPolicy = None,
+            workers: int = None,
+            max_pending: int = None,
+            max_per_ip: int = 4,
+            max_per_account: int = 2,
+            retry_after: int = 1,
+        ):
+        self.policy = policy or HashingPolicy()
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self.max_pending = max_pending or 8 * self.workers
+        self.max_per_ip = max_per_ip
+        self.max_per_account = max_per_account
+        self.retry_after = retry_after
+        self.executor = None
+
+        self.pending = 0
+        self.pending_per_ip = {}
+        self.pending_per_account = {}
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = {'queue': 0, 'ip': 0, 'account': 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    async def __async__init__(self) -> None:
+        # Spawned rather than forked, the event loop and its threads aren't copied into the workers
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=get_context('spawn'))
+        # Starts every worker now instead of on the first logins
+        await asyncio.gather(*(asyncio.wrap_future(self.executor.submit(_warm_up)) for _ in range(self.workers)))
+        if not self.policy.tuned:
+            self.policy = await asyncio.wrap_future(self.executor.submit(_tune, self.policy))
+
+    def _reject(self, reason: str):
+        self.rejected[reason] += 1
+        raise HashingBusy(reason, self.retry_after)
+
+    def _admit(self, ip: str | None, account: str | None) -> None:
+        """
+        Take a slot for a job, or raise `HashingBusy` if the queue or the caller's share of it is full.
+        """
+        if self.pending >= self.max_pending:
+            self._reject('queue')
+        if ip is not None and self.pending_per_ip.get(ip, 0) >= self.max_per_ip:
+            self._reject('ip')
+        if account is not None and self.pending_per_account.get(account, 0) >= self.max_per_account:
+            self._reject('account')
+
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        if ip is not None:
+            self.pending_per_ip[ip] = self.pending_per_ip.get(ip, 0) + 1
+        if account is not None:
+            self.pending_per_account[account] = self.pending_per_account.get(account, 0) + 1
+
+    def _release(self, ip: str | None, account: str | None) -> None:
+        self.pending -= 1
+        for pending, key in ((self.pending_per_ip, ip), (self.pending_per_account, account)):
+            if key is None:
+                continue
+            if pending[key] <= 1:
+                del pending[key]
+            else:
+                pending[key] -= 1
+
+    async def _run(self, ip: str | None, account: str | None, fn, *args):
+        """
+        Run a job on the pool once admitted, recording its latency.
+        """
+        account = None if account is None else str(account)
+        self._admit(ip, account)
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wrap_future(self.executor.submit(fn, *args))
+        finally:
+            self._release(ip, account)
+        self.latencies.append(time.perf_counter() - started)
+        self.completed += 1
+        return result
+
+    async def hash_password(self, password, ip: str = None, account=None) -> str:
+        """
+        Hash a password on the pool.
+
+        Args:
+            password (str | bytes): The password to be hashed.
+            ip (str, optional): The IP address the request came from.
+            account (optional): The account the password belongs to, such as its email or UUID.
+
+        Returns:
+            str: The hashed password.
+
+        Raises:
+            HashingBusy: If the pool has no room for the job.
+        """
+        return await self._run(ip, account, _hash, self.policy, _to_bytes(password))
+
+    async def check_password(self, password, hashed_password, ip: str = None, account=None) -> bool:
+        """
+        Check a password against its hash on the pool.
+
+        Args:
+            password (str | bytes): The password to check.
+            hashed_password (str | bytes): The hashed password to compare against.
+            ip (str, optional): The IP address the request came from.
+            account (optional): The account the password belongs to, such as its email or UUID.
+
+        Returns:
+            bool: True if the password matches the hashed password, False otherwise.
+
+        Raises:
+            HashingBusy: If the pool has no room for the job.
+        """
+        return await self._run(ip, account, _verify, self.policy, _to_bytes(password), _to_bytes(hashed_password))
+
+    def needs_rehash(self, hashed_password) -> bool:
+        """
+        Check whether a hash should be replaced by one made under the pool's policy, see `HashingPolicy.needs_rehash`.
+
+        Args:
+            hashed_password (str | bytes): The hashed password.
+
+        Returns:
+            bool: True if the hash should be replaced.
+        """
+        return self.policy.needs_rehash(hashed_password)
+
+    def get_stats(self) -> dict:
+        """
+        Retrieve the counters of the pool.
+
+        Returns:
+            dict: The hashing algorithm and parameters, the current and peak queue depth, the completed and rejected jobs,
+                and the p50, p99 and max hash latency in milliseconds over the last jobs.
+        """
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction: float) -> float | None:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+        return {
+            'algorithm': self.policy.algorithm,
+            'parameters': self.policy.parameters,
+            'workers': self.workers,
+            'pending': self.pending,
+            'peak_pending': self.peak_pending,
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+            'rejected': dict(self.rejected),
+            'latency_p50_ms': percentile(0.5),
+            'latency_p99_ms': percentile(0.99),
+            'latency_max_ms': latencies[-1] * 1000 if latencies else None,
+        }
+
+    async def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
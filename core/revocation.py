@@ -0,0 +1,141 @@
+""" A module holding revoked session IDs in a compact in-memory filter synced from the cache storage. """
+
+import asyncio
+import hashlib
+import math
+import time
+from core.cache_storage import CacheStorageManager
+
+REVOKED_INDEX = 'revoked'
+REVOKED_PREFIX = 'revoked:'
+
+class BloomFilter:
+    """
+    A Bloom filter over strings: no false negatives, and false positives at about `error_rate`.
+
+    Args:
+        capacity (int): The number of items the filter is sized for.
+        error_rate (float, optional): The false positive rate at capacity. Defaults to 0.001.
+    """
+    __slots__ = ('size', 'hash_count', 'bits')
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(-(-self.size // 8))
+
+    def _positions(self, item: str):
+        """
+        The bit positions of an item, derived from one hash by double hashing.
+        """
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class RevocationList:
+    """
+    Revoked session IDs, shared through the cache storage and checked locally.
+    - Revocations are written to the storage, each with a marker entry and a member of the revoked index.
+    - Every worker rebuilds a Bloom filter from the index every `sync_interval` seconds, in the background,
+      so checking a session that was never revoked costs no round trip.
+    - A filter hit is confirmed against the marker entry, which also rules out false positives.
+    - Revocations only need to outlive the signed claims they block, so they expire after `ttl` seconds.
+
+    Args:
+        storage (CacheStorageManager): The cache instance holding the revocations.
+        ttl (int): The seconds a revocation is kept.
+        sync_interval (float, optional): The seconds between filter rebuilds. Defaults to 1.
+        capacity (int, optional): The number of revocations the filter is sized for at least. Defaults to 10000.
+    """
+    def __init__(self, storage: CacheStorageManager, ttl: int, sync_interval: float = 1.0, capacity: int = 10000):
+        self.storage = storage
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self.capacity = capacity
+        self.filter = BloomFilter(capacity)
+        # Revocations made by this worker with the time they were made, kept across rebuilds
+        # started before the revocation reached the storage
+        self.local = {}
+        self.synced_at = None
+        self.syncing = None
+
+    async def sync(self) -> None:
+        """
+        Rebuild the filter from the revoked index of the storage.
+        """
+        started = time.monotonic()
+        members = await self.storage.index_members(REVOKED_INDEX)
+        self.local = {
+            session_id: revoked_at for session_id, revoked_at in self.local.items()
+            if started - revoked_at < self.ttl
+        }
+        bloom = BloomFilter(max(self.capacity, 2 * (len(members) + len(self.local))))
+        for session_id in members:
+            bloom.add(session_id)
+        for session_id in self.local:
+            bloom.add(session_id)
+        self.filter = bloom
+        self.synced_at = started
+
+    def _synced(self, task: asyncio.Task) -> None:
+        self.syncing = None
+        if not task.cancelled():
+            # A failed sync is retried on the next check, the old filter stays in use meanwhile
+            task.exception()
+
+    def _maybe_sync(self) -> None:
+        """
+        Start a background rebuild if the filter is older than the sync interval.
+        """
+        if self.syncing is None and time.monotonic() - self.synced_at >= self.sync_interval:
+            self.syncing = asyncio.create_task(self.sync())
+            self.syncing.add_done_callback(self._synced)
+
+    async def revoke(self, session_ids: list) -> None:
+        """
+        Revoke sessions on every worker.
+
+        Args:
+            session_ids (list): The IDs of the sessions.
+        """
+        if not session_ids:
+            return
+        await self.storage.set_many({REVOKED_PREFIX + session_id: True for session_id in session_ids}, ttl=self.ttl)
+        for session_id in session_ids:
+            await self.storage.index_add(REVOKED_INDEX, session_id, ttl=self.ttl)
+            self.local[session_id] = time.monotonic()
+            self.filter.add(session_id)
+
+    async def is_revoked(self, session_id: str) -> bool:
+        """
+        Check whether a session was revoked, without a round trip unless the filter matches.
+
+        Args:
+            session_id (str): The ID of the session.
+
+        Returns:
+            bool: True if the session was revoked.
+        """
+        if self.synced_at is None:
+            await self.sync()
+        else:
+            self._maybe_sync()
+        if session_id not in self.filter:
+            return False
+        return await self.storage.get(REVOKED_PREFIX + session_id) is not None
+
+    async def close(self) -> None:
+        if self.syncing is not None:
+            self.syncing.cancel()
+            self.syncing = None
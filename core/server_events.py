@@ -4,10 +4,14 @@ from sanic import Sanic
 from asyncio import AbstractEventLoop
 from core.database import init_db, close_db
 from core.database.models.user.User import User
+from core.user_snapshot import UserSnapshot
 from core.sessions import SessionManager
 from core.cache import CacheManager
+from core.hashing import HashingPolicy, HashingPool
+from core.throttle import LoginThrottle
 from core.authentication import get_user
 from core.config import init_config
+from core.cookies import CookieSigner
 
 async def clear_expired_storage(app: Sanic) -> None:
     """
@@ -19,6 +23,7 @@ async def clear_expired_storage(app: Sanic) -> None:
     while True:
         await app.ctx.cache_manager.clear_expired()
         await app.ctx.session_manager.clear_expired()
+        await app.ctx.login_throttle.clear_expired()
         await asyncio.sleep(app.ctx.env_manager.get("CACHE_EXPIRATION_INTERVAL"))
 
 async def before_server_start(app: Sanic, loop: AbstractEventLoop) -> None:
@@ -39,27 +44,100 @@ async def before_server_start(app: Sanic, loop: AbstractEventLoop) -> None:
 
     await init_config(app)
 
+    COOKIE_CACHE_SIZE = app.ctx.env_manager.get("COOKIE_CACHE_SIZE")
+
+    app.ctx.identity_cookie = app.ctx.env_manager.get("COOKIE_IDENTITY")
+    app.ctx.cookie_signer = CookieSigner(
+        app.ctx.env_manager.get("COOKIE_SECRET"),
+        cookie_format=app.ctx.env_manager.get("COOKIE_FORMAT") or "jwt",
+        cache_size=4096 if COOKIE_CACHE_SIZE in (None, '') else COOKIE_CACHE_SIZE,
+        cache_ttl=app.ctx.env_manager.get("COOKIE_CACHE_TTL") or 300,
+    )
+
     CACHE_STORAGE_TYPE = app.ctx.env_manager.get("CACHE_STORAGE_TYPE")
+    CACHE_CODECS = app.ctx.env_manager.get("CACHE_CODECS") or {}
 
     if CACHE_STORAGE_TYPE == "redis":
-        REDIS_URL = app.ctx.env_manager.get("REDIS_URL")
-        app.ctx.session_manager = SessionManager(connector_type="redis", redis_url=REDIS_URL)
-        app.ctx.cache_manager = CacheManager(connector_type="redis", redis_url=REDIS_URL)
-    if CACHE_STORAGE_TYPE == "sqlite":
-        app.ctx.session_manager = SessionManager(connector_type="sqlite", db_path=app.ctx.env_manager.get("CACHE_STORAGE_DB_PATH"))
-        app.ctx.cache_manager = CacheManager(connector_type="sqlite", db_path=app.ctx.env_manager.get("CACHE_STORAGE_DB_PATH"))
-    if CACHE_STORAGE_TYPE == "system":
-        app.ctx.session_manager = SessionManager(connector_type="system")
-        app.ctx.cache_manager = CacheManager(connector_type="system")
-    if CACHE_STORAGE_TYPE == "memcached":
-        app.ctx.session_manager = SessionManager(connector_type="memcached", memcached_url=app.ctx.env_manager.get("MEMCACHED_URL"))
-        app.ctx.cache_manager = CacheManager(connector_type="memcached", memcached_url=app.ctx.env_manager.get("MEMCACHED_URL"))
+        connector_kwargs = {"redis_url": app.ctx.env_manager.get("REDIS_URL")}
+    elif CACHE_STORAGE_TYPE == "sqlite":
+        connector_kwargs = {"db_path": app.ctx.env_manager.get("CACHE_STORAGE_DB_PATH")}
+    elif CACHE_STORAGE_TYPE == "system":
+        connector_kwargs = {
+            "max_entries": app.ctx.env_manager.get("CACHE_SYSTEM_MAX_ENTRIES"),
+            "max_bytes": app.ctx.env_manager.get("CACHE_SYSTEM_MAX_BYTES"),
+            "snapshot_dir": app.ctx.env_manager.get("CACHE_SYSTEM_SNAPSHOT_DIR") or None,
+            "snapshot_interval": app.ctx.env_manager.get("CACHE_SYSTEM_SNAPSHOT_INTERVAL") or 0,
+        }
+    elif CACHE_STORAGE_TYPE == "memcached":
+        connector_kwargs = {"memcached_url": app.ctx.env_manager.get("MEMCACHED_URL")}
+    elif CACHE_STORAGE_TYPE == "shared_memory":
+        connector_kwargs = {
+            "directory": app.ctx.env_manager.get("CACHE_SHM_DIR") or None,
+            "max_entries": app.ctx.env_manager.get("CACHE_SHM_MAX_ENTRIES"),
+            "arena_bytes": app.ctx.env_manager.get("CACHE_SHM_ARENA_BYTES"),
+        }
+    else:
+        connector_kwargs = {}
+
+    near_cache_kwargs = {
+        "near_cache_ttl": app.ctx.env_manager.get("CACHE_NEAR_TTL"),
+        "near_cache_size": app.ctx.env_manager.get("CACHE_NEAR_MAX_ENTRIES"),
+    }
+
+    CACHE_BATCH_WINDOW_US = app.ctx.env_manager.get("CACHE_BATCH_WINDOW_US")
+    batch_window = None if CACHE_BATCH_WINDOW_US in (None, '') else CACHE_BATCH_WINDOW_US / 1_000_000
+
+    session_kwargs = {
+        "mode": app.ctx.env_manager.get("SESSION_MODE") or "stateful",
+        "claims_ttl": app.ctx.env_manager.get("SESSION_CLAIMS_TTL") or 300,
+        "revocation_sync": app.ctx.env_manager.get("SESSION_REVOCATION_SYNC") or 1.0,
+        "touch_interval": app.ctx.env_manager.get("SESSION_TOUCH_INTERVAL") or None,
+        "touch_fraction": app.ctx.env_manager.get("SESSION_TOUCH_FRACTION") or 0.5,
+    }
+
+    app.ctx.session_manager = SessionManager(connector_type=CACHE_STORAGE_TYPE, codec=CACHE_CODECS.get("sessions"), **near_cache_kwargs, batch_window=batch_window, **session_kwargs, **connector_kwargs)
+    app.ctx.cache_manager = CacheManager(connector_type=CACHE_STORAGE_TYPE, codec=CACHE_CODECS.get("users"), **near_cache_kwargs, batch_window=batch_window, ttl=app.ctx.env_manager.get("CACHE_USER_TTL") or None, **connector_kwargs)
+
+    # Password hashing runs on its own processes, with admission control so login bursts get a 429 instead of starving the loop
+    # Parameters left empty are tuned on the host to take HASHING_TARGET_MS per hash
+    hashing_policy = HashingPolicy(
+        algorithm=app.ctx.env_manager.get("HASHING_ALGORITHM") or "bcrypt",
+        target_ms=app.ctx.env_manager.get("HASHING_TARGET_MS") or 150,
+        bcrypt_rounds=app.ctx.env_manager.get("HASHING_BCRYPT_ROUNDS") or None,
+        argon2_time_cost=app.ctx.env_manager.get("HASHING_ARGON2_TIME_COST") or None,
+        argon2_memory_kib=app.ctx.env_manager.get("HASHING_ARGON2_MEMORY_KIB") or 65536,
+    )
+    app.ctx.hashing_pool = HashingPool(
+        policy=hashing_policy,
+        workers=app.ctx.env_manager.get("HASHING_WORKERS") or None,
+        max_pending=app.ctx.env_manager.get("HASHING_MAX_PENDING") or None,
+        max_per_ip=app.ctx.env_manager.get("HASHING_MAX_PER_IP") or 4,
+        max_per_account=app.ctx.env_manager.get("HASHING_MAX_PER_ACCOUNT") or 2,
+    )
+
+    app.ctx.login_throttle = LoginThrottle(
+        connector_type=CACHE_STORAGE_TYPE,
+        db_session=asyncsession,
+        codec=CACHE_CODECS.get("login_throttle"),
+        batch_window=batch_window,
+        window=app.ctx.env_manager.get("LOGIN_THROTTLE_WINDOW") or 900,
+        max_account_failures=app.ctx.env_manager.get("LOGIN_MAX_ACCOUNT_FAILURES") or 5,
+        max_ip_failures=app.ctx.env_manager.get("LOGIN_MAX_IP_FAILURES") or 50,
+        audit_interval=app.ctx.env_manager.get("LOGIN_AUDIT_FLUSH_INTERVAL") or 30,
+        **connector_kwargs
+    )
 
     await app.ctx.cache_manager.__async__init__()
     await app.ctx.session_manager.__async__init__()
+    await app.ctx.login_throttle.__async__init__()
+    await app.ctx.hashing_pool.__async__init__()
+
+    # Cached users are dropped when their row changes, and loaded again on the next request
+    app.ctx.cache_manager.register_invalidation_hooks()
 
-    # Adding user dependency if it has type hint `: User`
+    # Adding user dependency if it has type hint `: User` or `: UserSnapshot`, both get the cached snapshot
     app.ext.add_dependency(User, get_user)
+    app.ext.add_dependency(UserSnapshot, get_user)
 
 async def after_server_start(app: Sanic, loop: AbstractEventLoop) -> None:
     """
@@ -81,4 +159,8 @@ async def before_server_stop(app: Sanic, loop: AbstractEventLoop) -> None:
             app (Sanic): The Sanic application.
             loop (asyncio.AbstractEventLoop): The event loop.
     """
+    await app.ctx.cache_manager.close()
+    await app.ctx.session_manager.close()
+    await app.ctx.hashing_pool.close()
+    await app.ctx.login_throttle.close()
     await close_db()
@@ -1,36 +1,74 @@
+import asyncio
 from datetime import datetime
+import time
 from typing import Dict, Union
 import uuid
 from sqlalchemy import Uuid
 from core.cache_storage import CacheStorageManager
+from core.cache_storage.connectors.factory import make_connector
 from core.database.models.user.User import User
+from core.revocation import RevocationList
 
-from core.cache_storage.connectors.sqlite import SQLiteConnector
-from core.cache_storage.connectors.redis import RedisConnector
-from core.cache_storage.connectors.system import SystemConnector
-from core.cache_storage.connectors.memcached import MemcachedConnector
+SESSION_MODES = ('stateful', 'stateless')
 
 class SessionManager:
-    def __init__(self, connector_type: str, **kwargs):
+    """
+    Stores user sessions keyed by their session ID.
+    - The session IDs of each user are kept in a secondary index, so listing or counting the sessions
+      of a user costs one index read instead of a scan of every session.
+    - In stateless mode the identity cookie carries signed, short-lived claims, validated without the store.
+      Once the claims are older than `claims_ttl` the stored session is checked again and the claims reissued,
+      and revoked sessions are caught in between by a revocation filter synced from the store.
+    - With `touch_interval`, expiry slides with activity: a session seen after `touch_fraction` of its TTL
+      is queued, and the queue is flushed as one batched touch every `touch_interval` seconds.
+    """
+    def __init__(
+            self,
+            connector_type: str,
+            codec: str = None,
+            near_cache_ttl: float = None,
+            near_cache_size: int = None,
+            batch_window: float = None,
+            mode: str = 'stateful',
+            claims_ttl: int = 300,
+            revocation_sync: float = 1.0,
+            touch_interval: float = None,
+            touch_fraction: float = 0.5,
+            **kwargs
+        ):
         """
         Initialize the session manager.
 
         Args:
             connector_type: The type of connector to use.
+            codec: The name of the codec used to encode cached values. Defaults to the compact codec.
+            near_cache_ttl: Seconds values are served from an in-process near cache. Defaults to disabled.
+            near_cache_size: The maximum number of entries in the near cache.
+            batch_window: Seconds single-key calls are collected for and sent as one batch. Defaults to disabled.
+            mode: `stateful` to look every session up in the store, or `stateless` for signed session claims.
+            claims_ttl: Seconds signed session claims are trusted before the stored session is checked again.
+            revocation_sync: Seconds between revocation filter syncs, the delay for a logout to reach other workers.
+            touch_interval: Seconds between flushes of sliding expiry touches. Defaults to disabled, a fixed TTL.
+            touch_fraction: The fraction of its TTL a session must be past before it is touched again.
             kwargs: Additional keyword arguments to pass to the connector.
         """
-        if connector_type.lower() == 'sqlite':
-            connector = SQLiteConnector(**kwargs)
-        elif connector_type.lower() == 'redis':
-            connector = RedisConnector(**kwargs)
-        elif connector_type.lower() == 'system':
-            connector = SystemConnector(**kwargs)
-        elif connector_type.lower() == 'memcached':
-            connector = MemcachedConnector(**kwargs)
-        else:
-            raise ValueError('Invalid connector type: {}'.format(connector_type))
+        connector = make_connector(connector_type, **kwargs)
+
+        if mode not in SESSION_MODES:
+            raise ValueError('Invalid session mode: {}'.format(mode))
+
+        self.sessions = CacheStorageManager(connector, 'sessions', codec, near_cache_ttl, near_cache_size, batch_window, generations=True)
+        self.stateless = mode == 'stateless'
+        self.claims_ttl = claims_ttl
+        self.revocations = RevocationList(self.sessions, claims_ttl, revocation_sync) if self.stateless else None
 
-        self.sessions = CacheStorageManager(connector, 'sessions')
+        self.touch_interval = touch_interval
+        self.touch_fraction = touch_fraction
+        # When this worker last pushed back the expiry of each session, with the session TTL
+        self.touched = {}
+        # Sessions waiting for the next flush, with their owner and TTL
+        self.pending_touches = {}
+        self.touch_task = None
 
     async def __async__init__(self) -> None:
         """
@@ -51,6 +89,18 @@ class SessionManager:
         session_info = await self.sessions.get(session_id)
         return session_info
 
+    async def get_many(self, session_ids: list[str]) -> Dict[str, Dict[str, Union[Uuid, str, datetime, bool]]]:
+        """
+        Retrieve several user sessions info from the cache in one round trip.
+
+        Args:
+            session_ids: The IDs of the sessions to retrieve.
+
+        Returns:
+            The found user sessions info keyed by their session ID.
+        """
+        return await self.sessions.get_many(session_ids)
+
     async def add(self, session_id: str, user_uuid: Uuid, ip_address: str, is_logging_in_with_mfa: bool, ttl: int = None) -> None:
         """
         Add a user session info to the cache.
@@ -62,43 +112,264 @@ class SessionManager:
             is_logging_in_with_mfa: Boolean indicating if the user is logging in with MFA.
             ttl: The time-to-live in seconds. Defaults to None.
         """
+        created_at = datetime.now()
         session_info = {
             'user_uuid': user_uuid,
-            'created_at': datetime.now(),
+            'created_at': created_at,
+            # Epoch seconds, read by `touch` whatever the codec makes of `created_at`
+            'created_ts': created_at.timestamp(),
             'ip_address': ip_address,
             'is_logging_in_with_mfa': is_logging_in_with_mfa,
-            'session_id': session_id
+            'session_id': session_id,
+            'ttl': ttl
         }
         await self.sessions.set(session_id, session_info, ttl=ttl)
+        await self.sessions.index_add(self._user_index(user_uuid), session_id, ttl=ttl)
 
-    async def delete(self, session_id: str) -> None:
+    async def delete(self, session_id: str, user_uuid: Uuid = None) -> None:
         """
         Remove a user session info from the cache based on the session ID.
 
         Args:
             session_id: The ID of the session.
+            user_uuid: The uuid of the session owner, looked up from the session when not given.
         """
+        if user_uuid is None:
+            session_info = await self.sessions.get(session_id)
+            if session_info is not None:
+                user_uuid = session_info.get('user_uuid')
+        self.pending_touches.pop(session_id, None)
+        self.touched.pop(session_id, None)
         await self.sessions.delete(session_id)
+        if user_uuid is not None:
+            await self.sessions.index_remove(self._user_index(user_uuid), [session_id])
+        if self.revocations is not None:
+            await self.revocations.revoke([session_id])
 
-    async def clear_expired(self) -> None:
+    async def cookie_value(self, session_id: str, user_uuid: Uuid, is_logging_in_with_mfa: bool) -> dict:
         """
-        Clear expired sessions from the cache.
+        Build the value of the identity cookie of a session.
+
+        Args:
+            session_id: The ID of the session.
+            user_uuid: The uuid of the session owner.
+            is_logging_in_with_mfa: Boolean indicating if the user is logging in with MFA.
+
+        Returns:
+            The session ID, or in stateless mode the session claims, to be signed into the cookie.
         """
-        await self.sessions.clear_expired()
+        if not self.stateless:
+            return {'session_id': session_id}
+        issued_at = int(time.time())
+        return {
+            'sid': session_id,
+            'uid': str(user_uuid),
+            'mfa': is_logging_in_with_mfa,
+            'iat': issued_at,
+            'rat': issued_at + self.claims_ttl,
+            'gen': await self.sessions.generation(),
+        }
+
+    async def resolve(self, cookie: dict) -> tuple[Union[Dict[str, Union[Uuid, str, datetime, bool]], None], Union[dict, None]]:
+        """
+        Retrieve the session info of an identity cookie.
+        - Stateless claims are trusted without a round trip until their refresh time, unless revoked.
+
+        Args:
+            cookie: The decoded identity cookie.
+
+        Returns:
+            The user session info if the session is valid, otherwise None, and the reissued claims
+            when the cookie must be rewritten, otherwise None.
+        """
+        if not self.stateless:
+            session_info = await self.sessions.get(cookie.get('session_id'))
+            if session_info is not None:
+                self.touch(session_info)
+            return session_info, None
+
+        session_id = cookie.get('sid')
+        if session_id is None:
+            return None, None
+        # Claims issued before `revoke_all` carry an older generation
+        if cookie.get('gen') != await self.sessions.generation():
+            return None, None
+        if await self.revocations.is_revoked(session_id):
+            return None, None
 
-    async def get_all(self, user: User) -> Dict[str, Union[Uuid, str, datetime, bool]]:
+        if time.time() < cookie.get('rat', 0):
+            return {
+                'user_uuid': uuid.UUID(cookie['uid']),
+                'created_at': datetime.fromtimestamp(cookie['iat']),
+                'is_logging_in_with_mfa': cookie['mfa'],
+                'session_id': session_id,
+            }, None
+
+        session_info = await self.sessions.get(session_id)
+        if session_info is None:
+            return None, None
+        self.touch(session_info)
+        return session_info, await self.cookie_value(session_id, session_info['user_uuid'], session_info['is_logging_in_with_mfa'])
+
+    def touch(self, session_info: Dict[str, Union[Uuid, str, datetime, bool]]) -> None:
         """
-        Retrieve all user session info from the cache based on the user.
+        Queue a session to have its expiry pushed back, if it is past `touch_fraction` of its TTL.
+        - No write happens here, queued sessions are flushed in batches every `touch_interval` seconds.
+
+        Args:
+            session_info: The user session info of an active session.
+        """
+        ttl = session_info.get('ttl')
+        if self.touch_interval is None or not ttl:
+            return
+        session_id = session_info['session_id']
+        now = time.time()
+        if session_id in self.touched:
+            touched_at = self.touched[session_id][0]
+        else:
+            touched_at = session_info.get('created_ts')
+            if touched_at is None:
+                # Stored before `created_ts` was, `created_at` is an ISO string with the json codec
+                created_at = session_info['created_at']
+                if isinstance(created_at, str):
+                    created_at = datetime.fromisoformat(created_at)
+                touched_at = created_at.timestamp()
+        if now - touched_at < ttl * self.touch_fraction:
+            return
+        self.touched[session_id] = (now, ttl)
+        self.pending_touches[session_id] = (session_info['user_uuid'], ttl)
+        if self.touch_task is None:
+            self.touch_task = asyncio.create_task(self._touch_periodically())
+
+    async def flush_touches(self) -> None:
+        """
+        Push back the expiry of the queued sessions and of their entries in the user indexes.
+        """
+        pending, self.pending_touches = self.pending_touches, {}
+        by_ttl = {}
+        by_index = {}
+        for session_id, (user_uuid, ttl) in pending.items():
+            by_ttl.setdefault(ttl, []).append(session_id)
+            by_index.setdefault(self._user_index(user_uuid), []).append((session_id, ttl))
+
+        async def touch_index(index: str, members: list) -> None:
+            # One user's sessions in turn, so their adds don't contend on the same index
+            for session_id, ttl in members:
+                await self.sessions.index_add(index, session_id, ttl=ttl)
+
+        try:
+            for ttl, session_ids in by_ttl.items():
+                await self.sessions.touch_many(session_ids, ttl)
+            await asyncio.gather(*(touch_index(index, members) for index, members in by_index.items()))
+        except asyncio.CancelledError:
+            # Interrupted by `close`, queued again for its final flush
+            for session_id, touch in pending.items():
+                self.pending_touches.setdefault(session_id, touch)
+            raise
+        except Exception:
+            # Let the next request of these sessions queue them again
+            for session_id in pending:
+                self.touched.pop(session_id, None)
+            raise
+
+        now = time.time()
+        self.touched = {
+            session_id: (touched_at, ttl) for session_id, (touched_at, ttl) in self.touched.items()
+            if now - touched_at < ttl
+        }
+
+    async def _touch_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.touch_interval)
+            try:
+                await self.flush_touches()
+            except Exception:
+                # The storage is unavailable, the sessions are queued again on their next request
+                pass
+
+    def _user_index(self, user_uuid: Uuid) -> str:
+        """
+        The name of the index holding the session IDs of a user.
+        """
+        return f'user:{user_uuid}'
+
+    async def list_for_user(self, user: User) -> list[Dict[str, Union[Uuid, str, datetime, bool]]]:
+        """
+        Retrieve all user session info of a user, through the user's session index.
+        - Index members whose session is gone, e.g. evicted, are pruned from the index.
 
         Args:
             user: The user to retrieve sessions for.
 
         Returns:
-            The user session info.
+            The user sessions info.
+        """
+        index = self._user_index(user.uuid)
+        session_ids = await self.sessions.index_members(index)
+        if not session_ids:
+            return []
+        sessions = await self.sessions.get_many(session_ids)
+        missing = [session_id for session_id in session_ids if session_id not in sessions]
+        if missing:
+            await self.sessions.index_remove(index, missing)
+        return list(sessions.values())
+
+    async def count_for_user(self, user: User) -> int:
+        """
+        Count the live sessions of a user.
+
+        Args:
+            user: The user to count sessions for.
+
+        Returns:
+            The number of sessions.
         """
-        user_sessions = await self.sessions.get_all(user.uuid)
-        return user_sessions
-    
+        return len(await self.list_for_user(user))
+
+    async def revoke_all_for_user(self, user: User) -> None:
+        """
+        Log a user out of every session, e.g. after a password change.
+
+        Args:
+            user: The user to log out.
+        """
+        session_ids = await self.sessions.index_pop(self._user_index(user.uuid))
+        if session_ids:
+            await self.sessions.delete_many(session_ids)
+            if self.revocations is not None:
+                await self.revocations.revoke(session_ids)
+
+    async def revoke_all(self) -> None:
+        """
+        Log every user out at once, e.g. after rotating the cookie secret.
+        """
+        await self.sessions.invalidate_all()
+
+    async def clear_expired(self) -> None:
+        """
+        Clear expired sessions from the cache.
+        """
+        await self.sessions.clear_expired()
+
+    async def close(self) -> None:
+        """
+        Release the connections held by the session storage.
+        """
+        try:
+            if self.touch_task is not None:
+                touch_task, self.touch_task = self.touch_task, None
+                touch_task.cancel()
+                # A periodic flush interrupted by the cancel queues its sessions again before the final one
+                try:
+                    await touch_task
+                except asyncio.CancelledError:
+                    pass
+                await self.flush_touches()
+        finally:
+            if self.revocations is not None:
+                await self.revocations.close()
+            await self.sessions.close()
+
     def gen_session_id(self) -> str:
         """
         Generate a new session ID.
@@ -0,0 +1,217 @@
+""" A module throttling failed logins per account and IP address, with their audit written to the database in batches. """
+
+import asyncio
+import hashlib
+import math
+import time
+import uuid
+from datetime import datetime
+from sanic.exceptions import SanicException
+from sqlalchemy import Uuid
+from core.cache_storage import CacheStorageManager
+from core.cache_storage.connectors.factory import make_connector
+from core.database.DALs.user.user_dal import UserDAL
+
+# Users whose failed logins are written in one transaction
+AUDIT_BATCH_SIZE = 500
+
+class LoginThrottled(SanicException):
+    """
+    Raised when an account or IP address is locked out after too many failed logins, answered with 429 Too Many Requests.
+
+    Args:
+        retry_after (int): The seconds until the lockout ends.
+    """
+    status_code = 429
+    quiet = True
+
+    def __init__(self, retry_after: int):
+        super().__init__("Too many failed logins, try again later", headers={"Retry-After": str(retry_after)})
+
+class LoginThrottle:
+    """
+    Counts failed logins per account and per IP address in sliding windows kept in the cache storage,
+    so every worker sees the same counts.
+    - Each failure is a member of the account's and the IP's failure index, expiring after `window` seconds,
+      so the live members are the failures of the last `window` seconds.
+    - An account or IP reaching its limit gets a lockout marker for `window` seconds. `check` reads both
+      markers in one round trip before the user is looked up and the password hashed.
+    - Failed logins of existing users are rolled up in memory and written to their `User` row every
+      `audit_interval` seconds, in batches, instead of one encrypted-column update per attempt.
+    """
+    def __init__(
+            self,
+            connector_type: str,
+            db_session,
+            codec: str = None,
+            batch_window: float = None,
+            window: int = 900,
+            max_account_failures: int = 5,
+            max_ip_failures: int = 50,
+            audit_interval: float = 30,
+            **kwargs
+        ):
+        """
+        Initialize the login throttle.
+
+        Args:
+            connector_type: The type of connector to use.
+            db_session: The factory of the database sessions the audit is written with.
+            codec: The name of the codec used to encode cached values. Defaults to the compact codec.
+            batch_window: Seconds single-key calls are collected for and sent as one batch. Defaults to disabled.
+            window: Seconds failed logins are counted for, and lockouts last.
+            max_account_failures: Failed logins within the window that lock an account out.
+            max_ip_failures: Failed logins within the window that lock an IP address out.
+            audit_interval: Seconds between writes of the rolled-up failed logins to the database.
+            kwargs: Additional keyword arguments to pass to the connector.
+        """
+        connector = make_connector(connector_type, **kwargs)
+
+        # No near cache, a lockout must reach every worker on its next check
+        self.storage = CacheStorageManager(connector, 'login_throttle', codec, batch_window=batch_window)
+        self.db_session = db_session
+        self.window = window
+        self.limits = {'account': max_account_failures, 'ip': max_ip_failures}
+
+        self.audit_interval = audit_interval
+        # Failed logins waiting for the next audit write, per user: count, last time and last IP address
+        self.pending_audit = {}
+        self.audit_task = None
+
+    async def __async__init__(self) -> None:
+        """
+        Initialize the login throttle.
+        """
+        await self.storage.__async__init__()
+
+    def _keys(self, email, ip_address: str | None) -> dict:
+        """
+        The throttled identities of a login attempt, the account by a digest of its email.
+        """
+        keys = {'account': hashlib.blake2b(str(email).lower().encode(), digest_size=16).hexdigest()}
+        if ip_address:
+            keys['ip'] = ip_address
+        return keys
+
+    async def check(self, email, ip_address: str | None) -> None:
+        """
+        Reject a login attempt early if its account or IP address is locked out.
+
+        Args:
+            email: The email the login is attempted for.
+            ip_address: The IP address the attempt came from.
+
+        Raises:
+            LoginThrottled: If the account or IP address is locked out.
+        """
+        locks = await self.storage.get_many([f'lock:{kind}:{key}' for kind, key in self._keys(email, ip_address).items()])
+        if locks:
+            retry_after = max(locks.values()) - time.time()
+            raise LoginThrottled(max(1, math.ceil(retry_after)))
+
+    async def _count_failure(self, kind: str, key: str, member: str, now: float) -> None:
+        index = f'failures:{kind}:{key}'
+        await self.storage.index_add(index, member, ttl=self.window)
+        if len(await self.storage.index_members(index)) >= self.limits[kind]:
+            await self.storage.set(f'lock:{kind}:{key}', now + self.window, ttl=self.window)
+
+    async def failed(self, email, ip_address: str | None, user_uuid: Uuid = None) -> None:
+        """
+        Record a failed login attempt, locking its account or IP address out once over their limit.
+
+        Args:
+            email: The email the login was attempted for.
+            ip_address: The IP address the attempt came from.
+            user_uuid: The UUID of the user, if the email belongs to one, to audit the attempt for.
+        """
+        now = time.time()
+        member = f'{now:.6f}:{uuid.uuid4().hex[:8]}'
+        await asyncio.gather(*(
+            self._count_failure(kind, key, member, now)
+            for kind, key in self._keys(email, ip_address).items()
+        ))
+        if user_uuid is not None:
+            self.audit(user_uuid, ip_address)
+
+    async def succeeded(self, email) -> None:
+        """
+        Clear the failed logins of an account after a successful login. Those of the IP address are kept.
+
+        Args:
+            email: The email of the account.
+        """
+        await self.storage.index_pop(f"failures:account:{self._keys(email, None)['account']}")
+
+    def audit(self, user_uuid: Uuid, ip_address: str | None) -> None:
+        """
+        Queue a failed login for the audit columns of its user.
+        - No write happens here, queued failures are written in batches every `audit_interval` seconds.
+
+        Args:
+            user_uuid: The UUID of the user.
+            ip_address: The IP address the attempt came from.
+        """
+        count, _, _ = self.pending_audit.get(user_uuid, (0, None, None))
+        self.pending_audit[user_uuid] = (count + 1, datetime.now(), ip_address)
+        if self.audit_task is None:
+            self.audit_task = asyncio.create_task(self._audit_periodically())
+
+    async def flush_audit(self) -> None:
+        """
+        Write the queued failed logins to the `User` rows: the attempt count is increased by the
+        failures since the last write, the last failure time and IP address are set to the latest.
+        """
+        pending, self.pending_audit = self.pending_audit, {}
+        user_uuids = list(pending)
+        for start in range(0, len(user_uuids), AUDIT_BATCH_SIZE):
+            batch = user_uuids[start:start + AUDIT_BATCH_SIZE]
+            try:
+                async with self.db_session() as session:
+                    async with session.begin():
+                        user_dal = UserDAL(session)
+                        for user in await user_dal.get_many(batch):
+                            count, failed_at, ip_address = pending[user.uuid]
+                            user.failed_login_attempts = (user.failed_login_attempts or 0) + count
+                            user.last_failed_login = failed_at
+                            user.last_failed_login_ip = ip_address
+            except BaseException:
+                # Queued again for the next write, merged with the failures since, also when cancelled by `close`
+                for user_uuid in user_uuids[start:]:
+                    count, failed_at, ip_address = pending[user_uuid]
+                    newer = self.pending_audit.get(user_uuid)
+                    if newer is not None:
+                        count, failed_at, ip_address = count + newer[0], newer[1], newer[2]
+                    self.pending_audit[user_uuid] = (count, failed_at, ip_address)
+                raise
+
+    async def _audit_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.audit_interval)
+            try:
+                await self.flush_audit()
+            except Exception:
+                # The database is unavailable, the failures stay queued for the next write
+                pass
+
+    async def clear_expired(self) -> None:
+        """
+        Clear expired failures and lockouts from the cache.
+        """
+        await self.storage.clear_expired()
+
+    async def close(self) -> None:
+        """
+        Write the queued audit and release the connections held by the throttle storage.
+        """
+        try:
+            if self.audit_task is not None:
+                audit_task, self.audit_task = self.audit_task, None
+                audit_task.cancel()
+                # A periodic write interrupted by the cancel re-queues its failures before the final one
+                try:
+                    await audit_task
+                except asyncio.CancelledError:
+                    pass
+                await self.flush_audit()
+        finally:
+            await self.storage.close()
@@ -0,0 +1,136 @@
+""" A module providing the immutable user snapshot cached for the request path, and its codec. """
+
+import struct
+import uuid
+from core.cache_storage.codecs import BaseCodec, CODECS, register_codec
+from core.database.models.user.User import User
+
+# version, uuid, staff level, max sessions, flags, followed by the UTF-8 username
+SNAPSHOT = struct.Struct('<B16siiB')
+# Values other than snapshots cached in the same instance, encoded with the compact codec
+OTHER = 0
+
+ROOT_ADMIN = 0x01
+MFA_ENABLED = 0x02
+EMAIL_VERIFIED = 0x04
+
+class UserSnapshot:
+    """
+        An immutable copy of the user fields the request path needs, cached instead of the ORM `User`.
+        - It holds no encrypted columns and no ORM state, and is not tied to a database session.
+        - Bump `version` when the fields change, entries written with another version are reloaded.
+
+        Args:
+            uuid (UUID): The UUID of the user.
+            username (str): The username of the user.
+            staff_level (int): The staff level of the user.
+            is_root_admin (bool): True if the user is a root admin, False otherwise.
+            is_mfa_enabled (bool): True if the user has MFA enabled, False otherwise.
+            is_email_verified (bool): True if the user has verified their email, False otherwise.
+            max_sessions (int): The maximum number of sessions the user can have.
+    """
+    __slots__ = ('uuid', 'username', 'staff_level', 'is_root_admin', 'is_mfa_enabled', 'is_email_verified', 'max_sessions')
+
+    version = 1
+
+    def __init__(
+            self,
+            uuid: uuid.UUID,
+            username: str,
+            staff_level: int,
+            is_root_admin: bool,
+            is_mfa_enabled: bool,
+            is_email_verified: bool,
+            max_sessions: int,
+        ):
+        set_field = object.__setattr__
+        set_field(self, 'uuid', uuid)
+        set_field(self, 'username', username)
+        set_field(self, 'staff_level', staff_level)
+        set_field(self, 'is_root_admin', is_root_admin)
+        set_field(self, 'is_mfa_enabled', is_mfa_enabled)
+        set_field(self, 'is_email_verified', is_email_verified)
+        set_field(self, 'max_sessions', max_sessions)
+
+    @classmethod
+    def from_user(cls, user: User) -> 'UserSnapshot':
+        """
+            Take a snapshot of a user.
+
+            Args:
+                user (User): The user, or another snapshot.
+
+            Returns:
+                UserSnapshot: The snapshot of the user.
+        """
+        if isinstance(user, cls):
+            return user
+        return cls(
+            user.uuid,
+            user.username,
+            int(user.staff_level or 0),
+            bool(user.is_root_admin),
+            bool(user.is_mfa_enabled),
+            bool(user.is_email_verified),
+            user.max_sessions,
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError('UserSnapshot is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('UserSnapshot is immutable')
+
+    def __reduce__(self):
+        # Pickled field by field, the default slots state would be restored through __setattr__
+        return (type(self), tuple(getattr(self, field) for field in self.__slots__))
+
+    def __eq__(self, other):
+        if type(other) is not UserSnapshot:
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __hash__(self):
+        return hash(self.uuid)
+
+    def __repr__(self):
+        return f'UserSnapshot(uuid={self.uuid!r}, username={self.username!r})'
+
+class UserSnapshotCodec(BaseCodec):
+    """
+        Encodes user snapshots in a fixed binary layout, about 30 bytes plus the username.
+        - Other values are encoded with the compact codec, so the codec can be used for the whole users instance.
+        - Snapshots written with another version decode as missing, to be reloaded.
+    """
+    codec_id = 4
+    name = 'user_snapshot'
+
+    def encode(self, value) -> bytes:
+        if type(value) is not UserSnapshot:
+            return bytes((OTHER,)) + CODECS['compact'].encode(value)
+        flags = (
+            (ROOT_ADMIN if value.is_root_admin else 0)
+            | (MFA_ENABLED if value.is_mfa_enabled else 0)
+            | (EMAIL_VERIFIED if value.is_email_verified else 0)
+        )
+        return SNAPSHOT.pack(
+            UserSnapshot.version, value.uuid.bytes, value.staff_level, value.max_sessions, flags
+        ) + value.username.encode()
+
+    def decode(self, data: bytes):
+        if data[0] == OTHER:
+            return CODECS['compact'].decode(data[1:])
+        if data[0] != UserSnapshot.version:
+            return None
+        _, uuid_bytes, staff_level, max_sessions, flags = SNAPSHOT.unpack_from(data)
+        return UserSnapshot(
+            uuid.UUID(bytes=bytes(uuid_bytes)),
+            bytes(data[SNAPSHOT.size:]).decode(),
+            staff_level,
+            bool(flags & ROOT_ADMIN),
+            bool(flags & MFA_ENABLED),
+            bool(flags & EMAIL_VERIFIED),
+            max_sessions,
+        )
+
+register_codec(UserSnapshotCodec())
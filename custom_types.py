@@ -1,7 +1,10 @@
 from dataclasses import dataclass
 from core.cache import CacheManager
+from core.cookies import CookieSigner
 from core.env_manager import EnvManager
+from core.hashing import HashingPool
 from core.sessions import SessionManager
+from core.throttle import LoginThrottle
 from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import ConcreteBase
@@ -30,8 +33,16 @@ class MyTypedContext:
             env_manager: core.env_manager.EnvManager
             session_manager: core.session_manager.SessionManager
             cache_manager: core.cache_manager.CacheManager
+            identity_cookie: str
+            cookie_signer: core.cookies.CookieSigner
+            hashing_pool: core.hashing.HashingPool
+            login_throttle: core.throttle.LoginThrottle
     """
     db: DatabaseContext
     env_manager: EnvManager
     session_manager: SessionManager
     cache_manager: CacheManager
+    identity_cookie: str
+    cookie_signer: CookieSigner
+    hashing_pool: HashingPool
+    login_throttle: LoginThrottle
@@ -2,6 +2,7 @@ from sanic import Sanic
 from blueprints import blueprints
 from core.env_manager import EnvManager
 from core.server_events import before_server_start, after_server_start, before_server_stop
+from core.authentication import refresh_session_cookie
 from sanic.config import Config
 
 from custom_types import MyTypedContext
@@ -18,6 +19,8 @@ app.register_listener(before_server_start, "before_server_start")
 app.register_listener(after_server_start, "after_server_start")
 app.register_listener(before_server_stop, "before_server_stop")
 
+app.register_middleware(refresh_session_cookie, "response")
+
 for blueprint in blueprints:
     if blueprint.version in env_manager.get("ACTIVE_VERSIONS"):
         app.blueprint(blueprint)